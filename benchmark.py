@@ -0,0 +1,364 @@
+"""Benchmark of the star schema load on synthetic data
+This script generates synthetic Song and Event json files (configurable number
+of users, songs, artists and events, with a Zipf like skew of song plays),
+loads them into a local PostgreSQL stand-in through the statements of
+sql_queries.py and reports throughput and latency of every phase at one or
+more data scales. Results are appended to a json lines file together with the
+git revision, so regressions between versions are visible. The daily plays
+queries are timed both on the Fact table and on the rollups of rollups.py.
+
+Usage:
+    python benchmark.py --config bench.cfg --scales 10000,100000
+
+bench.cfg needs a [DB] section like dwh.cfg pointing at the PostgreSQL
+stand-in.
+
+This file can also be imported as a module and contains the following
+functions:
+
+    * generate_data - Writing synthetic Song and Event json files.
+    * timed - Running one benchmark phase and measuring it.
+    * run_benchmark - Loading one data scale and measuring every phase.
+    * save_results - Appending results to the results file.
+    * compare_results - Comparing results with the previous run per phase.
+    * main - the main function of the script
+"""
+
+# Importing system libraries
+import argparse
+import configparser
+import itertools
+import json
+import os
+import random
+import string
+import subprocess
+import tempfile
+import time
+
+# Importing user libraries
+from db_connection import connect
+import local_loader
+from pg_compat import to_postgres
+from rollups import compare_latency, refresh_rollups
+from sql_queries import create_table_queries, drop_table_queries, insert_table_nodes, rollup_tables
+
+# Songplay insert joining on title, duration and artist name, as used before
+# the song lookup, kept to measure the lookup join against it
+SONGPLAY_TITLE_JOIN_INSERT = ("""insert into songs_plays_fact
+                                (start_time, user_id, level, song_id, artist_id,
+                                 session_id, location, user_agent)
+                                select TIMESTAMP 'epoch' + ts/1000 *INTERVAL '1 second',
+                                       user_id, level, s.song_id, a.artist_id,
+                                       session_id, e.location, user_agent
+                                from events_stg e join songs_dim s
+                                on (e.song = s.title and e.length = s.duration)
+                                join artists_dim a
+                                on (a.name = e.artist)
+                                where e.page = 'NextSong';
+                             """)
+
+PAGES = ['NextSong'] * 8 + ['Home', 'Logout', 'Login', 'Settings']
+EVENT_DAY = 1541030400000  # 2018-11-01 in epoch milliseconds
+
+
+def _word(rnd, length=8):
+    return ''.join(rnd.choice(string.ascii_lowercase) for _ in range(length)).title()
+
+
+def generate_data(directory, users=100, songs=1000, artists=200, events=10000,
+                  skew=1.1, match_rate=0.8, seed=42):
+    """Writing synthetic Song and Event json files.
+
+    Song files hold one song each (like the song data set), event files hold
+    one json document per line for each day (like the log data set).
+
+    Parameters
+    ___________
+        directory  : str
+                    Target directory, song_data and log_data are created below
+        users      : int
+                    Number of distinct users
+        songs      : int
+                    Number of songs
+        artists    : int
+                    Number of artists
+        events     : int
+                    Number of log events
+        skew       : float
+                    Zipf exponent of song popularity, 0 for uniform plays
+        match_rate : float
+                    Share of played songs that exist in the song data
+        seed       : int
+                    Random seed, same seed gives the same data
+
+    Returns
+    ___________
+        tuple - (song_data directory, log_data directory)
+    """
+
+    rnd = random.Random(seed)
+    song_dir = os.path.join(directory, 'song_data')
+    log_dir = os.path.join(directory, 'log_data')
+    os.makedirs(song_dir, exist_ok=True)
+    os.makedirs(log_dir, exist_ok=True)
+
+    artist_rows = [{'artist_id': 'AR{:016d}'.format(i),
+                    'artist_name': _word(rnd) + ' ' + _word(rnd),
+                    'artist_location': rnd.choice(['', 'London', 'New York', 'Berlin']),
+                    'artist_latitude': rnd.choice([None, round(rnd.uniform(-90, 90), 5)]),
+                    'artist_longitude': rnd.choice([None, round(rnd.uniform(-180, 180), 5)])}
+                   for i in range(artists)]
+
+    song_rows = []
+    for i in range(songs):
+        artist = artist_rows[rnd.randrange(artists)]
+        song = dict(artist, num_songs=1, song_id='SO{:016d}'.format(i),
+                    title=_word(rnd) + ' ' + _word(rnd, 5),
+                    duration=round(rnd.uniform(60, 600), 2),
+                    year=rnd.choice([0] + list(range(1960, 2019))))
+        song_rows.append(song)
+        with open(os.path.join(song_dir, song['song_id'] + '.json'), 'w') as f:
+            json.dump(song, f)
+
+    user_rows = [{'userId': i + 1, 'firstName': _word(rnd), 'lastName': _word(rnd),
+                  'gender': rnd.choice('MF'), 'level': rnd.choice(['free', 'paid']),
+                  'location': rnd.choice(['Austin, TX', 'Boston, MA', 'Denver, CO']),
+                  'userAgent': 'Mozilla/5.0', 'registration': 1540000000000.0 + i}
+                 for i in range(users)]
+
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) ** skew for rank in range(songs)))
+    days = {}
+    for i in range(events):
+        user = rnd.choice(user_rows)
+        page = rnd.choice(PAGES)
+        event = dict(user, auth='Logged In', method='PUT' if page == 'NextSong' else 'GET',
+                     page=page, status=200, itemInSession=i % 100,
+                     sessionId=rnd.randrange(1, 5000),
+                     ts=EVENT_DAY + rnd.randrange(30 * 86400000),
+                     artist=None, song=None, length=None)
+        if page == 'NextSong':
+            if rnd.random() < match_rate:
+                song = rnd.choices(song_rows, cum_weights=cum_weights)[0]
+                event.update(artist=song['artist_name'], song=song['title'],
+                             length=song['duration'])
+            else:
+                event.update(artist=_word(rnd), song=_word(rnd),
+                             length=round(rnd.uniform(60, 600), 2))
+        day = time.strftime('%Y-%m-%d', time.gmtime(event['ts'] // 1000))
+        days.setdefault(day, []).append(event)
+
+    for day, day_events in days.items():
+        with open(os.path.join(log_dir, day + '-events.json'), 'w') as f:
+            for event in sorted(day_events, key=lambda e: e['ts']):
+                f.write(json.dumps(event) + '\n')
+
+    return song_dir, log_dir
+
+
+def timed(phase, func, *args):
+    """Running one benchmark phase and measuring it.
+
+    Parameters
+    ___________
+        phase : str
+               Name of the phase
+        func  : callable
+               Runs the phase and returns the number of rows it processed
+
+    Returns
+    ___________
+        dict - phase, seconds, rows and rows_per_second
+    """
+
+    start = time.time()
+    rows = func(*args)
+    seconds = time.time() - start
+    result = {'phase': phase, 'seconds': round(seconds, 4), 'rows': rows,
+              'rows_per_second': round(rows / seconds, 1) if rows and seconds else None}
+    print("  {:<25} {:>9.3f}s {:>10} rows {:>12} rows/s"
+          .format(phase, seconds, rows if rows is not None else '-',
+                  result['rows_per_second'] or '-'))
+    return result
+
+
+def _execute_all(cur, queries):
+    rows = 0
+    for query in queries:
+        cur.execute(to_postgres(query))
+        rows += max(cur.rowcount, 0)
+    return rows
+
+
+def _refresh_rollups(cur):
+    """Refreshing the rollups, returning the number of rollup rows."""
+
+    refresh_rollups(cur, rewrite=to_postgres)
+    rows = 0
+    for table, _, _ in rollup_tables:
+        cur.execute("select count(*) from {};".format(table))
+        rows += cur.fetchone()[0]
+    return rows
+
+
+def run_benchmark(conn, events, users=None, songs=None, artists=None, skew=1.1, workers=1):
+    """Loading one data scale and measuring every phase.
+
+    Parameters
+    ___________
+        conn    : psycopg2 connection object
+                 Connection to the PostgreSQL stand-in (autocommit)
+        events  : int
+                 Number of log events, the other sizes default to a share of it
+        users   : int
+                 Number of users
+        songs   : int
+                 Number of songs
+        artists : int
+                 Number of artists
+        skew    : float
+                 Zipf exponent of song popularity
+        workers : int
+                 Number of json parsing processes
+
+    Returns
+    ___________
+        dict - sizes and the measured phases
+    """
+
+    users = users or max(10, events // 100)
+    songs = songs or max(10, events // 10)
+    artists = artists or max(5, songs // 5)
+    print("Scale: {} events, {} users, {} songs, {} artists".format(events, users, songs, artists))
+
+    cur = conn.cursor()
+    phases = []
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.time()
+        song_dir, log_dir = generate_data(directory, users, songs, artists, events, skew)
+        print("  generated data in {:.2f}s".format(time.time() - start))
+
+        phases.append(timed('drop', _execute_all, cur, drop_table_queries))
+        phases.append(timed('create', _execute_all, cur, create_table_queries))
+        phases.append(timed('copy events_stg', lambda: local_loader.load_directory(
+            cur, conn, 'events_stg', local_loader.EVENTS_COLUMNS,
+            local_loader.parse_jsonpaths(local_loader.EVENTS_JSONPATHS), log_dir, workers)['rows']))
+        phases.append(timed('copy songs_stg', lambda: local_loader.load_directory(
+            cur, conn, 'songs_stg', local_loader.SONGS_COLUMNS,
+            [(c,) for c in local_loader.SONGS_COLUMNS], song_dir, workers)['rows']))
+        for name, query, _, _ in insert_table_nodes:
+            phases.append(timed(name, _execute_all, cur, [query]))
+        
+        # Daily plays from the rollups against aggregating the Fact table
+        phases.append(timed('refresh_rollups', _refresh_rollups, cur))
+        for result in compare_latency(cur):
+            for source in ('fact', 'rollup'):
+                phases.append({'phase': '{} {}'.format(result['query'], source),
+                               'seconds': result[source + '_seconds'], 'rows': result['rows'],
+                               'rows_per_second': None})
+        
+        # Same fact load through the old title/duration/artist name join
+        cur.execute("delete from songs_plays_fact;")
+        phases.append(timed('songplay_title_join', _execute_all, cur,
+                            [SONGPLAY_TITLE_JOIN_INSERT]))
+    cur.close()
+
+    return {'events': events, 'users': users, 'songs': songs, 'artists': artists,
+            'skew': skew, 'phases': phases}
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(path, results):
+    """Appending benchmark results to a json lines file.
+
+    Parameters
+    ___________
+        path    : str
+                 Results file
+        results : list
+                 Output of run_benchmark per scale
+
+    Returns
+    ___________
+        None
+    """
+
+    revision = _git_revision()
+    timestamp = time.strftime('%Y-%m-%dT%H:%M:%S')
+    with open(path, 'a') as f:
+        for result in results:
+            f.write(json.dumps(dict(result, revision=revision, timestamp=timestamp)) + '\n')
+
+
+def compare_results(path, results, threshold=0.2):
+    """Comparing results with the latest earlier run of the same scale.
+
+    Parameters
+    ___________
+        path      : str
+                   Results file
+        results   : list
+                   Output of run_benchmark per scale, not saved yet
+        threshold : float
+                   Relative slowdown reported as a regression
+
+    Returns
+    ___________
+        list - (events, phase, previous seconds, current seconds) of regressions
+    """
+
+    if not os.path.exists(path):
+        return []
+    previous = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                result = json.loads(line)
+                previous[result['events']] = result
+
+    regressions = []
+    for result in results:
+        before = previous.get(result['events'])
+        if before is None:
+            continue
+        before_phases = {p['phase']: p['seconds'] for p in before['phases']}
+        for phase in result['phases']:
+            old = before_phases.get(phase['phase'])
+            if old and phase['seconds'] > old * (1 + threshold):
+                regressions.append((result['events'], phase['phase'], old, phase['seconds']))
+                print("Regression at {} events, {}: {:.3f}s -> {:.3f}s (revision {})"
+                      .format(result['events'], phase['phase'], old, phase['seconds'],
+                              before.get('revision')))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the star schema load on synthetic data.')
+    parser.add_argument('--config', default='dwh.cfg', help='config with a [DB] section for PostgreSQL')
+    parser.add_argument('--scales', default='10000,100000', help='comma separated event counts')
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of song plays')
+    parser.add_argument('--workers', type=int, default=1, help='json parsing processes')
+    parser.add_argument('--results', default='benchmark_results.jsonl', help='results file')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    conn = connect(config)
+
+    results = [run_benchmark(conn, int(events), skew=args.skew, workers=args.workers)
+               for events in args.scales.split(',')]
+    conn.close()
+
+    compare_results(args.results, results)
+    save_results(args.results, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Checkpointing of ETL steps so a failed run can be resumed
+This script records every completed step of etl.py (COPY of each staging table,
+each Fact and Dimension insert) in the etl_checkpoints table per run id. Each
+step runs in its own transaction together with its checkpoint, so a step either
+completes and is recorded or is rolled back as a whole. A resumed run skips the
+recorded steps and only pays for the remaining ones.
+
+This file can also be imported as a module and contains the following
+functions:
+
+    * start_run - Starting a new run or picking up an unfinished one.
+    * record_step - Recording a completed step inside the step's transaction.
+    * run_step - Running one step in a transaction unless it completed before.
+    * finish_run - Marking a run as finished.
+"""
+
+# Importing system libraries
+import time
+
+# Importing user libraries
+from sql_queries import (checkpoint_insert, checkpoint_select, checkpoint_table_create,
+                         checkpoint_unfinished_run_select)
+
+
+def start_run(cur, conn, run_id=None, resume=False):
+    """Starting a new run or picking up an unfinished one.
+
+    Parameters
+    ___________
+        cur    : psycopg2 cursor object
+                Cursor object for sparkifydb
+        conn   : psycopg2 connection object
+                Connection object for sparkifydb
+        run_id : str
+                Run to resume or start, generated when not given
+        resume : bool
+                Resume run_id, or the latest unfinished run if run_id is None
+
+    Returns
+    ___________
+        tuple - (run id, set of completed steps)
+    """
+
+    cur.execute(checkpoint_table_create)
+
+    if resume and run_id is None:
+        cur.execute(checkpoint_unfinished_run_select)
+        row = cur.fetchone()
+        if row is None:
+            print("No unfinished run to resume, starting a new run")
+        else:
+            run_id = row[0]
+
+    if run_id is None:
+        run_id = time.strftime('%Y%m%d%H%M%S')
+
+    cur.execute(checkpoint_select, (run_id,))
+    completed = {row[0] for row in cur.fetchall()}
+    if 'started' not in completed:
+        cur.execute(checkpoint_insert, (run_id, 'started'))
+    conn.commit()
+
+    completed.discard('started')
+    if completed:
+        print("Resuming run {}, skipping {}".format(run_id, ', '.join(sorted(completed))))
+    return run_id, completed
+
+
+def record_step(cur, run_id, step):
+    """Recording a completed step; call inside the step's transaction.
+
+    Parameters
+    ___________
+        cur    : psycopg2 cursor object
+                Cursor of the step's transaction
+        run_id : str
+                Run the step belongs to
+        step   : str
+                Name of the step
+
+    Returns
+    ___________
+        None
+    """
+
+    cur.execute(checkpoint_insert, (run_id, step))
+
+
+def run_step(conn, run_id, step, completed, func):
+    """Running one step in a transaction unless it completed before.
+
+    Parameters
+    ___________
+        conn      : psycopg2 connection object
+                   Connection object for sparkifydb
+        run_id    : str
+                   Run the step belongs to
+        step      : str
+                   Name of the step
+        completed : set
+                   Steps completed by earlier attempts, the step is added
+        func      : callable
+                   Called with a cursor, runs the step's statements
+
+    Returns
+    ___________
+        bool - True if the step ran, False if it was skipped
+    """
+
+    if step in completed:
+        return False
+
+    autocommit = conn.autocommit
+    conn.autocommit = False
+    try:
+        cur = conn.cursor()
+        try:
+            func(cur)
+            record_step(cur, run_id, step)
+        finally:
+            cur.close()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = autocommit
+
+    completed.add(step)
+    return True
+
+
+def finish_run(cur, conn, run_id):
+    """Marking a run as finished so it is not resumed again.
+
+    Parameters
+    ___________
+        cur    : psycopg2 cursor object
+                Cursor object for sparkifydb
+        conn   : psycopg2 connection object
+                Connection object for sparkifydb
+        run_id : str
+                Finished run
+
+    Returns
+    ___________
+        None
+    """
+
+    cur.execute(checkpoint_insert, (run_id, 'finished'))
+    conn.commit()
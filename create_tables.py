@@ -1,19 +1,57 @@
 """ Drop and re-create tables in redshift Database 
 This script delete table (if exists) and then re-creates the tables.
+
+Run with --sync to only apply the changes between the live catalog and the
+CREATE TABLE statements of sql_queries.py: missing tables are created, wider
+varchar columns are altered and new nullable columns added in place, and
+tables whose columns changed otherwise are re-created with their rows copied
+over. Created and re-created tables change in one transaction (one commit
+instead of one per statement), or with --parallel one transaction per table
+on concurrent connections. A deploy without schema changes runs a single
+catalog query.
+--dry-run prints the planned statements without running them. Distribution
+and sort keys are not compared.
+
 This file can also be imported as a module and contains the following
 functions:
 
     * drop_tables - Dropping Tables (if exist)
     * create_tables - Creating Tables (if not exist)
+    * read_catalog - Reading the columns of the existing tables
+    * plan_schema_sync - Diffing the catalog against the CREATE TABLE statements
+    * apply_schema_sync - Running the planned DDL
     * main - the main function of the script
 """
 
 # Importing system libraries
+import argparse
 import configparser
-import psycopg2
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Importing user defined libraries
-from sql_queries import create_table_queries, drop_table_queries
+from db_connection import ConnectionPool, connect
+import instrumentation
+from schema_advisor import parse_create
+from sql_queries import catalog_columns_select, create_table_queries, drop_table_queries
+
+# Catalog names of the type names used in sql_queries.py
+_TYPE_NAMES = {
+    'varchar': 'character varying',
+    'char': 'character',
+    'int': 'integer',
+    'int4': 'integer',
+    'int2': 'smallint',
+    'int8': 'bigint',
+    'float4': 'real',
+    'float': 'double precision',
+    'float8': 'double precision',
+    'bool': 'boolean',
+    'timestamp': 'timestamp without time zone',
+    'decimal': 'numeric',
+}
 
 def drop_tables(cur, conn):
     """Dropping tables from Database. 
@@ -53,25 +91,233 @@ def create_tables(cur, conn):
         cur.execute(query)
         conn.commit()
 
+def _catalog_type(column_type):
+    """Catalog data type and length of a column type of sql_queries.py."""
+
+    match = re.match(r'(\w+(?:\s+precision)?)\s*(?:\(\s*(\d+)[^)]*\))?', column_type)
+    name = _TYPE_NAMES.get(match.group(1), match.group(1))
+    length = int(match.group(2)) if match.group(2) and name.startswith('character') else None
+    return name, length
+
+def read_catalog(cur):
+    """Reading the columns of the existing tables.
+
+    Parameters
+    ___________
+        cur : psycopg2 cursor object
+            Cursor object for DB
+
+    Returns
+    ___________
+        dict - table name to list of (column, data type, length, nullable)
+    """
+
+    cur.execute(catalog_columns_select)
+    catalog = {}
+    for table, column, data_type, length, nullable in cur.fetchall():
+        catalog.setdefault(table, []).append((column, data_type, length, nullable == 'YES'))
+    return catalog
+
+def _rebuild_statements(table, query, existing, columns):
+    """Statements re-creating a table with its rows copied over.
+
+    The new table is created as <table>_sync, filled with the columns both
+    versions have (identity columns are generated again) and renamed, so the
+    rows survive the change. A copy failing, e.g. on a narrowed column or a
+    new not null column, rolls back the whole transaction.
+    """
+
+    shadow = table + '_sync'
+    create = re.sub(r'(create\s+table\s+(?:if\s+not\s+exists\s+)?){}\b'.format(table),
+                    r'\g<1>' + shadow, query, count=1, flags=re.IGNORECASE)
+    names = {name for name, _, _, _ in existing}
+    copied = [name for name, _, rest in columns
+              if name.lower() in names and not re.search(r'\bidentity\b', rest, re.IGNORECASE)]
+    statements = ["drop table if exists {};".format(shadow), create]
+    if copied:
+        statements.append("insert into {0} ({1}) select {1} from {2};".format(shadow, ', '.join(copied), table))
+    statements += ["drop table {};".format(table),
+                   "alter table {} rename to {};".format(shadow, table)]
+    return statements
+
+def plan_schema_sync(catalog, queries=create_table_queries):
+    """Diffing the live catalog against the CREATE TABLE statements.
+
+    Missing tables are created. Wider varchar columns and nullable columns
+    appended at the end are changed in place ('alter columns'). Any other
+    change re-creates the table and copies its rows into it ('rebuild'),
+    so no data is dropped.
+
+    Parameters
+    ___________
+        catalog : dict
+            Output of read_catalog
+        queries : list
+            CREATE TABLE statements
+
+    Returns
+    ___________
+        list - (table, action, statements) for every table needing DDL,
+               action is 'create', 'alter columns' or 'rebuild'
+    """
+
+    plan = []
+    for query in queries:
+        table, columns = parse_create(query)
+        expected = []
+        for name, column_type, rest in columns:
+            data_type, length = _catalog_type(column_type)
+            nullable = not re.search(r'\bnot\s+null\b|\bprimary\s+key\b', rest, re.IGNORECASE)
+            expected.append((name.lower(), data_type, length, nullable))
+
+        existing = catalog.get(table)
+        if existing is None:
+            plan.append((table, 'create', [query]))
+            continue
+
+        existing = [(name, data_type, length, nullable) for name, data_type, length, nullable in existing]
+        if existing == expected:
+            continue
+
+        # Wider varchar columns and nullable columns appended at the end can be changed in place
+        widened = []
+        in_place = len(expected) >= len(existing)
+        for old, new in zip(existing, expected):
+            if old == new:
+                continue
+            if (old[0] == new[0] and old[1] == new[1] == 'character varying' and old[3] == new[3]
+                    and old[2] is not None and new[2] is not None and new[2] > old[2]):
+                widened.append(new)
+            else:
+                in_place = False
+        added = expected[len(existing):]
+        if in_place and all(nullable for _, _, _, nullable in added):
+            definitions = {name.lower(): '{} {}'.format(name, column_type) for name, column_type, _ in columns}
+            plan.append((table, 'alter columns',
+                         ["alter table {} alter column {} type varchar({});".format(table, name, length)
+                          for name, _, length, _ in widened] +
+                         ["alter table {} add column {};".format(table, definitions[name])
+                          for name, _, _, _ in added]))
+        else:
+            plan.append((table, 'rebuild', _rebuild_statements(table, query, existing, columns)))
+    return plan
+
+def _run_in_transaction(conn, statements):
+    """Running statements in one transaction."""
+
+    autocommit = conn.autocommit
+    conn.autocommit = False
+    try:
+        cur = conn.cursor()
+        for statement in statements:
+            cur.execute(statement)
+        cur.close()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = autocommit
+
+def _run_autocommit(conn, statements):
+    """Running statements one by one outside a transaction block."""
+
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        cur = conn.cursor()
+        for statement in statements:
+            cur.execute(statement)
+        cur.close()
+    finally:
+        conn.autocommit = autocommit
+
+def _apply_table(conn, action, statements):
+    """Running the planned DDL of one table."""
+
+    # Redshift does not run ALTER COLUMN ... TYPE inside a transaction block
+    if action == 'alter columns':
+        _run_autocommit(conn, statements)
+    else:
+        _run_in_transaction(conn, statements)
+
+def apply_schema_sync(plan, conn=None, pool=None, max_workers=4):
+    """Running the planned DDL.
+
+    Created and rebuilt tables change in one transaction, column changes run
+    statement by statement as Redshift does not allow ALTER COLUMN in a
+    transaction block.
+
+    Parameters
+    ___________
+        plan : list
+            Output of plan_schema_sync
+        conn : psycopg2 connection object
+            Runs the statements of all created and rebuilt tables in one
+            transaction, then the column changes
+        pool : db_connection.ConnectionPool
+            Used instead of conn to change each table on its own connection,
+            tables in parallel
+        max_workers : int
+            Tables changed at the same time with a pool
+
+    Returns
+    ___________
+        None
+    """
+
+    if pool is None:
+        _run_in_transaction(conn, [statement for _, action, statements in plan
+                                   if action != 'alter columns' for statement in statements])
+        _run_autocommit(conn, [statement for _, action, statements in plan
+                               if action == 'alter columns' for statement in statements])
+        return
+
+    def apply(entry):
+        _, action, statements = entry
+        with pool.connection() as table_conn:
+            _apply_table(table_conn, action, statements)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, pool.maxconn)) as executor:
+        list(executor.map(apply, plan))
+
 def main():
+    parser = argparse.ArgumentParser(description='Drop and re-create, or sync, the sparkifydb tables.')
+    parser.add_argument('--sync', action='store_true', help='only apply the changes to the live schema')
+    parser.add_argument('--parallel', action='store_true', help='sync tables concurrently, one transaction each')
+    parser.add_argument('--dry-run', action='store_true', help='print the sync statements only')
+    args = parser.parse_args()
     
     # Intialising and loading config
     config = configparser.ConfigParser()
     config.read('dwh.cfg')
     
-    # Opening DB connecion
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}"
-                            .format(config.get('DB','HOST'),
-                                    config.get('DB','DB_NAME'), 
-                                    config.get('DB','DB_USER'),
-                                    config.get('DB','DB_PASSWORD'),
-                                    config.get('DB','DB_PORT'),
-                                   )
-                           )
-    
-    conn.set_session(autocommit=True)
+    # Opening DB connecion (retried with backoff, autocommit)
+    conn = connect(config)
     
     cur = conn.cursor()
+
+    if args.sync:
+        try:
+            plan = plan_schema_sync(read_catalog(cur))
+            for table, action, statements in plan:
+                print("-- {}: {}".format(table, action))
+                for statement in statements:
+                    print(statement.strip())
+            if not plan:
+                print("Schema is up to date")
+            elif not args.dry_run:
+                pool = ConnectionPool(config) if args.parallel else None
+                apply_schema_sync(plan, conn, pool)
+                if pool is not None:
+                    pool.closeall()
+        except Exception as e:
+            print("Error while syncing tables; error message " + str(e))
+            cur.close()
+            conn.close()
+            sys.exit(1)
+        conn.close()
+        return
     
     # Dropping existing tables 
     try:
@@ -91,6 +337,9 @@ def main():
         conn.close()
         sys.exit(1)
     
+    # Summarising per statement timings (when [LOG] STATEMENT_LOG is set)
+    instrumentation.report(config, conn, 'create_tables-' + time.strftime('%Y%m%d%H%M%S'))
+    
     # Closing the connection
     conn.close()
 
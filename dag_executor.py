@@ -0,0 +1,153 @@
+"""Dependency aware parallel executor for SQL statements.
+This script runs a set of SQL statements as a DAG. Every statement declares
+the tables it reads and writes; a statement is started only once every
+statement writing one of its input tables has finished. Independent statements
+run concurrently, each on a connection borrowed for the statement.
+
+This file can also be imported as a module and contains the following
+functions:
+
+    * build_dag - Working out the upstream nodes of every statement.
+    * run_dag - Executing the statements in dependency order in parallel.
+    * print_timings - Printing per node timings of a DAG run.
+"""
+
+# Importing system libraries
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+def build_dag(nodes):
+    """Working out upstream nodes of every statement.
+    
+    A node depends on every earlier node that writes a table it reads or
+    writes, so declaration order is kept for statements touching the same
+    table.
+    
+    Parameters
+    ___________
+        nodes : list of tuples
+              (name, query, tables read, tables written) for each statement
+    
+    Returns
+    ___________
+        dict - node name mapped to the set of upstream node names
+    """
+    
+    dag = {}
+    writers = {}
+    for name, _, reads, writes in nodes:
+        if name in dag:
+            raise ValueError("Duplicate DAG node " + name)
+        dag[name] = set()
+        for table in list(reads) + list(writes):
+            dag[name].update(writers.get(table, []))
+        for table in writes:
+            writers.setdefault(table, []).append(name)
+    return dag
+
+
+def _execute_node(name, query, connect, release=None, on_success=None):
+    """Running one statement in its own transaction on a borrowed connection."""
+    
+    conn = connect()
+    autocommit = conn.autocommit
+    conn.autocommit = False
+    try:
+        start = time.time()
+        cur = conn.cursor()
+        try:
+            cur.execute(query)
+            rows = cur.rowcount
+            if on_success is not None:
+                on_success(cur, name)
+        finally:
+            cur.close()
+        conn.commit()
+        return start, time.time(), rows
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = autocommit
+        if release is None:
+            conn.close()
+        else:
+            release(conn)
+
+
+def run_dag(nodes, connect, max_workers=4, release=None, on_success=None):
+    """Executing statements in dependency order, independent ones in parallel.
+    
+    Parameters
+    ___________
+        nodes       : list of tuples
+                     (name, query, tables read, tables written) for each statement
+        connect     : callable
+                     Returns a DB API connection for one statement and must be
+                     thread safe, e.g. db_connection.ConnectionPool.getconn
+        max_workers : int
+                     Number of statements allowed to run at the same time
+        release     : callable
+                     Called with the connection after each statement, e.g.
+                     ConnectionPool.putconn, closes the connection by default
+        on_success  : callable
+                     Called with (cursor, node name) after a statement ran,
+                     inside the statement's transaction
+    
+    Returns
+    ___________
+        dict - node name mapped to a dict with start, end, elapsed and rows
+    """
+    
+    dag = build_dag(nodes)
+    queries = {name: query for name, query, _, _ in nodes}
+    pending = {name: set(upstream) for name, upstream in dag.items()}
+    timings = {}
+    
+    def _run(name):
+        return _execute_node(name, queries[name], connect, release, on_success)
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+        while pending or running:
+            for name in [n for n, up in pending.items() if not up]:
+                del pending[name]
+                running[executor.submit(_run, name)] = name
+            
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    start, end, rows = future.result()
+                except Exception as e:
+                    # Letting running statements finish before failing
+                    wait(running)
+                    raise RuntimeError("DAG node {} failed: {}".format(name, e)) from e
+                timings[name] = {'start': start, 'end': end,
+                                 'elapsed': end - start, 'rows': rows}
+                for upstream in pending.values():
+                    upstream.discard(name)
+
+    return timings
+
+
+def print_timings(timings):
+    """Printing per node timings of a DAG run, ordered by start time.
+    
+    Parameters
+    ___________
+        timings : dict
+                 Output of run_dag
+    
+    Returns
+    ___________
+        None
+    """
+    
+    if not timings:
+        return
+    origin = min(t['start'] for t in timings.values())
+    for name, t in sorted(timings.items(), key=lambda item: item[1]['start']):
+        print("{:<25} start {:>8.2f}s  elapsed {:>8.2f}s  rows {}"
+              .format(name, t['start'] - origin, t['elapsed'], t['rows']))
@@ -0,0 +1,225 @@
+"""Data quality checks of the loaded Fact and Dimension tables
+Checks are declared once in CHECKS as an aggregate over one table and a test
+of its value. All aggregates of a table are compiled into one SELECT, so every
+table is scanned once however many checks it has, and the scans of different
+tables run concurrently on pooled connections. A failed check blocks the load:
+etl.py does not swap in or finish a run whose checks failed.
+
+Incremental loads run INCREMENTAL_CHECKS on the merge transaction before it
+commits: the Fact table also holds the songplays of earlier loads, so only
+the songplays of the staged events are compared with staging.
+
+This file can also be imported as a module and contains the following
+functions:
+
+    * compile_checks - Combining the checks into one aggregate query per table.
+    * run_quality_checks - Running the scans concurrently and testing the values.
+    * print_report - Printing check results and scan timings.
+    * check_load - Running the checks and failing on any failed check.
+"""
+
+# Importing system libraries
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# FROM clause per scanned table. The Dimension keys are deduplicated before the
+# join so duplicate keys cannot inflate the Fact counts.
+TABLE_SOURCES = {
+    'songs_plays_fact': """songs_plays_fact f
+                           left join (select distinct song_id from songs_dim) s on s.song_id = f.song_id
+                           left join (select distinct artist_id from artists_dim) a on a.artist_id = f.artist_id""",
+    # Songplays at or after the earliest staged event, i.e. the ones merged by an
+    # incremental load (staged events are all newer than the previous load)
+    'staged_songplays': """songs_plays_fact f
+                           join (select min(ts) as ts from events_stg where page = 'NextSong') e
+                             on f.start_time >= TIMESTAMP 'epoch' + e.ts/1000 *INTERVAL '1 second'""",
+}
+
+# (check name, table, aggregate, test) - test is called with the aggregate's
+# value and the values of all checks, keyed by check name
+CHECKS = [
+    ('staging_next_song_events', 'events_stg',
+     "sum(case when page = 'NextSong' then 1 else 0 end)",
+     lambda value, values: (value or 0) > 0),
+    ('songplays_within_staging', 'songs_plays_fact', "count(*)",
+     lambda value, values: 0 < value <= (values['staging_next_song_events'] or 0)),
+    ('songplays_null_keys', 'songs_plays_fact',
+     "sum(case when f.start_time is null or f.user_id is null then 1 else 0 end)",
+     lambda value, values: not value),
+    ('songplays_orphan_song_id', 'songs_plays_fact',
+     "sum(case when f.song_id is not null and s.song_id is null then 1 else 0 end)",
+     lambda value, values: not value),
+    ('songplays_orphan_artist_id', 'songs_plays_fact',
+     "sum(case when f.artist_id is not null and a.artist_id is null then 1 else 0 end)",
+     lambda value, values: not value),
+    ('users_null_user_id', 'users_dim',
+     "sum(case when user_id is null then 1 else 0 end)",
+     lambda value, values: not value),
+    ('users_duplicate_user_id', 'users_dim', "count(*) - count(distinct user_id)",
+     lambda value, values: not value),
+    ('songs_null_song_id', 'songs_dim',
+     "sum(case when song_id is null then 1 else 0 end)",
+     lambda value, values: not value),
+    ('artists_null_artist_id', 'artists_dim',
+     "sum(case when artist_id is null then 1 else 0 end)",
+     lambda value, values: not value),
+    ('time_null_start_time', 'time_dim',
+     "sum(case when start_time is null then 1 else 0 end)",
+     lambda value, values: not value),
+]
+
+# Checks of an incremental merge, which may stage no events (only song files)
+# and whose events may match no song
+INCREMENTAL_CHECKS = [
+    ('staging_next_song_events', 'events_stg',
+     "sum(case when page = 'NextSong' then 1 else 0 end)",
+     lambda value, values: (value or 0) >= 0),
+    ('songplays_within_staging', 'staged_songplays', "count(*)",
+     lambda value, values: (value or 0) <= (values['staging_next_song_events'] or 0)),
+] + [check for check in CHECKS if check[0] not in ('staging_next_song_events', 'songplays_within_staging')]
+
+
+def compile_checks(checks=CHECKS):
+    """Combining the checks into one aggregate query per table.
+
+    Parameters
+    ___________
+        checks : list
+                (check name, table, aggregate, test) tuples
+
+    Returns
+    ___________
+        list - (table, query, check names in select list order)
+    """
+
+    tables = {}
+    for name, table, aggregate, _ in checks:
+        tables.setdefault(table, []).append((name, aggregate))
+
+    scans = []
+    for table, aggregates in tables.items():
+        query = "select {} from {};".format(', '.join(aggregate for _, aggregate in aggregates),
+                                            TABLE_SOURCES.get(table, table))
+        scans.append((table, query, [name for name, _ in aggregates]))
+    return scans
+
+
+def _run_scan(connect, release, table, query, rewrite):
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        start = time.time()
+        cur.execute(rewrite(query) if rewrite else query)
+        row = cur.fetchone()
+        seconds = time.time() - start
+        cur.close()
+        if not conn.autocommit:
+            conn.rollback()
+        return row, seconds
+    finally:
+        if release is not None:
+            release(conn)
+
+
+def _run_scan_on_cursor(cur, query, rewrite):
+    start = time.time()
+    cur.execute(rewrite(query) if rewrite else query)
+    return cur.fetchone(), time.time() - start
+
+
+def run_quality_checks(connect, checks=CHECKS, release=None, rewrite=None, max_workers=4, cur=None):
+    """Running the table scans concurrently and testing every check.
+
+    Parameters
+    ___________
+        connect     : callable
+                     Returns a connection, e.g. ConnectionPool.getconn
+        checks      : list
+                     (check name, table, aggregate, test) tuples
+        release     : callable
+                     Called with a connection when its scan is done
+        rewrite     : callable
+                     Applied to every query, e.g. table_swap.shadow_statement
+        max_workers : int
+                     Scans running at the same time
+        cur         : psycopg2 cursor object
+                     Runs the scans one after the other on this cursor
+                     instead, inside its (uncommitted) transaction
+
+    Returns
+    ___________
+        tuple - (list of (check name, value, passed), dict of seconds per table)
+    """
+
+    scans = compile_checks(checks)
+    values = {}
+    timings = {}
+    if cur is not None:
+        for table, query, names in scans:
+            row, timings[table] = _run_scan_on_cursor(cur, query, rewrite)
+            values.update(zip(names, row))
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [(table, names, executor.submit(_run_scan, connect, release, table, query, rewrite))
+                       for table, query, names in scans]
+        for table, names, future in futures:
+            row, timings[table] = future.result()
+            values.update(zip(names, row))
+
+    results = [(name, values[name], bool(test(values[name], values)))
+               for name, _, _, test in checks]
+    return results, timings
+
+
+def print_report(results, timings):
+    """Printing check results and scan timings.
+
+    Parameters
+    ___________
+        results : list
+                 (check name, value, passed) from run_quality_checks
+        timings : dict
+                 Seconds per scanned table
+
+    Returns
+    ___________
+        None
+    """
+
+    for name, value, passed in results:
+        print("{:<30} {:>12} {}".format(name, value if value is not None else '-',
+                                        'ok' if passed else 'FAILED'))
+    for table, seconds in sorted(timings.items(), key=lambda t: t[1], reverse=True):
+        print("scan {:<25} {:>10.3f}s".format(table, seconds))
+
+
+def check_load(connect=None, release=None, rewrite=None, max_workers=4, cur=None, checks=CHECKS):
+    """Running the checks, printing the report and failing on any failed check.
+
+    Parameters
+    ___________
+        connect     : callable
+                     Returns a connection, e.g. ConnectionPool.getconn
+        release     : callable
+                     Called with a connection when its scan is done
+        rewrite     : callable
+                     Applied to every query, e.g. table_swap.shadow_statement
+        max_workers : int
+                     Scans running at the same time
+        cur         : psycopg2 cursor object
+                     Runs the scans on this cursor instead of connect
+        checks      : list
+                     (check name, table, aggregate, test) tuples
+
+    Returns
+    ___________
+        list - (check name, value, passed)
+    """
+
+    results, timings = run_quality_checks(connect, checks, release, rewrite, max_workers, cur)
+    print_report(results, timings)
+
+    failed = [name for name, _, passed in results if not passed]
+    if failed:
+        raise ValueError("Data quality checks failed: " + ', '.join(failed))
+    return results
@@ -0,0 +1,225 @@
+"""Shared database session layer for sparkifydb scripts
+This script builds DB connections from the [DB] section of dwh.cfg with TCP
+keepalives, retries failed connects with exponential backoff and keeps warm
+connections in a thread safe pool, so create_tables.py and etl.py do not pay
+the slow Redshift connection setup for every phase. When [LOG] STATEMENT_LOG
+is set, connections are instrumented (see instrumentation.py).
+
+This file can also be imported as a module and contains the following
+functions and classes:
+
+    * connection_params - psycopg2 connect arguments from dwh.cfg.
+    * connect - Opening a connection, retrying with backoff.
+    * statement_timeout - Context manager limiting statement run time.
+    * ConnectionPool - Thread safe pool of warm connections.
+"""
+
+# Importing system libraries
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+
+
+def connection_params(config):
+    """psycopg2 connect arguments from the [DB] section of dwh.cfg.
+
+    Parameters
+    ___________
+        config : configparser.ConfigParser
+                Loaded dwh.cfg
+
+    Returns
+    ___________
+        dict - keyword arguments for psycopg2.connect
+    """
+
+    return {
+        'host': config.get('DB', 'HOST'),
+        'dbname': config.get('DB', 'DB_NAME'),
+        'user': config.get('DB', 'DB_USER'),
+        'password': config.get('DB', 'DB_PASSWORD'),
+        'port': config.get('DB', 'DB_PORT'),
+        'connect_timeout': config.get('DB', 'CONNECT_TIMEOUT', fallback='') or 30,
+        'keepalives': 1,
+        'keepalives_idle': 60,
+        'keepalives_interval': 10,
+        'keepalives_count': 5,
+    }
+
+
+def connect(config, retries=5, backoff=1.0, autocommit=True):
+    """Opening a DB connection, retrying with exponential backoff.
+
+    Parameters
+    ___________
+        config     : configparser.ConfigParser
+                    Loaded dwh.cfg
+        retries    : int
+                    Number of attempts before giving up
+        backoff    : float
+                    Seconds to wait after the first failure, doubled each time
+        autocommit : bool
+                    Autocommit setting of the new connection
+
+    Returns
+    ___________
+        psycopg2 connection object
+    """
+
+    params = connection_params(config)
+    log_path = config.get('LOG', 'STATEMENT_LOG', fallback='')
+    if log_path:
+        import instrumentation
+        params['connection_factory'] = instrumentation.InstrumentedConnection
+
+    for attempt in range(retries):
+        try:
+            conn = psycopg2.connect(**params)
+            if log_path:
+                conn.statement_log = instrumentation.get_statement_log(log_path)
+            conn.set_session(autocommit=autocommit)
+            return conn
+        except psycopg2.OperationalError as e:
+            if attempt == retries - 1:
+                raise
+            print("Connect attempt {} failed, retrying; error message {}".format(attempt + 1, e))
+            time.sleep(backoff * 2 ** attempt)
+
+
+@contextmanager
+def statement_timeout(cur, milliseconds):
+    """Limiting the run time of statements executed inside the block.
+
+    Parameters
+    ___________
+        cur          : psycopg2 cursor object
+                      Cursor the timeout is applied to
+        milliseconds : int
+                      Timeout, 0 or None means no limit
+
+    Returns
+    ___________
+        None
+    """
+
+    cur.execute("show statement_timeout;")
+    previous = cur.fetchone()[0]
+    cur.execute("set statement_timeout to {:d};".format(int(milliseconds or 0)))
+    try:
+        yield
+    finally:
+        if not cur.connection.closed:
+            if cur.connection.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+                cur.connection.rollback()
+            cur.execute("set statement_timeout to %s;", (previous,))
+
+
+class ConnectionPool:
+    """Thread safe pool of warm DB connections.
+
+    Connections are opened lazily up to maxconn. getconn blocks while all
+    connections are in use; broken connections are replaced on checkout.
+
+    Parameters
+    ___________
+        config            : configparser.ConfigParser
+                           Loaded dwh.cfg
+        maxconn           : int
+                           Maximum number of open connections, defaults to
+                           [DB] POOL_SIZE or 8
+        statement_timeout : int
+                           Default statement timeout in milliseconds, defaults
+                           to [DB] STATEMENT_TIMEOUT, 0 for none
+    """
+
+    def __init__(self, config, maxconn=None, statement_timeout=None):
+        if maxconn is None:
+            maxconn = int(config.get('DB', 'POOL_SIZE', fallback='') or 8)
+        if statement_timeout is None:
+            statement_timeout = int(config.get('DB', 'STATEMENT_TIMEOUT', fallback='') or 0)
+        self.config = config
+        self.maxconn = maxconn
+        self.statement_timeout = statement_timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._all = []
+
+    def _open(self):
+        conn = connect(self.config)
+        if self.statement_timeout:
+            cur = conn.cursor()
+            cur.execute("set statement_timeout to {:d};".format(int(self.statement_timeout)))
+            cur.close()
+        with self._lock:
+            self._all.append(conn)
+        return conn
+
+    def getconn(self):
+        """Borrowing a connection, opening one if none is idle."""
+
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._open()
+                if not conn.closed:
+                    return conn
+                self._forget(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, close=False):
+        """Returning a borrowed connection to the pool."""
+
+        try:
+            if close or conn.closed:
+                self._forget(conn)
+                if not conn.closed:
+                    conn.close()
+            else:
+                if not conn.autocommit:
+                    try:
+                        conn.rollback()
+                    except psycopg2.Error:
+                        self._forget(conn)
+                        conn.close()
+                        return
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def _forget(self, conn):
+        with self._lock:
+            if conn in self._all:
+                self._all.remove(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrowing a connection for the duration of a with block."""
+
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except psycopg2.InterfaceError:
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, close=broken)
+
+    def closeall(self):
+        """Closing every connection opened by the pool."""
+
+        with self._lock:
+            conns, self._all = self._all, []
+        for conn in conns:
+            if not conn.closed:
+                conn.close()
+        self._idle = queue.LifoQueue()
@@ -9,18 +9,73 @@ functions:
       data into staging tables.  
     * insert_tables - Insert Data into Fact and Diomensions table from staging 
       tables. 
+    * insert_tables_parallel - Insert Data into Fact and Dimensions table, 
+      running independent loads concurrently.
     * main - the main function of the script
+
+Completed steps are checkpointed per run (see checkpoint.py); run with
+--resume to skip the steps an earlier failed run already completed.
+
+After the inserts the checks of data_quality.py run; a failed check stops the
+run before the tables are swapped in or the run is marked finished, and an
+incremental merge is rolled back. The daily plays rollups are then refreshed
+with the new songplays (see rollups.py). A stopped or failed load exits with
+status 1.
+
+Run with --swap to build the Fact and Dimension tables under shadow names and
+swap them in atomically once validated (see table_swap.py); production tables
+stay readable during the load and create_tables.py is not needed before it.
+
+Run with --incremental to only load S3 files not loaded by an earlier run
+(see incremental.py) instead of reprocessing the whole S3 prefix; full loads
+from S3 record their files and watermark for it. Run with
+--staging manifest to load the staging tables through COPY manifests listing
+the source files, with --staging compact to compact them into one gzip'd
+file of balanced size per slice first (see staging_loader.py), or with
+--staging local to stream local json files with COPY FROM STDIN (see
+local_loader.py).
+
+Run with --scale to resize the cluster for the load (to the given number of
+nodes, or estimated from the size of the S3 files the load stages) and back
+afterwards, and with --pause-after to pause it once done, resuming it first
+if needed (see redshift_cluster.py).
+
+Run with --preflight to validate the source json files before COPY and
+quarantine bad ones (see preflight.py), with --incremental only the new files
+are validated; rows rejected by COPY are printed from stl_load_errors.
 """
 
 # Importing system libraries
+import argparse
 import configparser
+import contextlib
+import sys
+
 import psycopg2
 
 # Importing user libraries
-from sql_queries import copy_table_queries, insert_table_queries
+import checkpoint
+from dag_executor import print_timings, run_dag
+from db_connection import ConnectionPool, connect
+import instrumentation
+from incremental import load_incremental, record_full_load
+import local_loader
+from pg_compat import is_redshift, to_postgres
+import preflight
+from rollups import refresh_rollups
+from s3_utils import s3_client
+import staging_loader
+from sql_queries import (copy_table_names, get_copy_table_queries, insert_table_queries,
+                         insert_table_nodes, loaded_files_all_select, render_statement,
+                         staged_files_insert, staged_files_delete, staged_files_select,
+                         staged_files_table_create, staging_truncate_queries, user_history_nodes)
+import table_swap
+from data_quality import check_load
+from maintenance import maintain
+from query_cache import bump_generation
 
 
-def load_staging_tables(cur, conn):
+def load_staging_tables(cur, conn, config=None):
     """Processing Song & Event data file and loading data into staging tables. 
     
     Parameters
@@ -29,6 +84,9 @@ def load_staging_tables(cur, conn):
               Cursor object for sparkifydb
         conn : psycopg2 connection object
               Connection object for sparkifydb
+        config : configparser.ConfigParser or str
+              Configuration the COPY statements are rendered with, dwh.cfg 
+              by default
     
     Returns
     ___________
@@ -36,7 +94,7 @@ def load_staging_tables(cur, conn):
     """
     
     # Looping for loading each file into the tables 
-    for query in copy_table_queries:
+    for query in get_copy_table_queries(config):
         cur.execute(query)
         conn.commit()
 
@@ -63,41 +121,342 @@ def insert_tables(cur, conn):
         conn.commit()
 
 
-def main():
+def insert_tables_parallel(pool, max_workers=4, completed=(), on_success=None, nodes=None):
+    """Processing data into Facts and Dimension tables in dependency order. 
+    
+    Dimension loads are independent of each other and run concurrently, the 
+    fact load starts once songs_dim and artists_dim are populated.
+    
+    Parameters
+    ___________
+        pool        : db_connection.ConnectionPool
+                     Pool the insert connections are borrowed from
+        max_workers : int
+                     Number of inserts allowed to run at the same time
+        completed   : set
+                     Inserts completed by an earlier attempt, skipped
+        on_success  : callable
+                     Called with (cursor, insert name) inside each insert's 
+                     transaction, e.g. to record a checkpoint
+        nodes       : list
+                     Insert DAG nodes, sql_queries.insert_table_nodes by default
+    
+    Returns
+    ___________
+        dict - per insert timings as returned by dag_executor.run_dag
+    """
+    
+    nodes = [node for node in (nodes or insert_table_nodes) if node[0] not in completed]
+    timings = run_dag(nodes, pool.getconn, min(max_workers, pool.maxconn),
+                      pool.putconn, on_success)
+    print_timings(timings)
+    return timings
+
+
+def _load_staging_step(cur, config, staging, s3=None, exclude=()):
+    """Loading the staging tables with one of the non prefix loaders."""
+    
+    conn = cur.connection
+    if staging == 'local':
+        local_loader.load_staging_tables(cur, conn, config)
+    else:
+        print(staging_loader.load_staging_tables(cur, conn, s3, config,
+                                                 compact=(staging == 'compact'), exclude=exclude))
+
+
+def _list_source_keys(s3, config, exclude=(), sources=('events', 'songs')):
+    """s3:// URIs of the Event and Song files a full load stages, per source."""
+    
+    options = {'events': 'LOG_DATA', 'songs': 'SONG_DATA'}
+    return {source: [uri for uri, _ in staging_loader.list_objects(s3, config.get('S3', options[source]))
+                     if uri not in exclude]
+            for source in sources}
+
+
+def _record_staged_keys(cur, run_id, s3, config, exclude=(), sources=('events', 'songs')):
+    """Recording the files a staging step loads, inside the step's transaction.
+    
+    Listed before COPY: a file added in between is staged again by the next
+    incremental run, where the watermark drops its events.
+    """
+    
+    for source, keys in _list_source_keys(s3, config, exclude, sources).items():
+        cur.executemany(staged_files_insert, [(run_id, source, key) for key in keys])
+
+
+def _record_load_state(cur, run_id):
+    """Recording the files staged by a run as loaded, see incremental.record_full_load."""
+    
+    cur.execute(staged_files_select, (run_id,))
+    staged = {}
+    for source, key in cur.fetchall():
+        staged.setdefault(source, []).append(key)
+    # Runs staged before the files were recorded only move the watermark
+    record_full_load(cur, staged or None)
+    cur.execute(staged_files_delete, (run_id,))
+
+
+def _preflight_keys(config, s3, keys):
+    """Validating the new files of an incremental load, returning the bad ones."""
+    
+    stats, bad = preflight.preflight(config, s3, keys={'events_stg': keys['events'],
+                                                       'songs_stg': keys['songs']})
+    print(stats)
+    return bad
+
+
+def _loaded_keys():
+    """s3:// URIs recorded as loaded, none before the first full load."""
     
-    # Loading Configurations
     config = configparser.ConfigParser()
     config.read('dwh.cfg')
+    conn = connect(config)
+    try:
+        cur = conn.cursor()
+        cur.execute(loaded_files_all_select)
+        return {row[0] for row in cur.fetchall()}
+    except psycopg2.ProgrammingError:
+        return set()
+    finally:
+        conn.close()
+
 
-    # creating sparkify DB connection
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}"
-                            .format(config.get('DB','HOST'),
-                                    config.get('DB','DB_NAME'), 
-                                    config.get('DB','DB_USER'),
-                                    config.get('DB','DB_PASSWORD'),
-                                    config.get('DB','DB_PORT'),
-                                   )
-                           )
+def _print_load_errors(conn):
+    """Printing rows rejected by COPY, ignoring targets without stl_load_errors."""
     
-    conn.set_session(autocommit=True)
+    try:
+        preflight.print_load_errors(conn.cursor())
+    except Exception:
+        conn.rollback()
+
+
+def _swap_step(conn, append_fact):
+    """Validating the shadow tables and swapping them in (autocommit connection)."""
     
-    # Opening Cursor object
     cur = conn.cursor()
+    print(table_swap.validate_shadow_tables(cur))
+    table_swap.swap_tables(cur, conn, append_fact)
+    cur.close()
+
+
+def main(incremental=False, staging='prefix', resume=False, run_id=None, swap=None, maintenance=True,
+         user_history=False, validate=False):
+    """Loading staging tables and populating Fact and Dimension tables.
     
-    # Calling function for populating staging tables
-    try:
-        load_staging_tables(cur, conn)
-    except Exception as e:
-        print(e)   
+    Parameters
+    ___________
+        incremental : bool
+                     Only load new S3 files and merge them into existing tables
+        staging     : str
+                     'prefix' to COPY whole S3 prefixes, 'manifest' to COPY
+                     through manifests listing the source files, 'compact'
+                     to compact them into one balanced gzip'd file per slice
+                     first,
+                     'local' to stream the [LOCAL] json directories
+        resume      : bool
+                     Skip the steps completed by an earlier unfinished run
+        run_id      : str
+                     Run to start or resume, generated (or the latest 
+                     unfinished run when resuming) if not given
+        swap        : str
+                     None to load the production tables directly, 'rename'
+                     to build shadow tables and swap them in, 'append' to 
+                     insert only the Fact rows newer than the production
+                     ones, together with the Dimension swap
+        maintenance : bool
+                     VACUUM/ANALYZE tables above the thresholds after the 
+                     load, see maintenance.py
+        user_history : bool
+                     Also keep the level history of users in 
+                     users_dim_history (slowly changing dimension type 2)
+        validate    : bool
+                     Validate the source files (the new ones only when
+                     incremental) before COPY and quarantine bad ones, see
+                     preflight.py
+    
+    Returns
+    ___________
+        None
+    """
+    
+    # Loading Configurations
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+
+    # creating sparkify DB connection pool, connections are reused by all phases
+    pool = ConnectionPool(config)
+    conn = pool.getconn()
     
-    # Calling function for populating Fact and Dimension tables
     try:
-        insert_tables(cur, conn)
-    except Exception as e:
-        print(e)
+        # Opening Cursor object
+        cur = conn.cursor()
     
-    # closing the connection
-    conn.close()
+        if incremental:
+            try:
+                s3 = s3_client(config)
+                validate_new = None
+                if validate:
+                    # Only the new files are validated, bad ones are left out of the manifests
+                    validate_new = lambda keys: _preflight_keys(config, s3, keys)
+                loaded = load_incremental(cur, conn, s3, config, user_history, validate_new)
+                print(loaded)
+                if any(loaded.values()):
+                    bump_generation(cur, conn)
+                if maintenance:
+                    maintain(config, conn)
+            except Exception as e:
+                print(e)
+                # The report below borrows a connection of its own
+                pool.putconn(conn, close=True)
+                sys.exit(1)
+            pool.putconn(conn)
+            return
+    
+        run_id, completed = checkpoint.start_run(cur, conn, run_id, resume)
+        rewrite = (lambda query: query) if is_redshift(conn) else to_postgres
+    
+        # Calling function for populating staging tables, one checkpointed step per COPY
+        try:
+            s3 = None
+            if staging != 'local':
+                s3 = s3_client(config)
+            exclude = set()
+            if validate and not {'staging_' + staging, *copy_table_names} & completed:
+                stats, exclude = preflight.preflight(config, s3, local=(staging == 'local'))
+                print(stats)
+                if exclude and staging == 'prefix':
+                    raise ValueError("{} bad source files quarantined, prefix COPY cannot skip them; "
+                                     "rerun with --staging manifest".format(len(exclude)))
+            if staging != 'local':
+                conn.cursor().execute(staged_files_table_create)
+            if swap:
+                # Production tables are not dropped before a swap load, staging is
+                checkpoint.run_step(conn, run_id, 'staging_truncate', completed,
+                                    lambda step_cur: [step_cur.execute(q) for q in staging_truncate_queries])
+            # Each step records the files it stages along with its checkpoint
+            if staging == 'prefix':
+                for name, source in zip(copy_table_names, ('events', 'songs')):
+                    query = render_statement(name, config)
+                    checkpoint.run_step(conn, run_id, name, completed,
+                                        lambda step_cur: (_record_staged_keys(step_cur, run_id, s3, config,
+                                                                              sources=(source,)),
+                                                          step_cur.execute(query)))
+            elif staging == 'local':
+                checkpoint.run_step(conn, run_id, 'staging_local', completed,
+                                    lambda step_cur: _load_staging_step(step_cur, config, staging))
+            else:
+                checkpoint.run_step(conn, run_id, 'staging_' + staging, completed,
+                                    lambda step_cur: (_record_staged_keys(step_cur, run_id, s3, config, exclude),
+                                                      _load_staging_step(step_cur, config, staging, s3, exclude)))
+            if staging != 'local':
+                _print_load_errors(conn)
+        except Exception as e:
+            print(e)
+            if staging != 'local':
+                _print_load_errors(conn)
+            print("Run {} stopped, rerun with --resume to continue".format(run_id))
+            pool.putconn(conn, close=True)
+            sys.exit(1)
+    
+        # Handing the connection back so the inserts can reuse it
+        pool.putconn(conn)
+    
+        # Calling function for populating Fact and Dimension tables
+        try:
+            nodes = insert_table_nodes + (user_history_nodes if user_history else [])
+            if swap:
+                nodes = table_swap.shadow_nodes(nodes)
+                with pool.connection() as conn:
+                    fresh = not any(name in completed for name, _, _, _ in nodes)
+                    table_swap.prepare_shadow_tables(conn.cursor(), conn, fresh)
+        
+            # The inserts use Redshift functions, rewritten on a PostgreSQL replica
+            nodes = [(name, rewrite(query), reads, writes) for name, query, reads, writes in nodes]
+            insert_tables_parallel(pool, completed=completed, nodes=nodes,
+                                   on_success=lambda step_cur, name: checkpoint.record_step(step_cur, run_id, name))
+        
+            # Failed checks stop the run before the swap and before it is finished
+            check_load(pool.getconn, pool.putconn, table_swap.shadow_statement if swap else None,
+                       min(4, pool.maxconn))
+        
+            if swap and 'swap_tables' not in completed:
+                # The swap manages its own transaction, the checkpoint is recorded
+                # once it succeeded
+                with pool.connection() as conn:
+                    _swap_step(conn, swap == 'append')
+                    checkpoint.run_step(conn, run_id, 'swap_tables', completed, lambda step_cur: None)
+        
+            # Adding the new songplays to the daily rollups, a rename swap replaced the Fact rows
+            with pool.connection() as conn:
+                checkpoint.run_step(conn, run_id, 'refresh_rollups', completed,
+                                    lambda step_cur: print(refresh_rollups(step_cur, rebuild=(swap == 'rename'),
+                                                                         rewrite=rewrite)))
+        
+            # Recording files and watermark, a following --incremental run only loads newer files
+            if staging != 'local':
+                with pool.connection() as conn:
+                    checkpoint.run_step(conn, run_id, 'record_load_state', completed,
+                                        lambda step_cur: _record_load_state(step_cur, run_id))
+        except Exception as e:
+            print(e)
+            print("Run {} stopped, rerun with --resume to continue".format(run_id))
+            sys.exit(1)
+    
+        with pool.connection() as conn:
+            checkpoint.finish_run(conn.cursor(), conn, run_id)
+            # Cached dashboard results of earlier loads are outdated now
+            bump_generation(conn.cursor(), conn)
+    
+        # Refreshing statistics and sort order of the loaded tables
+        if maintenance:
+            with pool.connection() as conn:
+                try:
+                    maintain(config, conn)
+                except Exception as e:
+                    print(e)
+    finally:
+        # Summarising per statement timings (when [LOG] STATEMENT_LOG is set),
+        # also of failed runs
+        try:
+            with pool.connection() as conn:
+                instrumentation.report(config, conn, run_id)
+        except Exception as e:
+            print(e)
+        
+        # closing the connections
+        pool.closeall()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--incremental', action='store_true',
+                        help='only load S3 files not loaded by an earlier run')
+    parser.add_argument('--staging', choices=['prefix', 'manifest', 'compact', 'local'],
+                        default='prefix', help='how staging tables are loaded')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip steps completed by an earlier unfinished run')
+    parser.add_argument('--run-id', help='run to start or resume')
+    parser.add_argument('--swap', choices=['rename', 'append'],
+                        help='load shadow tables and swap them in (append: insert only the new fact rows)')
+    parser.add_argument('--no-maintenance', action='store_true',
+                        help='skip VACUUM/ANALYZE after the load')
+    parser.add_argument('--user-history', action='store_true',
+                        help='keep user level changes in users_dim_history')
+    parser.add_argument('--preflight', action='store_true',
+                        help='validate source files before COPY and quarantine bad ones')
+    parser.add_argument('--scale', nargs='?', type=int, const=0,
+                        help='resize the cluster for the load (nodes, estimated if omitted) and back after')
+    parser.add_argument('--pause-after', action='store_true',
+                        help='pause the cluster after the load (resumed first if paused)')
+    args = parser.parse_args()
+    
+    window = contextlib.nullcontext()
+    if args.scale is not None or args.pause_after:
+        from redshift_cluster import ClusterManager
+        # An incremental load only stages the files not loaded before
+        window = ClusterManager().capacity_window(args.scale or None, args.pause_after,
+                                                  loaded=_loaded_keys if args.incremental else None,
+                                                  resize=args.scale is not None)
+    
+    with window:
+        main(args.incremental, args.staging, args.resume, args.run_id, args.swap,
+             not args.no_maintenance, args.user_history, args.preflight)
\ No newline at end of file
@@ -0,0 +1,292 @@
+"""Exporting sparkifydb tables to Parquet
+On Redshift a table is exported with UNLOAD ... FORMAT AS PARQUET PARALLEL ON,
+so every slice writes its part straight to S3 under [S3] EXPORT_PREFIX; the
+files can then be downloaded concurrently, each one in chunks by the boto3
+transfer manager. On PostgreSQL the rows are streamed through a server side
+(named) cursor in fixed size batches into local Parquet files. Either way the
+client never holds more than one batch, however large the table is, and rows
+and bytes per second are reported.
+
+Usage:
+    python export.py [--config dwh.cfg] [--output exports] [--download] songs_plays_fact users_dim
+
+This file can also be imported as a module and contains the following
+functions:
+
+    * unload_table - UNLOADing a table to S3 as Parquet (Redshift).
+    * download_prefix - Downloading the files under an S3 prefix concurrently.
+    * stream_table - Streaming a table into Parquet files in batches.
+    * export_table - Exporting a table the way the connection supports.
+    * main - the main function of the script
+"""
+
+# Importing system libraries
+import argparse
+import configparser
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Importing user libraries
+from db_connection import connect
+from pg_compat import is_redshift
+from s3_utils import s3_client, split_s3_uri
+from schema_advisor import parse_create
+from sql_queries import create_table_queries, table_unload, unload_count_select
+
+# Tables that can be exported
+EXPORT_TABLES = [parse_create(query)[0] for query in create_table_queries]
+
+# pyarrow type names per PostgreSQL type oid, anything else is exported as string
+ARROW_TYPES = {
+    16: 'bool_',
+    20: 'int64',
+    21: 'int16',
+    23: 'int32',
+    700: 'float32',
+    701: 'float64',
+    1082: 'date32',
+    1114: 'timestamp',
+    1700: 'decimal',
+}
+
+# Largest precision of pyarrow's decimal128
+_DECIMAL_PRECISION = 38
+
+
+def unload_table(cur, table, prefix, arn):
+    """UNLOADing a table to S3 as Parquet, in parallel from every slice.
+
+    Parameters
+    ___________
+        cur    : psycopg2 cursor object
+                Cursor object for sparkifydb
+        table  : str
+                Table to export
+        prefix : str
+                S3 URI the table's files are written under
+        arn    : str
+                IAM role allowed to write to the bucket
+
+    Returns
+    ___________
+        dict - rows and seconds
+    """
+
+    start = time.time()
+    select = "select * from {}".format(table).replace("'", "''")
+    cur.execute(table_unload.format(select, prefix.rstrip('/') + '/' + table + '/', arn))
+    cur.execute(unload_count_select)
+    return {'rows': cur.fetchone()[0], 'seconds': time.time() - start}
+
+
+def download_prefix(s3, uri, directory, max_workers=8):
+    """Downloading the files under an S3 prefix concurrently.
+
+    Parameters
+    ___________
+        s3          : boto3 S3 client
+        uri         : str
+                     S3 URI of the prefix
+        directory   : str
+                     Local directory the files are written to
+        max_workers : int
+                     Files downloaded at the same time
+
+    Returns
+    ___________
+        dict - files, bytes and seconds
+    """
+
+    bucket, prefix = split_s3_uri(uri)
+    objects = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        objects.extend((obj['Key'], obj['Size']) for obj in page.get('Contents', []))
+
+    os.makedirs(directory, exist_ok=True)
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(lambda obj: s3.download_file(bucket, obj[0],
+                                                       os.path.join(directory, os.path.basename(obj[0]))),
+                          objects))
+    return {'files': len(objects), 'bytes': sum(size for _, size in objects),
+            'seconds': time.time() - start}
+
+
+def _arrow_type(column):
+    """pyarrow type of a cursor description column."""
+
+    import pyarrow as pa
+
+    name = ARROW_TYPES.get(column.type_code, 'string')
+    if name == 'timestamp':
+        return pa.timestamp('us')
+    if name == 'decimal':
+        # numeric without a declared precision does not fit a fixed decimal
+        if column.precision and column.precision <= _DECIMAL_PRECISION:
+            return pa.decimal128(column.precision, column.scale or 0)
+        return pa.float64()
+    return getattr(pa, name)()
+
+
+def _arrow_schema(description):
+    import pyarrow as pa
+
+    return pa.schema([pa.field(column.name, _arrow_type(column)) for column in description])
+
+
+def _arrow_values(column, field):
+    """Values of a column converted to what pyarrow takes for the field type."""
+
+    import pyarrow as pa
+
+    if pa.types.is_string(field.type):
+        return [None if value is None else str(value) for value in column]
+    if pa.types.is_floating(field.type):
+        return [None if value is None else float(value) for value in column]
+    return column
+
+
+def stream_table(conn, table, directory, batch_rows=50000, file_rows=1000000):
+    """Streaming a table through a named cursor into Parquet files.
+
+    Parameters
+    ___________
+        conn       : psycopg2 connection object
+                    Connection object for sparkifydb
+        table      : str
+                    Table to export
+        directory  : str
+                    Directory the table's files are written to
+        batch_rows : int
+                    Rows fetched and written at a time
+        file_rows  : int
+                    Rows per file before the next file is started
+
+    Returns
+    ___________
+        dict - rows, files, bytes and seconds
+    """
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(directory, exist_ok=True)
+    start = time.time()
+    rows = 0
+    paths = []
+    writer = None
+    file_rows_written = 0
+
+    # Named cursors only exist inside a transaction
+    autocommit = conn.autocommit
+    conn.autocommit = False
+    try:
+        cur = conn.cursor(name='export_' + table)
+        cur.execute("select * from {};".format(table))
+        schema = None
+        while True:
+            batch = cur.fetchmany(batch_rows)
+            if not batch:
+                break
+            if schema is None:
+                schema = _arrow_schema(cur.description)
+            if writer is None or file_rows_written >= file_rows:
+                if writer is not None:
+                    writer.close()
+                paths.append(os.path.join(directory, '{}_{:04d}.parquet'.format(table, len(paths))))
+                writer = pq.ParquetWriter(paths[-1], schema)
+                file_rows_written = 0
+            columns = list(zip(*batch))
+            writer.write_table(pa.table([pa.array(_arrow_values(column, field), type=field.type)
+                                         for column, field in zip(columns, schema)], schema=schema))
+            rows += len(batch)
+            file_rows_written += len(batch)
+        cur.close()
+        conn.rollback()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if writer is not None:
+            writer.close()
+        conn.autocommit = autocommit
+
+    return {'rows': rows, 'files': len(paths), 'bytes': sum(os.path.getsize(path) for path in paths),
+            'seconds': time.time() - start}
+
+
+def export_table(config, conn, table, output, s3=None, download=False, redshift=None):
+    """Exporting a table, with UNLOAD on Redshift and a named cursor otherwise.
+
+    Parameters
+    ___________
+        config   : configparser.ConfigParser
+                  Loaded dwh.cfg
+        conn     : psycopg2 connection object
+                  Connection object for sparkifydb
+        table    : str
+                  Table to export, one of EXPORT_TABLES
+        output   : str
+                  Local directory, one sub directory per table
+        s3       : boto3 S3 client
+                  Needed to download UNLOADed files
+        download : bool
+                  Download the UNLOADed files into output
+        redshift : bool
+                  Whether conn points at Redshift, looked up if None
+
+    Returns
+    ___________
+        dict - rows, seconds and, where known, files and bytes
+    """
+
+    if table not in EXPORT_TABLES:
+        raise ValueError("Unknown table " + table)
+    if redshift is None:
+        redshift = is_redshift(conn)
+
+    directory = os.path.join(output, table)
+    if not redshift:
+        return stream_table(conn, table, directory)
+
+    prefix = config.get('S3', 'EXPORT_PREFIX').strip().strip("'\"").rstrip('/')
+    result = unload_table(conn.cursor(), table, prefix, config.get('IAM_ROLE', 'ARN'))
+    if download:
+        downloaded = download_prefix(s3, prefix + '/' + table + '/', directory)
+        result.update(files=downloaded['files'], bytes=downloaded['bytes'],
+                      seconds=result['seconds'] + downloaded['seconds'])
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export tables to Parquet.')
+    parser.add_argument('--config', default='dwh.cfg', help='configuration file')
+    parser.add_argument('--output', default='exports', help='local directory of the Parquet files')
+    parser.add_argument('--download', action='store_true', help='download UNLOADed files from S3')
+    parser.add_argument('tables', nargs='+', choices=EXPORT_TABLES, help='tables to export')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+
+    conn = connect(config)
+    redshift = is_redshift(conn)
+    s3 = None
+    if redshift and args.download:
+        s3 = s3_client(config)
+
+    for table in args.tables:
+        result = export_table(config, conn, table, args.output, s3, args.download, redshift)
+        seconds = max(result['seconds'], 1e-9)
+        line = "{:<20} {:>12} rows {:>9.3f}s {:>12.0f} rows/s".format(table, result['rows'], seconds,
+                                                                     result['rows'] / seconds)
+        if 'bytes' in result:
+            line += " {:>8.1f} MB/s".format(result['bytes'] / seconds / 1e6)
+        print(line)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
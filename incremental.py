@@ -0,0 +1,234 @@
+"""Incremental (watermark based) loading of sparkifydb Fact and Dimension tables
+This script stages only the S3 files not loaded by an earlier run and merges
+them into the Fact and Dimension tables, so a daily run costs in proportion to
+the day's data rather than to the whole history.
+
+State is kept in two tables: etl_loaded_files records every S3 key already
+staged per source and etl_watermarks keeps the highest event ts merged so far.
+Full loads of etl.py record the same state when they finish. An incremental
+run refuses to start on a loaded Fact table without state, as it would load
+every file again.
+
+This file can also be imported as a module and contains the following
+functions:
+
+    * list_new_keys - Listing S3 keys of a source that are not loaded yet.
+    * stage_new_files - Loading new Song and Event files into staging tables.
+    * merge_tables - Merging staged data into Fact and Dimension tables.
+    * record_full_load - Recording a full load of etl.py as load state.
+    * load_incremental - Running a complete incremental load.
+"""
+
+# Importing user libraries
+from data_quality import INCREMENTAL_CHECKS, check_load
+from rollups import refresh_rollups
+from s3_utils import split_s3_uri, write_manifest
+from sql_queries import (create_table_queries, events_stg_below_watermark_delete,
+                         loaded_files_delete, loaded_files_insert, loaded_files_select,
+                         merge_table_queries, staging_events_copy_manifest,
+                         user_history_insert,
+                         songplay_exists_select, staging_songs_copy_manifest,
+                         staging_truncate_queries, watermark_select, watermark_upsert)
+
+
+def list_new_keys(cur, s3, source, uri):
+    """Listing S3 json files of a source which were not staged before.
+
+    Parameters
+    ___________
+        cur    : psycopg2 cursor object
+                Cursor object for sparkifydb
+        s3     : boto3 S3 client
+        source : str
+                Name of the source ('events' or 'songs')
+        uri    : str
+                S3 URI of the source prefix
+
+    Returns
+    ___________
+        list - s3:// URIs of the new files, sorted
+    """
+
+    bucket, prefix = split_s3_uri(uri)
+
+    cur.execute(loaded_files_select, (source,))
+    loaded = {row[0] for row in cur.fetchall()}
+
+    new_keys = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            key = 's3://{}/{}'.format(bucket, obj['Key'])
+            if obj['Key'].endswith('.json') and key not in loaded:
+                new_keys.append(key)
+    return sorted(new_keys)
+
+
+def stage_new_files(cur, conn, s3, config, validate=None):
+    """Loading Song and Event files not loaded before into staging tables.
+
+    Staging tables are truncated first, so after this call they only hold the
+    new data. Events at or below the watermark are removed from events_stg.
+    Files rejected by validate are left out and not recorded as loaded, so
+    they are checked again by the next run.
+
+    Parameters
+    ___________
+        cur    : psycopg2 cursor object
+                Cursor object for sparkifydb
+        conn   : psycopg2 connection object
+                Connection object for sparkifydb
+        s3     : boto3 S3 client
+        config : configparser.ConfigParser
+                Loaded dwh.cfg
+        validate : callable
+                Called with the new s3:// URIs per source, returns the set
+                of bad files, e.g. through preflight.preflight
+
+    Returns
+    ___________
+        dict - s3:// URIs of the new files staged per source
+    """
+
+    for query in staging_truncate_queries:
+        cur.execute(query)
+    conn.commit()
+
+    arn = config.get('IAM_ROLE', 'ARN')
+    manifest_prefix = config.get('S3', 'MANIFEST_PREFIX').strip().strip("'\"").rstrip('/')
+    sources = [('events', config.get('S3', 'LOG_DATA'), staging_events_copy_manifest),
+               ('songs', config.get('S3', 'SONG_DATA'), staging_songs_copy_manifest)]
+
+    new_keys = {source: list_new_keys(cur, s3, source, uri) for source, uri, _ in sources}
+    bad = validate(new_keys) if validate else set()
+
+    staged = {}
+    for source, uri, copy_query in sources:
+        keys = [key for key in new_keys[source] if key not in bad]
+        staged[source] = keys
+        if not keys:
+            continue
+
+        manifest = write_manifest(s3, '{}/{}.manifest'.format(manifest_prefix, source), keys)
+        cur.execute(copy_query.format(manifest, arn, ''))
+        conn.commit()
+
+    cur.execute(watermark_select, ('events',))
+    row = cur.fetchone()
+    if row is not None:
+        cur.execute(events_stg_below_watermark_delete, (row[0],))
+        conn.commit()
+
+    return staged
+
+
+def merge_tables(cur, conn, staged, user_history=False):
+    """Merging staged data into Fact and Dimension tables, recording the
+    staged files and moving the watermark forward.
+
+    Dimension rows are replaced (delete + insert) for keys present in staging,
+    new songplays are appended to the Fact table and added to the daily plays
+    rollups. The data quality checks run on the merge before it commits, a
+    failed check rolls it back. Staged files are only marked as loaded once
+    the merge has committed.
+
+    Parameters
+    ___________
+        cur    : psycopg2 cursor object
+                Cursor object for sparkifydb
+        conn   : psycopg2 connection object
+                Connection object for sparkifydb
+        staged       : dict
+                      s3:// URIs of the staged files per source
+        user_history : bool
+                      Also add level changes to users_dim_history
+
+    Returns
+    ___________
+        None
+    """
+
+    # Merging in one transaction so a failure leaves no partial merge behind
+    autocommit = conn.autocommit
+    conn.autocommit = False
+    try:
+        for query in merge_table_queries + ([user_history_insert] if user_history else []):
+            cur.execute(query)
+        check_load(cur=cur, checks=INCREMENTAL_CHECKS)
+        refresh_rollups(cur)
+        cur.execute(watermark_upsert)
+        for source, keys in staged.items():
+            cur.executemany(loaded_files_insert, [(source, key) for key in keys])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = autocommit
+
+
+def record_full_load(cur, staged=None):
+    """Recording a full load as incremental load state.
+
+    The events watermark is moved to the latest staged event and the staged
+    files replace the files recorded for their source, so a following
+    incremental run only loads files added since. Nothing is committed.
+
+    Parameters
+    ___________
+        cur    : psycopg2 cursor object
+                Cursor object for sparkifydb
+        staged : dict
+                s3:// URIs of the files staged per source ('events', 'songs'),
+                None to only move the watermark
+
+    Returns
+    ___________
+        None
+    """
+
+    cur.execute(watermark_upsert)
+    for source, keys in (staged or {}).items():
+        cur.execute(loaded_files_delete, (source,))
+        cur.executemany(loaded_files_insert, [(source, key) for key in keys])
+
+
+def load_incremental(cur, conn, s3, config, user_history=False, validate=None):
+    """Running an incremental load of new Song and Event files.
+
+    Parameters
+    ___________
+        cur    : psycopg2 cursor object
+                Cursor object for sparkifydb
+        conn   : psycopg2 connection object
+                Connection object for sparkifydb
+        s3     : boto3 S3 client
+        config : configparser.ConfigParser
+                Loaded dwh.cfg
+        user_history : bool
+                Also maintain users_dim_history
+        validate : callable
+                Returns the bad files among the new ones, see stage_new_files
+
+    Returns
+    ___________
+        dict - number of new files staged per source
+    """
+
+    # Making sure all tables incl. the load state tables exist
+    for query in create_table_queries:
+        cur.execute(query)
+    conn.commit()
+
+    # Without state every file would be staged and every songplay appended again
+    cur.execute(watermark_select, ('events',))
+    if cur.fetchone() is None:
+        cur.execute(songplay_exists_select)
+        if cur.fetchone() is not None:
+            raise ValueError("songs_plays_fact is loaded but no incremental load state exists, "
+                             "run a full load with etl.py first")
+
+    staged = stage_new_files(cur, conn, s3, config, validate)
+    if any(staged.values()):
+        merge_tables(cur, conn, staged, user_history)
+    return {source: len(keys) for source, keys in staged.items()}
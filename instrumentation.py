@@ -0,0 +1,277 @@
+"""Per statement instrumentation of sparkifydb scripts
+This script hooks into psycopg2 through a connection/cursor factory, so every
+statement executed by create_tables.py and etl.py is measured: wall time, rows
+affected and, on Redshift, the backend query id (pg_last_query_id()). Each
+statement is written as one json line to the statement log; bytes scanned are
+looked up per query id from svl_query_summary when the summary is built.
+
+Instrumentation is switched on by setting STATEMENT_LOG in the [LOG] section
+of dwh.cfg (see db_connection.connect).
+
+This file can also be imported as a module and contains the following
+functions and classes:
+
+    * StatementLog - Collecting statement records and writing json lines.
+    * InstrumentedConnection - psycopg2 connection handing out measured cursors.
+    * InstrumentedCursor - psycopg2 cursor measuring execute and copy_expert.
+    * get_statement_log - Shared StatementLog per log file.
+    * add_bytes_scanned - Adding bytes scanned per Redshift query id.
+    * print_summary - Printing a per statement summary.
+    * write_summary_table - Storing the records in etl_statement_log.
+    * report - Summarising the statement log at the end of a script.
+"""
+
+# Importing system libraries
+import json
+import re
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+# Importing user libraries
+from sql_queries import (bytes_scanned_select, statement_log_insert,
+                         statement_log_table_create)
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+
+class StatementLog:
+    """Collecting statement records and writing them as json lines.
+
+    Parameters
+    ___________
+        path : str
+              File the json lines are appended to, None to keep records in
+              memory only
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.records = []
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        """Adding one statement record and appending it to the log file."""
+
+        with self._lock:
+            self.records.append(record)
+            if self.path:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+
+
+def get_statement_log(path):
+    """Shared StatementLog per log file, so all connections write to one log.
+
+    Parameters
+    ___________
+        path : str
+              Statement log file
+
+    Returns
+    ___________
+        StatementLog
+    """
+
+    with _logs_lock:
+        if path not in _logs:
+            _logs[path] = StatementLog(path)
+        return _logs[path]
+
+
+def _statement_name(query):
+    """Short label of a statement: verb and target table."""
+
+    match = re.search(r'\b(insert\s+into|copy|create\s+table\s+if\s+not\s+exists|create\s+table'
+                      r'|drop\s+table\s+if\s+exists|drop\s+table|delete\s+from|truncate|select'
+                      r'|analyze|vacuum)\s+([\w.]+)?', query, re.IGNORECASE)
+    if not match:
+        return ' '.join(query.split())[:60]
+    verb = ' '.join(match.group(1).lower().split())
+    return '{} {}'.format(verb, match.group(2) or '').strip()
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """psycopg2 cursor recording every execute and copy_expert."""
+
+    def _record(self, query, start, error=None):
+        conn = self.connection
+        record = {
+            'statement': _statement_name(query.decode() if isinstance(query, bytes) else str(query)),
+            'started_at': start,
+            'seconds': round(time.time() - start, 6),
+            'rows': self.rowcount,
+            'query_id': None,
+            'error': error,
+        }
+        if error is None and conn.is_redshift:
+            record['query_id'] = conn.last_query_id()
+        conn.statement_log.emit(record)
+
+    def execute(self, query, vars=None):
+        start = time.time()
+        try:
+            result = super().execute(query, vars)
+        except Exception as e:
+            self._record(query, start, str(e))
+            raise
+        self._record(query, start)
+        return result
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.time()
+        try:
+            result = super().copy_expert(sql, file, size)
+        except Exception as e:
+            self._record(sql, start, str(e))
+            raise
+        self._record(sql, start)
+        return result
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """psycopg2 connection whose cursors record into statement_log."""
+
+    statement_log = None
+    _is_redshift = None
+
+    def cursor(self, *args, **kwargs):
+        kwargs.setdefault('cursor_factory', InstrumentedCursor)
+        return super().cursor(*args, **kwargs)
+
+    def _plain_query(self, query):
+        cur = super().cursor()
+        try:
+            psycopg2.extensions.cursor.execute(cur, query)
+            return cur.fetchone()[0]
+        finally:
+            cur.close()
+
+    @property
+    def is_redshift(self):
+        if self._is_redshift is None:
+            self._is_redshift = 'redshift' in self._plain_query("select version();").lower()
+        return self._is_redshift
+
+    def last_query_id(self):
+        """Backend query id of the last statement run on this connection."""
+
+        return self._plain_query("select pg_last_query_id();")
+
+
+def add_bytes_scanned(cur, records):
+    """Adding bytes scanned per Redshift query id to the records.
+
+    Parameters
+    ___________
+        cur     : psycopg2 cursor object
+                 Cursor object for sparkifydb (Redshift)
+        records : list
+                 Statement records
+
+    Returns
+    ___________
+        None
+    """
+
+    query_ids = sorted({r['query_id'] for r in records if r.get('query_id')})
+    if not query_ids:
+        return
+    cur.execute(bytes_scanned_select, (tuple(query_ids),))
+    scanned = dict(cur.fetchall())
+    for record in records:
+        if record.get('query_id') in scanned:
+            record['bytes_scanned'] = int(scanned[record['query_id']])
+
+
+def print_summary(records):
+    """Printing one line per statement, slowest first.
+
+    Parameters
+    ___________
+        records : list
+                 Statement records
+
+    Returns
+    ___________
+        None
+    """
+
+    print("{:<45} {:>10} {:>12} {:>10} {:>14}".format('statement', 'seconds', 'rows',
+                                                       'query_id', 'bytes_scanned'))
+    for r in sorted(records, key=lambda r: r['seconds'], reverse=True):
+        print("{:<45} {:>10.3f} {:>12} {:>10} {:>14}"
+              .format(r['statement'][:45], r['seconds'], r['rows'],
+                      r.get('query_id') or '-', r.get('bytes_scanned', '-')))
+
+
+def write_summary_table(cur, conn, records, run_id):
+    """Storing statement records in the etl_statement_log table.
+
+    Parameters
+    ___________
+        cur     : psycopg2 cursor object
+                 Cursor object for sparkifydb
+        conn    : psycopg2 connection object
+                 Connection object for sparkifydb
+        records : list
+                 Statement records
+        run_id  : str
+                 Identifier of the run the records belong to
+
+    Returns
+    ___________
+        None
+    """
+
+    # Copying first, the inserts below are recorded into the log themselves
+    records = list(records)
+    cur.execute(statement_log_table_create)
+    cur.executemany(statement_log_insert,
+                    [(run_id, r['statement'], r['started_at'], r['seconds'], r['rows'],
+                      r.get('query_id'), r.get('bytes_scanned'), r.get('error'))
+                     for r in records])
+    conn.commit()
+
+
+def report(config, conn, run_id):
+    """Summarising the statement log at the end of a script.
+
+    Does nothing unless [LOG] STATEMENT_LOG is set. Bytes scanned are added on
+    Redshift and the records are stored in etl_statement_log when [LOG]
+    SUMMARY_TABLE is true.
+
+    Parameters
+    ___________
+        config : configparser.ConfigParser
+                Loaded dwh.cfg
+        conn   : psycopg2 connection object
+                Instrumented connection for sparkifydb
+        run_id : str
+                Identifier of the run
+
+    Returns
+    ___________
+        list - statement records of the run
+    """
+
+    path = config.get('LOG', 'STATEMENT_LOG', fallback='')
+    if not path:
+        return []
+
+    log = get_statement_log(path)
+    records = list(log.records)
+    cur = conn.cursor()
+    try:
+        if conn.is_redshift:
+            add_bytes_scanned(cur, records)
+        print_summary(records)
+        summary_table = config.get('LOG', 'SUMMARY_TABLE', fallback='') or 'false'
+        if summary_table.strip().lower() in ('true', 'yes', 'on', '1'):
+            write_summary_table(cur, conn, records, run_id)
+    finally:
+        cur.close()
+    return records
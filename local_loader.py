@@ -0,0 +1,288 @@
+"""Streaming loader of local Song and Event json files into staging tables
+This script is used where Redshift's S3 COPY is not available (development
+and on-prem PostgreSQL replicas). Json files are read from a local directory
+through a generator pipeline, mapped to the events_stg/songs_stg columns (the
+events using the log_json_path.json jsonpaths, the songs by column name like
+json 'auto') and written with COPY FROM STDIN in bounded size CSV chunks, so
+memory use does not grow with the number of files.
+
+This file can also be imported as a module and contains the following
+functions:
+
+    * parse_jsonpaths - Turning Redshift jsonpaths into key paths.
+    * iter_files - Yielding json files below a directory.
+    * iter_rows - Yielding staging rows of json files, parsed by workers.
+    * copy_rows - Writing rows with COPY FROM STDIN in bounded CSV chunks.
+    * load_directory - Loading one local directory into a staging table.
+    * load_staging_tables - Loading events_stg and songs_stg from local files.
+"""
+
+# Importing system libraries
+import csv
+import io
+import json
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Columns of events_stg and songs_stg in table order
+EVENTS_COLUMNS = ['artist', 'auth', 'first_name', 'gender', 'itemInSession',
+                  'last_name', 'length', 'level', 'location', 'method', 'page',
+                  'registration', 'session_id', 'song', 'status', 'ts',
+                  'user_Agent', 'user_Id']
+SONGS_COLUMNS = ['num_songs', 'artist_id', 'artist_latitude', 'artist_longitude',
+                 'artist_location', 'artist_name', 'song_id', 'title',
+                 'duration', 'year']
+
+# Same mapping as s3://udacity-dend/log_json_path.json
+EVENTS_JSONPATHS = ["$['artist']", "$['auth']", "$['firstName']", "$['gender']",
+                    "$['itemInSession']", "$['lastName']", "$['length']",
+                    "$['level']", "$['location']", "$['method']", "$['page']",
+                    "$['registration']", "$['sessionId']", "$['song']",
+                    "$['status']", "$['ts']", "$['userAgent']", "$['userId']"]
+
+
+def parse_jsonpaths(jsonpaths):
+    """Turning Redshift jsonpaths into key paths.
+
+    Parameters
+    ___________
+        jsonpaths : list
+                   Expressions like $['firstName'] or $.firstName
+
+    Returns
+    ___________
+        list - tuple of keys for each expression
+    """
+
+    paths = []
+    for expression in jsonpaths:
+        if not expression.startswith('$'):
+            raise ValueError("Invalid jsonpath " + expression)
+        keys = re.findall(r"\['([^']*)'\]|\[\"([^\"]*)\"\]|\.(\w+)", expression[1:])
+        paths.append(tuple(next(k for k in key if k) for key in keys))
+    return paths
+
+
+def read_jsonpaths(path):
+    """Reading a jsonpaths file as used by Redshift COPY.
+
+    Parameters
+    ___________
+        path : str
+              Local path of the jsonpaths file
+
+    Returns
+    ___________
+        list - tuple of keys for each column
+    """
+
+    with open(path) as f:
+        return parse_jsonpaths(json.load(f)['jsonpaths'])
+
+
+def iter_files(directory):
+    """Yielding json files below a directory in a stable order.
+
+    Parameters
+    ___________
+        directory : str
+                   Root directory of the json files
+
+    Returns
+    ___________
+        generator - file paths
+    """
+
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith('.json'):
+                yield os.path.join(root, name)
+
+
+def _lookup(record, keys):
+    """Returning the value at a key path, None if it is missing."""
+
+    for key in keys:
+        if not isinstance(record, dict) or key not in record:
+            return None
+        record = record[key]
+    return record
+
+
+def _parse_file(args):
+    """Parsing one json file into staging rows (runs in worker processes)."""
+
+    path, paths = args
+    rows = []
+    with open(path) as f:
+        text = f.read()
+    try:
+        records = [json.loads(text)]
+    except ValueError:
+        records = [json.loads(line) for line in text.splitlines() if line.strip()]
+    for record in records:
+        rows.append(tuple(_lookup(record, keys) for keys in paths))
+    return rows
+
+
+def iter_rows(files, paths, workers=1):
+    """Yielding staging rows of json files.
+
+    With more than one worker, files are parsed in worker processes with at
+    most two files per worker in flight, so memory stays bounded.
+
+    Parameters
+    ___________
+        files   : iterable
+                 Paths of the json files
+        paths   : list
+                 Key path of each staging column
+        workers : int
+                 Number of parsing processes
+
+    Returns
+    ___________
+        generator - row tuples in staging column order
+    """
+
+    if workers <= 1:
+        for path in files:
+            yield from _parse_file((path, paths))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for path in files:
+            in_flight.append(executor.submit(_parse_file, (path, paths)))
+            if len(in_flight) >= workers * 2:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+
+def copy_rows(cur, table, columns, rows, chunk_rows=50000):
+    """Writing rows with COPY FROM STDIN in CSV chunks of bounded size.
+
+    Parameters
+    ___________
+        cur        : psycopg2 cursor object
+                    Cursor object for the target DB
+        table      : str
+                    Staging table name
+        columns    : list
+                    Column names in row order
+        rows       : iterable
+                    Row tuples, None is loaded as NULL
+        chunk_rows : int
+                    Number of rows sent per COPY
+
+    Returns
+    ___________
+        int - number of rows written
+    """
+
+    copy_query = "copy {} ({}) from stdin with csv".format(table, ', '.join(columns))
+    total = 0
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    pending = 0
+
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= chunk_rows:
+            buffer.seek(0)
+            cur.copy_expert(copy_query, buffer)
+            total += pending
+            pending = 0
+            buffer.seek(0)
+            buffer.truncate()
+
+    if pending:
+        buffer.seek(0)
+        cur.copy_expert(copy_query, buffer)
+        total += pending
+
+    return total
+
+
+def load_directory(cur, conn, table, columns, paths, directory, workers=1, chunk_rows=50000):
+    """Loading every json file below a directory into a staging table.
+
+    Parameters
+    ___________
+        cur        : psycopg2 cursor object
+                    Cursor object for the target DB
+        conn       : psycopg2 connection object
+                    Connection object for the target DB
+        table      : str
+                    Staging table name
+        columns    : list
+                    Staging column names
+        paths      : list
+                    Key path of each staging column
+        directory  : str
+                    Root directory of the json files
+        workers    : int
+                    Number of parsing processes
+        chunk_rows : int
+                    Number of rows sent per COPY
+
+    Returns
+    ___________
+        dict - rows, seconds and rows_per_second
+    """
+
+    start = time.time()
+    rows = copy_rows(cur, table, columns,
+                     iter_rows(iter_files(directory), paths, workers), chunk_rows)
+    elapsed = time.time() - start
+
+    stats = {'rows': rows, 'seconds': elapsed,
+             'rows_per_second': rows / elapsed if elapsed else 0.0}
+    print("{}: {} rows in {:.2f}s ({:.0f} rows/s)"
+          .format(table, rows, elapsed, stats['rows_per_second']))
+    return stats
+
+
+def load_staging_tables(cur, conn, config, workers=None, chunk_rows=50000):
+    """Loading events_stg and songs_stg from the local directories in dwh.cfg.
+
+    Nothing is committed, the caller commits both tables at once (etl.py runs
+    the load as one checkpointed step).
+
+    Parameters
+    ___________
+        cur        : psycopg2 cursor object
+                    Cursor object for the target DB
+        conn       : psycopg2 connection object
+                    Connection object for the target DB
+        config     : configparser.ConfigParser
+                    Loaded dwh.cfg, [LOCAL] section
+        workers    : int
+                    Number of parsing processes, defaults to [LOCAL] WORKERS
+        chunk_rows : int
+                    Number of rows sent per COPY
+
+    Returns
+    ___________
+        dict - load statistics per staging table
+    """
+
+    if workers is None:
+        workers = int(config.get('LOCAL', 'WORKERS', fallback='') or 1)
+
+    jsonpath_file = config.get('LOCAL', 'LOG_JSONPATH', fallback='')
+    events_paths = read_jsonpaths(jsonpath_file) if jsonpath_file else parse_jsonpaths(EVENTS_JSONPATHS)
+    songs_paths = [(column,) for column in SONGS_COLUMNS]
+
+    return {
+        'events_stg': load_directory(cur, conn, 'events_stg', EVENTS_COLUMNS, events_paths,
+                                     config.get('LOCAL', 'LOG_DATA'), workers, chunk_rows),
+        'songs_stg': load_directory(cur, conn, 'songs_stg', SONGS_COLUMNS, songs_paths,
+                                    config.get('LOCAL', 'SONG_DATA'), workers, chunk_rows),
+    }
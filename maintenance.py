@@ -0,0 +1,240 @@
+"""Post-load VACUUM/ANALYZE of sparkifydb tables
+COPY runs with compupdate off and the inserts append unsorted rows, so after a
+load the statistics of the Fact and Dimension tables are stale and their sort
+order degrades. This script reads the table statistics (svv_table_info on
+Redshift, pg_stat_user_tables on the PostgreSQL stand-in), picks the tables
+above the unsorted/stale statistics thresholds and runs ANALYZE or VACUUM SORT
+ONLY on them, most out of date first, until the time budget is used up.
+Statistics are printed before and after so the effect can be compared with
+the statement timings of instrumentation.py.
+
+Thresholds and budget are read from the [MAINTENANCE] section of dwh.cfg
+(UNSORTED_PCT, STATS_OFF_PCT, BUDGET_SECONDS).
+
+Usage:
+    python maintenance.py [--config dwh.cfg] [--dry-run]
+
+This file can also be imported as a module and contains the following
+functions:
+
+    * table_stats - Unsorted and stale statistics percentage per table.
+    * plan_maintenance - Choosing the ANALYZE/VACUUM statements to run.
+    * run_maintenance - Running the plan within a time budget.
+    * print_stats - Printing statistics before and after maintenance.
+    * maintain - Reading thresholds from the configuration and maintaining.
+    * main - the main function of the script
+"""
+
+# Importing system libraries
+import argparse
+import configparser
+import time
+
+# Importing user libraries
+from db_connection import connect, statement_timeout
+from pg_compat import is_redshift
+from sql_queries import postgres_table_stats_select, redshift_table_stats_select
+
+# Tables looked at, staging tables are truncated or dropped before every load
+MAINTAINED_TABLES = ['songs_plays_fact', 'users_dim', 'songs_dim', 'artists_dim', 'time_dim', 'song_lookup',
+                     'daily_song_plays', 'daily_artist_plays', 'daily_level_plays']
+
+DEFAULT_UNSORTED_PCT = 10.0
+DEFAULT_STATS_OFF_PCT = 10.0
+DEFAULT_BUDGET_SECONDS = 600
+
+
+def table_stats(cur, redshift=True, tables=None):
+    """Unsorted and stale statistics percentage per table.
+
+    Parameters
+    ___________
+        cur      : psycopg2 cursor object
+                  Cursor object for sparkifydb
+        redshift : bool
+                  Read svv_table_info, otherwise pg_stat_user_tables
+        tables   : list
+                  Tables to report, defaults to MAINTAINED_TABLES
+
+    Returns
+    ___________
+        dict - table name to {rows, unsorted, stats_off}
+    """
+
+    tables = MAINTAINED_TABLES if tables is None else tables
+    cur.execute(redshift_table_stats_select if redshift else postgres_table_stats_select)
+    return {table.strip(): {'rows': rows, 'unsorted': float(unsorted), 'stats_off': float(stats_off)}
+            for table, rows, unsorted, stats_off in cur.fetchall()
+            if table.strip() in tables}
+
+
+def plan_maintenance(stats, unsorted_pct=DEFAULT_UNSORTED_PCT, stats_off_pct=DEFAULT_STATS_OFF_PCT,
+                     redshift=True):
+    """Choosing the ANALYZE/VACUUM statements to run.
+
+    Tables furthest above a threshold come first, so a short budget is spent
+    where query plans suffer most. VACUUM SORT ONLY comes before the ANALYZE
+    of the same table since it changes the block layout ANALYZE samples.
+
+    Parameters
+    ___________
+        stats         : dict
+                       Output of table_stats
+        unsorted_pct  : float
+                       Vacuum tables with more unsorted rows (percent)
+        stats_off_pct : float
+                       Analyze tables with staler statistics (percent)
+        redshift      : bool
+                       Render Redshift statements, otherwise PostgreSQL
+
+    Returns
+    ___________
+        list - (table, statement) in the order they should run
+    """
+
+    candidates = []
+    for table, values in stats.items():
+        if not values['rows']:
+            continue
+        if values['unsorted'] > unsorted_pct:
+            statement = "vacuum sort only {};" if redshift else "vacuum {};"
+            candidates.append((values['unsorted'] - unsorted_pct, 0, table, statement.format(table)))
+        if values['stats_off'] > stats_off_pct:
+            candidates.append((values['stats_off'] - stats_off_pct, 1, table,
+                               "analyze {};".format(table)))
+
+    # Vacuum before analyze per table, then by distance above the threshold
+    excess = {}
+    for distance, _, table, _ in candidates:
+        excess[table] = max(excess.get(table, 0), distance)
+    candidates.sort(key=lambda c: (-excess[c[2]], c[2], c[1]))
+    return [(table, statement) for _, _, table, statement in candidates]
+
+
+def run_maintenance(cur, conn, plan, budget_seconds=DEFAULT_BUDGET_SECONDS):
+    """Running the planned statements within a time budget.
+
+    VACUUM cannot run inside a transaction block, so the statements run in
+    autocommit mode. Each statement is limited to the remaining budget with
+    statement_timeout; statements not started within the budget are skipped.
+
+    Parameters
+    ___________
+        cur            : psycopg2 cursor object
+                        Cursor object for sparkifydb
+        conn           : psycopg2 connection object
+                        Connection object for sparkifydb
+        plan           : list
+                        Output of plan_maintenance
+        budget_seconds : float
+                        Wall time available for all statements
+
+    Returns
+    ___________
+        list - (statement, seconds or None if skipped, error or None)
+    """
+
+    results = []
+    start = time.time()
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        for _, statement in plan:
+            remaining = budget_seconds - (time.time() - start)
+            if remaining <= 0:
+                results.append((statement, None, 'budget exhausted'))
+                continue
+            began = time.time()
+            try:
+                with statement_timeout(cur, remaining * 1000):
+                    cur.execute(statement)
+                results.append((statement, time.time() - began, None))
+            except Exception as e:
+                results.append((statement, time.time() - began, str(e).strip()))
+    finally:
+        conn.autocommit = autocommit
+    return results
+
+
+def print_stats(before, after, results):
+    """Printing statistics before and after maintenance.
+
+    Parameters
+    ___________
+        before  : dict
+                 table_stats before maintenance
+        after   : dict
+                 table_stats after maintenance
+        results : list
+                 Output of run_maintenance
+
+    Returns
+    ___________
+        None
+    """
+
+    for statement, seconds, error in results:
+        took = '-' if seconds is None else '{:.3f}s'.format(seconds)
+        print("{:<40} {:>10} {}".format(statement, took, error or ''))
+
+    print("{:<20} {:>12} {:>18} {:>18}".format('table', 'rows', 'unsorted %', 'stats_off %'))
+    for table in sorted(before):
+        old, new = before[table], after.get(table, before[table])
+        print("{:<20} {:>12} {:>8.1f} -> {:>6.1f} {:>8.1f} -> {:>6.1f}"
+              .format(table, new['rows'], old['unsorted'], new['unsorted'],
+                      old['stats_off'], new['stats_off']))
+
+
+def maintain(config, conn, dry_run=False):
+    """Reading thresholds from the configuration and maintaining the tables.
+
+    Parameters
+    ___________
+        config  : configparser.ConfigParser
+                 Configuration with an optional [MAINTENANCE] section
+        conn    : psycopg2 connection object
+                 Connection object for sparkifydb
+        dry_run : bool
+                 Only print the plan
+
+    Returns
+    ___________
+        list - output of run_maintenance, empty on a dry run
+    """
+
+    unsorted_pct = float(config.get('MAINTENANCE', 'UNSORTED_PCT', fallback='') or DEFAULT_UNSORTED_PCT)
+    stats_off_pct = float(config.get('MAINTENANCE', 'STATS_OFF_PCT', fallback='') or DEFAULT_STATS_OFF_PCT)
+    budget = float(config.get('MAINTENANCE', 'BUDGET_SECONDS', fallback='') or DEFAULT_BUDGET_SECONDS)
+
+    redshift = is_redshift(conn)
+    cur = conn.cursor()
+    before = table_stats(cur, redshift)
+    plan = plan_maintenance(before, unsorted_pct, stats_off_pct, redshift)
+    if dry_run or not plan:
+        for _, statement in plan:
+            print(statement)
+        if not plan:
+            print("All tables within thresholds, nothing to maintain")
+        return []
+
+    results = run_maintenance(cur, conn, plan, budget)
+    print_stats(before, table_stats(cur, redshift), results)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='VACUUM/ANALYZE tables above the staleness thresholds.')
+    parser.add_argument('--config', default='dwh.cfg', help='configuration file')
+    parser.add_argument('--dry-run', action='store_true', help='only print the statements')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+
+    conn = connect(config)
+    maintain(config, conn, args.dry_run)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Running the Redshift statements of sql_queries.py on PostgreSQL
+This script rewrites the Redshift specific parts of a statement so the same
+DDL and inserts can run against a local PostgreSQL stand-in (benchmarks,
+development, on-prem replicas).
+
+This file can also be imported as a module and contains the following
+functions:
+
+    * to_postgres - Rewriting a Redshift statement for PostgreSQL.
+    * is_redshift - Checking whether a connection points at Redshift.
+"""
+
+# Importing system libraries
+import re
+
+# (pattern, replacement) applied in order, case insensitive
+_REWRITES = [
+    (r'\bidentity\s*\(\s*0\s*,\s*1\s*\)', 'generated by default as identity (start with 0 minvalue 0)'),
+    (r'\bdiststyle\s+(even|all|key|auto)\b', ''),
+    (r'\b(compound\s+|interleaved\s+)?sortkey\s*\([^)]*\)', ''),
+    (r'\bdistkey\s*\([^)]*\)', ''),
+    (r'\b(sortkey|distkey)\b', ''),
+    (r'\bencode\s+\w+', ''),
+    (r'\bextract\s*\(\s*weekday\b', 'extract(dow'),
+    (r'\bgetdate\s*\(\s*\)', 'now()'),
+    (r'\bfnv_hash\s*\(', 'hashtextextended('),
+]
+
+
+def to_postgres(query):
+    """Rewriting a Redshift statement for PostgreSQL.
+
+    Distribution, sort key and encoding clauses are dropped, identity columns
+    become PostgreSQL identity columns and Redshift only functions are mapped
+    to their PostgreSQL equivalent.
+
+    Parameters
+    ___________
+        query : str
+               Redshift statement
+
+    Returns
+    ___________
+        str - PostgreSQL statement
+    """
+
+    for pattern, replacement in _REWRITES:
+        query = re.sub(pattern, replacement, query, flags=re.IGNORECASE)
+    return query
+
+
+def is_redshift(conn):
+    """Checking whether a connection points at Redshift.
+
+    Parameters
+    ___________
+        conn : psycopg2 connection object
+              Connection to check
+
+    Returns
+    ___________
+        bool
+    """
+
+    cur = conn.cursor()
+    try:
+        cur.execute("select version();")
+        return 'redshift' in cur.fetchone()[0].lower()
+    finally:
+        cur.close()
@@ -0,0 +1,333 @@
+"""Running any subset of the sparkifydb load steps
+create_tables.py and etl.py always run all of their steps. This script runs
+the selected steps only, in load order: drop, create, copy (S3 prefix COPY of
+both staging tables) and any of the inserts of sql_queries.py, which run in
+dependency order on pooled connections as in etl.py. 'inserts' selects all
+Fact and Dimension inserts, 'all' (the default) every step.
+
+--dry-run prints the rendered statements without connecting, configuration
+values the COPY statements need but are empty are printed as placeholders. --explain runs
+EXPLAIN on every statement of the selected inserts and reports the estimated
+cost, the join strategies (DS_DIST_NONE, DS_BCAST_INNER, ...) and the data
+redistribution steps of each plan; plans broadcasting or redistributing both
+sides of a join are flagged and make the script exit with status 1, so such
+regressions are caught before a production run. On a PostgreSQL stand-in the
+statements are rewritten by pg_compat.py and the join types are reported.
+
+Usage:
+    python pipeline.py [--config dwh.cfg] [--dry-run | --explain] [steps ...]
+    python pipeline.py create copy
+    python pipeline.py --explain inserts
+
+This file can also be imported as a module and contains the following
+functions:
+
+    * select_steps - Expanding the step names and aliases in load order.
+    * split_statements - Splitting a string of statements at semicolons.
+    * step_statements - Statements of the selected steps.
+    * parse_plan - Cost, joins and redistribution steps of an EXPLAIN plan.
+    * explain_steps - Running EXPLAIN on the statements of the selected inserts.
+    * print_explain_report - Printing the EXPLAIN report.
+    * run_steps - Running the selected steps.
+    * main - the main function of the script
+"""
+
+# Importing system libraries
+import argparse
+import configparser
+import re
+import sys
+import time
+
+# Importing user libraries
+from db_connection import ConnectionPool
+from etl import insert_tables_parallel
+import instrumentation
+from pg_compat import is_redshift, to_postgres
+from query_cache import _LITERAL
+from sql_queries import (copy_table_names, create_table_queries, drop_table_queries,
+                         insert_table_nodes, render_statement, user_history_nodes)
+
+# Insert DAG nodes by step name
+INSERT_NODES = {node[0]: node for node in insert_table_nodes + user_history_nodes}
+
+# Steps in load order
+STEPS = ['drop', 'create', 'copy'] + [node[0] for node in insert_table_nodes + user_history_nodes]
+
+# Step aliases
+ALIASES = {
+    'inserts': [node[0] for node in insert_table_nodes],
+    'all': ['drop', 'create', 'copy'] + [node[0] for node in insert_table_nodes],
+}
+
+# Join strategies that do not move rows between nodes
+NO_REDISTRIBUTION = ('DS_DIST_NONE', 'DS_DIST_ALL_NONE')
+
+# Join strategies flagged in the EXPLAIN report
+FLAGGED_STRATEGIES = ('DS_BCAST_INNER', 'DS_DIST_BOTH', 'DS_DIST_ALL_INNER')
+
+
+def select_steps(names):
+    """Expanding step names and aliases into the steps to run, in load order.
+
+    Parameters
+    ___________
+        names : list
+               Step names or aliases ('inserts', 'all')
+
+    Returns
+    ___________
+        list - steps in load order
+    """
+
+    selected = set()
+    for name in names:
+        if name not in STEPS and name not in ALIASES:
+            raise ValueError("Unknown step " + name)
+        selected.update(ALIASES.get(name, [name]))
+    return [step for step in STEPS if step in selected]
+
+
+def split_statements(query):
+    """Splitting a string of statements at the semicolons outside literals.
+
+    Parameters
+    ___________
+        query : str
+               One or more SQL statements
+
+    Returns
+    ___________
+        list - statements without the trailing semicolon
+    """
+
+    statements = []
+    current = ''
+    for i, part in enumerate(_LITERAL.split(query)):
+        if i % 2:
+            current += part
+            continue
+        pieces = part.split(';')
+        for piece in pieces[:-1]:
+            statements.append(current + piece)
+            current = ''
+        current += pieces[-1]
+    statements.append(current)
+    return [statement.strip() for statement in statements if statement.strip()]
+
+
+def step_statements(steps, config, placeholders=False):
+    """Statements of the selected steps.
+
+    Parameters
+    ___________
+        steps        : list
+                      Output of select_steps
+        config       : configparser.ConfigParser
+                      Configuration the COPY statements are rendered with
+        placeholders : bool
+                      Render empty configuration values as placeholders
+
+    Returns
+    ___________
+        list - (step, statement)
+    """
+
+    statements = []
+    for step in steps:
+        if step == 'drop':
+            statements.extend((step, query) for query in drop_table_queries)
+        elif step == 'create':
+            statements.extend((step, query) for query in create_table_queries)
+        elif step == 'copy':
+            statements.extend((step, render_statement(name, config, placeholders))
+                              for name in copy_table_names)
+        else:
+            statements.append((step, INSERT_NODES[step][1]))
+    return statements
+
+
+def parse_plan(lines):
+    """Cost, joins and redistribution steps of an EXPLAIN plan.
+
+    Parameters
+    ___________
+        lines : list
+               Lines of the plan as returned by EXPLAIN
+
+    Returns
+    ___________
+        dict - cost (total estimate of the top node), joins (join nodes with
+               their strategy), redistribution (steps moving rows between
+               nodes) and flagged (strategies of FLAGGED_STRATEGIES used)
+    """
+
+    cost = None
+    joins = []
+    redistribution = []
+    for i, line in enumerate(lines):
+        node = line.strip()
+        if node.startswith('->'):
+            node = node[2:].strip()
+        match = re.search(r'\(cost=[\d.]+\.\.([\d.]+)', node)
+        if match and cost is None:
+            cost = float(match.group(1))
+        name = node.split('(cost=')[0].strip()
+        if re.search(r'\b(Join|Nested Loop)\b', name):
+            joins.append(name)
+        for strategy in re.findall(r'\bDS_[A-Z_]+\b', name):
+            if strategy not in NO_REDISTRIBUTION:
+                redistribution.append(strategy)
+        # The kind of network step is given on the line below the node
+        if name.startswith('XN Network'):
+            detail = lines[i + 1].strip() if i + 1 < len(lines) else ''
+            if re.match(r'(Distribute|Broadcast)\b', detail):
+                redistribution.append('XN Network ' + detail)
+
+    text = '\n'.join(lines)
+    flagged = [strategy for strategy in FLAGGED_STRATEGIES if strategy in text]
+    return {'cost': cost, 'joins': joins, 'redistribution': redistribution, 'flagged': flagged}
+
+
+def explain_steps(cur, steps, rewrite=None):
+    """Running EXPLAIN on every statement of the selected inserts.
+
+    Parameters
+    ___________
+        cur     : psycopg2 cursor object
+                 Cursor object for sparkifydb
+        steps   : list
+                 Output of select_steps, steps other than inserts are skipped
+        rewrite : callable
+                 Applied to every statement, e.g. pg_compat.to_postgres
+
+    Returns
+    ___________
+        list - (step, statement number, output of parse_plan)
+    """
+
+    report = []
+    for step in steps:
+        if step not in INSERT_NODES:
+            continue
+        for number, statement in enumerate(split_statements(INSERT_NODES[step][1]), 1):
+            cur.execute("explain " + (rewrite(statement) if rewrite else statement))
+            report.append((step, number, parse_plan([row[0] for row in cur.fetchall()])))
+    return report
+
+
+def print_explain_report(report):
+    """Printing the EXPLAIN report, one line per statement.
+
+    Parameters
+    ___________
+        report : list
+                Output of explain_steps
+
+    Returns
+    ___________
+        None
+    """
+
+    for step, number, plan in report:
+        cost = '{:.2f}'.format(plan['cost']) if plan['cost'] is not None else '-'
+        print("{:<25} #{} cost {:>16} {} redistribution step(s){}".format(
+            step, number, cost, len(plan['redistribution']),
+            '  FLAGGED: ' + ', '.join(plan['flagged']) if plan['flagged'] else ''))
+        for join in plan['joins']:
+            print("    join: " + join)
+        for redistribution in plan['redistribution']:
+            print("    redistribution: " + redistribution)
+
+
+def run_steps(pool, steps, config, redshift=True):
+    """Running the selected steps.
+
+    Drop, create and copy statements run one transaction each, the selected
+    inserts run in dependency order on pooled connections.
+
+    Parameters
+    ___________
+        pool     : db_connection.ConnectionPool
+                  Pool the connections are borrowed from
+        steps    : list
+                  Output of select_steps
+        config   : configparser.ConfigParser
+                  Configuration the COPY statements are rendered with
+        redshift : bool
+                  False rewrites the statements for PostgreSQL
+
+    Returns
+    ___________
+        None
+    """
+
+    rewrite = (lambda query: query) if redshift else to_postgres
+    if 'copy' in steps and not redshift:
+        raise ValueError("COPY from S3 needs Redshift, use etl.py --staging local instead")
+
+    with pool.connection() as conn:
+        cur = conn.cursor()
+        for step, statement in step_statements([s for s in steps if s not in INSERT_NODES], config):
+            cur.execute(rewrite(statement))
+            conn.commit()
+        cur.close()
+
+    nodes = [(name, rewrite(query), reads, writes)
+             for name, query, reads, writes in (INSERT_NODES[step] for step in steps if step in INSERT_NODES)]
+    if nodes:
+        insert_tables_parallel(pool, nodes=nodes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run selected sparkifydb load steps.')
+    parser.add_argument('--config', default='dwh.cfg', help='configuration file')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--dry-run', action='store_true', help='print the statements without running them')
+    mode.add_argument('--explain', action='store_true', help='report the EXPLAIN plans of the inserts')
+    parser.add_argument('steps', nargs='*',
+                        help='steps to run, in load order, all by default: ' + ', '.join(STEPS + sorted(ALIASES)))
+    args = parser.parse_args()
+
+    try:
+        steps = select_steps(args.steps or ['all'])
+    except ValueError as e:
+        parser.error(str(e))
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+
+    # Reporting missing COPY settings before connecting
+    if 'copy' in steps and not (args.dry_run or args.explain):
+        try:
+            step_statements(['copy'], config)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.dry_run:
+        for step, statement in step_statements(steps, config, placeholders=True):
+            print("-- " + step)
+            print(statement.strip())
+        return
+
+    pool = ConnectionPool(config)
+    try:
+        with pool.connection() as conn:
+            redshift = is_redshift(conn)
+            if args.explain:
+                report = explain_steps(conn.cursor(), steps, None if redshift else to_postgres)
+                print_explain_report(report)
+                if any(plan['flagged'] for _, _, plan in report):
+                    sys.exit(1)
+                return
+        run_steps(pool, steps, config, redshift)
+
+        # Summarising per statement timings (when [LOG] STATEMENT_LOG is set)
+        with pool.connection() as conn:
+            instrumentation.report(config, conn, 'pipeline-' + time.strftime('%Y%m%d%H%M%S'))
+    finally:
+        pool.closeall()
+
+
+if __name__ == "__main__":
+    main()
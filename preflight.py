@@ -0,0 +1,382 @@
+"""Validating Song and Event json files before they are COPYed
+One malformed file makes a whole COPY fail after the cluster has worked on it
+for minutes. This script reads the source files (local directories or S3) in
+parallel and checks every record against the column types of events_stg and
+songs_stg (varchar lengths in bytes, smallint/integer/bigint ranges, numbers).
+Files with bad records are quarantined before COPY: local files are moved to
+[LOCAL] QUARANTINE, S3 files are copied to [S3] QUARANTINE_PREFIX and left out
+of the COPY manifests. On Redshift, rows rejected by COPY itself (up to [S3]
+MAXERROR) are read back from stl_load_errors.
+
+Usage:
+    python preflight.py [--config dwh.cfg] [--local] [--quarantine]
+
+This file can also be imported as a module and contains the following
+functions:
+
+    * column_rules - Type checks of the columns of a CREATE TABLE statement.
+    * check_record - Checking one record against the column rules.
+    * validate_local - Validating the json files below a local directory.
+    * validate_s3 - Validating the json files under an S3 prefix.
+    * quarantine_local - Moving bad local files to the quarantine directory.
+    * quarantine_s3 - Copying bad S3 files to the quarantine prefix.
+    * preflight - Validating and quarantining the sources of both staging tables.
+    * print_load_errors - Printing rows rejected by the latest COPY (Redshift).
+    * main - the main function of the script
+"""
+
+# Importing system libraries
+import argparse
+import configparser
+import json
+import math
+import os
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Importing user libraries
+from local_loader import (EVENTS_JSONPATHS, SONGS_COLUMNS, _lookup, iter_files, parse_jsonpaths,
+                          read_jsonpaths)
+from s3_utils import s3_client, split_s3_uri
+from schema_advisor import parse_create
+from sql_queries import load_errors_select, staging_events_table_create, staging_songs_table_create
+from staging_loader import list_objects
+
+# Value ranges of the integer column types
+INTEGER_RANGES = {
+    'smallint': (-2 ** 15, 2 ** 15 - 1),
+    'integer': (-2 ** 31, 2 ** 31 - 1),
+    'bigint': (-2 ** 63, 2 ** 63 - 1),
+}
+
+# Errors reported per file
+MAX_FILE_ERRORS = 5
+
+
+def column_rules(create_query):
+    """Type checks of the columns of a CREATE TABLE statement.
+
+    Parameters
+    ___________
+        create_query : str
+                      CREATE TABLE statement from sql_queries.py
+
+    Returns
+    ___________
+        list - (column, kind, limit) in table order; kind is 'string' with the
+               byte length, 'integer' with the (min, max) range or 'number'
+    """
+
+    rules = []
+    for name, column_type, _ in parse_create(create_query)[1]:
+        match = re.match(r'(\w+)\s*(?:\((\d+)\))?', column_type)
+        base, length = match.group(1), match.group(2)
+        if base == 'varchar':
+            rules.append((name, 'string', int(length or 256)))
+        elif base in ('char', 'character'):
+            rules.append((name, 'string', int(length or 1)))
+        elif base in INTEGER_RANGES:
+            rules.append((name, 'integer', INTEGER_RANGES[base]))
+        else:
+            rules.append((name, 'number', None))
+    return rules
+
+
+def check_record(values, rules):
+    """Checking one record against the column rules.
+
+    Values are accepted the way COPY accepts them: nulls load as NULL, numbers
+    may be json numbers or numeric strings. NaN and infinite numbers are bad.
+
+    Parameters
+    ___________
+        values : tuple
+                Values of the record in table column order
+        rules  : list
+                Output of column_rules
+
+    Returns
+    ___________
+        str - description of the first bad value, None if the record is valid
+    """
+
+    for value, (name, kind, limit) in zip(values, rules):
+        if value is None or value == '':
+            continue
+        if kind == 'string':
+            size = len(str(value).encode('utf-8'))
+            if size > limit:
+                return "{} is {} bytes, longer than {}".format(name, size, limit)
+            continue
+        try:
+            number = float(value)
+            if not math.isfinite(number):
+                return "{} is not a finite number: {!r}".format(name, value)
+            if kind == 'integer' and (number != int(number) or not limit[0] <= number <= limit[1]):
+                return "{} out of range: {!r}".format(name, value)
+        except (TypeError, ValueError, OverflowError):
+            return "{} is not a number: {!r}".format(name, value)
+    return None
+
+
+def _validate_text(text, paths, rules):
+    """Validating the records of one json file, returning (records, errors)."""
+
+    errors = []
+    try:
+        records = [json.loads(text)]
+    except ValueError:
+        records = []
+        for number, line in enumerate(text.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError as e:
+                errors.append("line {}: invalid json ({})".format(number, e))
+
+    for number, record in enumerate(records, 1):
+        if not isinstance(record, dict):
+            error = "not a json object: {}".format(type(record).__name__)
+        else:
+            error = check_record(tuple(_lookup(record, keys) for keys in paths), rules)
+        if error:
+            errors.append("record {}: {}".format(number, error))
+        if len(errors) >= MAX_FILE_ERRORS:
+            break
+    return len(records), errors[:MAX_FILE_ERRORS]
+
+
+def _validate_file(args):
+    """Validating one local file (runs in worker processes)."""
+
+    path, paths, rules = args
+    with open(path, encoding='utf-8', errors='replace') as f:
+        records, errors = _validate_text(f.read(), paths, rules)
+    return path, records, errors
+
+
+def validate_local(directory, paths, rules, workers=1):
+    """Validating the json files below a local directory.
+
+    Parameters
+    ___________
+        directory : str
+                   Root directory of the json files
+        paths     : list
+                   Key path of each column, see local_loader.parse_jsonpaths
+        rules     : list
+                   Output of column_rules
+        workers   : int
+                   Number of validating processes
+
+    Returns
+    ___________
+        list - (path, records, errors) per file
+    """
+
+    tasks = ((path, paths, rules) for path in iter_files(directory))
+    if workers <= 1:
+        return [_validate_file(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_validate_file, tasks, chunksize=16))
+
+
+def validate_s3(s3, uri, paths, rules, max_workers=8, sources=None):
+    """Validating the json files under an S3 prefix.
+
+    Parameters
+    ___________
+        s3          : boto3 S3 client
+        uri         : str
+                     S3 URI of the prefix
+        paths       : list
+                     Key path of each column, see local_loader.parse_jsonpaths
+        rules       : list
+                     Output of column_rules
+        max_workers : int
+                     Files read at the same time
+        sources     : list
+                     s3:// URIs of the files to validate, all files under
+                     the prefix if None
+
+    Returns
+    ___________
+        list - (s3:// URI, records, errors) per file
+    """
+
+    def validate(source):
+        bucket, key = split_s3_uri(source)
+        text = s3.get_object(Bucket=bucket, Key=key)['Body'].read().decode('utf-8', errors='replace')
+        return (source,) + _validate_text(text, paths, rules)
+
+    if sources is None:
+        sources = [source for source, _ in list_objects(s3, uri)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(validate, sources))
+
+
+def quarantine_local(results, directory, quarantine):
+    """Moving bad local files to the quarantine directory.
+
+    Parameters
+    ___________
+        results    : list
+                    Output of validate_local
+        directory  : str
+                    Root directory the files were read from
+        quarantine : str
+                    Directory the files are moved to, keeping their sub path
+
+    Returns
+    ___________
+        list - moved files
+    """
+
+    moved = []
+    for path, _, errors in results:
+        if errors:
+            target = os.path.join(quarantine, os.path.relpath(path, directory))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(path, target)
+            moved.append(path)
+    return moved
+
+
+def quarantine_s3(s3, results, uri, quarantine_uri):
+    """Copying bad S3 files to the quarantine prefix, the sources are kept.
+
+    Parameters
+    ___________
+        s3             : boto3 S3 client
+        results        : list
+                        Output of validate_s3
+        uri            : str
+                        S3 URI of the prefix the files were read from
+        quarantine_uri : str
+                        S3 URI of the quarantine prefix
+
+    Returns
+    ___________
+        set - s3:// URIs of the bad files, to be left out of COPY
+    """
+
+    _, prefix = split_s3_uri(uri)
+    target_bucket, target_prefix = split_s3_uri(quarantine_uri)
+    bad = set()
+    for source, _, errors in results:
+        if errors:
+            bucket, key = split_s3_uri(source)
+            target_key = target_prefix.rstrip('/') + '/' + key[len(prefix):].lstrip('/')
+            s3.copy_object(Bucket=target_bucket, Key=target_key, CopySource={'Bucket': bucket, 'Key': key})
+            bad.add(source)
+    return bad
+
+
+def _sources(config):
+    """(table, rules, key paths, [LOCAL]/[S3] option) of both staging tables."""
+
+    jsonpath_file = config.get('LOCAL', 'LOG_JSONPATH', fallback='')
+    events_paths = read_jsonpaths(jsonpath_file) if jsonpath_file else parse_jsonpaths(EVENTS_JSONPATHS)
+    return [('events_stg', column_rules(staging_events_table_create), events_paths, 'LOG_DATA'),
+            ('songs_stg', column_rules(staging_songs_table_create),
+             [(column,) for column in SONGS_COLUMNS], 'SONG_DATA')]
+
+
+def preflight(config, s3=None, local=False, quarantine=True, workers=None, keys=None):
+    """Validating and quarantining the sources of both staging tables.
+
+    Parameters
+    ___________
+        config     : configparser.ConfigParser
+                    Loaded dwh.cfg
+        s3         : boto3 S3 client
+                    Needed unless local
+        local      : bool
+                    Validate the [LOCAL] directories instead of S3
+        quarantine : bool
+                    Quarantine bad files, otherwise only report them
+        workers    : int
+                    Parallel readers, defaults to [LOCAL] WORKERS or 8 for S3
+        keys       : dict
+                    s3:// URIs per staging table validated instead of the
+                    whole prefixes, e.g. the new files of an incremental load
+
+    Returns
+    ___________
+        tuple - (statistics per staging table, set of bad files)
+    """
+
+    if workers is None:
+        workers = int(config.get('LOCAL', 'WORKERS', fallback='') or 1) if local else 8
+
+    stats = {}
+    bad = set()
+    for table, rules, paths, option in _sources(config):
+        if local:
+            directory = config.get('LOCAL', option)
+            results = validate_local(directory, paths, rules, workers)
+        else:
+            uri = config.get('S3', option)
+            results = validate_s3(s3, uri, paths, rules, workers, None if keys is None else keys.get(table, []))
+
+        failed = [(source, errors) for source, _, errors in results if errors]
+        for source, errors in failed:
+            print("{}: {}".format(source, '; '.join(errors)))
+        stats[table] = {'files': len(results), 'records': sum(records for _, records, _ in results),
+                        'bad_files': len(failed)}
+
+        if quarantine and failed:
+            if local:
+                quarantine_local(results, directory,
+                                 os.path.join(config.get('LOCAL', 'QUARANTINE'), table))
+            else:
+                quarantine_s3(s3, results, uri,
+                              config.get('S3', 'QUARANTINE_PREFIX').strip().strip("'\"").rstrip('/') + '/' + table)
+        bad.update(source for source, _ in failed)
+    return stats, bad
+
+
+def print_load_errors(cur, limit=20):
+    """Printing rows rejected by the latest COPY statements of the session.
+
+    Parameters
+    ___________
+        cur   : psycopg2 cursor object
+               Cursor on the connection that ran the COPY (Redshift)
+        limit : int
+               Number of rejected rows printed
+
+    Returns
+    ___________
+        int - number of rows printed
+    """
+
+    cur.execute(load_errors_select, (limit,))
+    rows = cur.fetchall()
+    for filename, line_number, column, value, reason in rows:
+        print("{}:{} {} {!r}: {}".format(filename, line_number, column, value, reason))
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Validate Song and Event json files before COPY.')
+    parser.add_argument('--config', default='dwh.cfg', help='configuration file')
+    parser.add_argument('--local', action='store_true', help='validate the [LOCAL] directories')
+    parser.add_argument('--quarantine', action='store_true', help='quarantine bad files')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+
+    s3 = None
+    if not args.local:
+        s3 = s3_client(config)
+
+    stats, _ = preflight(config, s3, args.local, args.quarantine)
+    print(stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""Cached analytical queries on the sparkifydb star schema
+Dashboards run the same aggregates over songs_plays_fact again and again while
+the data only changes when etl.py loads. This script runs such queries over the
+connection settings of dwh.cfg and keeps each result set as a Parquet file,
+keyed by the normalized SQL and its parameters. Every completed load adds a row
+to etl_load_generations; results cached for an older load are not used again.
+The latest load is looked up at most every CHECK_SECONDS, so repeated reads in
+between are served from disk without touching the cluster.
+
+Cache directory and check interval are read from the [CACHE] section of dwh.cfg
+(DIRECTORY, CHECK_SECONDS). Requires pyarrow.
+
+Usage:
+    python query_cache.py [--config dwh.cfg] [--refresh] top_songs plays_per_hour
+
+This file can also be imported as a module and contains the following
+functions and classes:
+
+    * normalize_sql - Normalizing a statement for use as cache key.
+    * bump_generation - Recording a completed load, invalidating cached results.
+    * QueryCache - Running queries with results cached per load.
+    * main - the main function of the script
+"""
+
+# Importing system libraries
+import argparse
+import configparser
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+
+# Importing user libraries
+from db_connection import connect
+from sql_queries import dashboard_queries, load_generation_insert, load_generation_select
+
+DEFAULT_DIRECTORY = '.query_cache'
+DEFAULT_CHECK_SECONDS = 30
+
+# Quoted SQL string literals, also used by pipeline.py
+_LITERAL = re.compile(r"('(?:[^']|'')*')")
+
+# Names of the per generation sub directories, see QueryCache.generation
+_GENERATION = re.compile(r'^(\d{20}|initial)$')
+
+
+def normalize_sql(query):
+    """Normalizing a statement for use as cache key.
+
+    Whitespace is collapsed, the trailing semicolon dropped and everything
+    outside string literals lower cased, so formatting does not split the cache.
+
+    Parameters
+    ___________
+        query : str
+               SQL statement
+
+    Returns
+    ___________
+        str - normalized statement
+    """
+
+    parts = _LITERAL.split(query.strip().rstrip(';').strip())
+    return ''.join(part if i % 2 else re.sub(r'\s+', ' ', part).lower()
+                   for i, part in enumerate(parts))
+
+
+def bump_generation(cur, conn):
+    """Recording a completed load, results cached before it are not used again.
+
+    Parameters
+    ___________
+        cur  : psycopg2 cursor object
+              Cursor object for sparkifydb
+        conn : psycopg2 connection object
+              Connection object for sparkifydb
+
+    Returns
+    ___________
+        None
+    """
+
+    cur.execute(load_generation_insert)
+    conn.commit()
+
+
+class QueryCache:
+    """Running queries with result sets cached on disk per load.
+
+    Parameters
+    ___________
+        config        - Loaded dwh.cfg
+        directory     - Cache directory, defaults to [CACHE] DIRECTORY
+        check_seconds - Seconds the latest load is trusted before it is looked
+                        up again, defaults to [CACHE] CHECK_SECONDS
+    """
+
+    def __init__(self, config, directory=None, check_seconds=None):
+        self.config = config
+        self.directory = directory or config.get('CACHE', 'DIRECTORY', fallback='') or DEFAULT_DIRECTORY
+        if check_seconds is None:
+            check_seconds = float(config.get('CACHE', 'CHECK_SECONDS', fallback='') or DEFAULT_CHECK_SECONDS)
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._conn = None
+        self._generation = None
+        self._checked_at = 0.0
+
+    @property
+    def connection(self):
+        """DB connection opened on first use."""
+
+        with self._lock:
+            if self._conn is None or self._conn.closed:
+                self._conn = connect(self.config)
+            return self._conn
+
+    def generation(self, max_age=None):
+        """Latest completed load, looked up at most every check_seconds.
+
+        Parameters
+        ___________
+            max_age - Oldest acceptable lookup in seconds, defaults to check_seconds
+        Returns
+        ___________
+            str - generation the cached results belong to
+        """
+
+        max_age = self.check_seconds if max_age is None else max_age
+        if self._generation is not None and time.time() - self._checked_at <= max_age:
+            return self._generation
+
+        cur = self.connection.cursor()
+        cur.execute(load_generation_select)
+        loaded_at = cur.fetchone()[0]
+        cur.close()
+
+        generation = loaded_at.strftime('%Y%m%d%H%M%S%f') if loaded_at else 'initial'
+        if generation != self._generation:
+            self._prune(generation)
+        self._generation, self._checked_at = generation, time.time()
+        return generation
+
+    def _prune(self, generation):
+        """Removing results cached for older loads.
+
+        Only generation sub directories are removed, anything else in the
+        cache directory is left alone.
+        """
+
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name != generation and _GENERATION.match(name) and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def path(self, query, params=None, generation=None):
+        """Parquet file holding the result of a query for a generation."""
+
+        key = hashlib.sha1(repr((normalize_sql(query), params)).encode()).hexdigest()
+        return os.path.join(self.directory, generation or self.generation(), key + '.parquet')
+
+    def query(self, query, params=None, refresh=False):
+        """Result of a query, from the cache if it ran since the latest load.
+
+        Parameters
+        ___________
+            query   - SQL statement
+            params  - Statement parameters
+            refresh - Run the query even if a cached result exists
+        Returns
+        ___________
+            pyarrow.Table - result set
+        """
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        path = self.path(query, params)
+        if not refresh and os.path.exists(path):
+            return pq.read_table(path)
+
+        cur = self.connection.cursor()
+        cur.execute(query, params)
+        rows = cur.fetchall()
+        names = [column[0] for column in cur.description]
+        cur.close()
+        table = pa.Table.from_arrays([pa.array(list(column)) for column in zip(*rows)] if rows
+                                     else [pa.array([]) for _ in names], names=names)
+
+        # Writing to a temporary file first so readers never see a partial file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = '{}.{}.tmp'.format(path, threading.get_ident())
+        pq.write_table(table, temporary)
+        os.replace(temporary, path)
+        return table
+
+    def close(self):
+        """Closing the DB connection, cached results stay on disk."""
+
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run dashboard queries with cached results.')
+    parser.add_argument('--config', default='dwh.cfg', help='configuration file')
+    parser.add_argument('--refresh', action='store_true', help='ignore cached results')
+    parser.add_argument('queries', nargs='*',
+                        help='dashboard queries to run, all by default: ' + ', '.join(sorted(dashboard_queries)))
+    args = parser.parse_args()
+
+    unknown = [name for name in args.queries if name not in dashboard_queries]
+    if unknown:
+        parser.error("unknown dashboard queries: " + ', '.join(unknown))
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+
+    cache = QueryCache(config)
+    for name in args.queries or sorted(dashboard_queries):
+        start = time.time()
+        table = cache.query(dashboard_queries[name], refresh=args.refresh)
+        print("-- {} ({:.3f}s)".format(name, time.time() - start))
+        print('\t'.join(table.column_names))
+        for row in table.to_pylist():
+            print('\t'.join(str(value) for value in row.values()))
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
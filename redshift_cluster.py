@@ -1,169 +1,672 @@
-"""Functions to state maintain redshift cluster on AWS. 
+"""Functions to state maintain redshift cluster on AWS.
+
+All operations go through a ClusterManager, which reads dwh.cfg once and
+lazily creates and caches one boto3 session with its IAM and Redshift
+clients. describe_clusters results are cached for a few seconds, so polling
+redshiftProps in a loop does not rebuild clients or hammer the API.
+
+The manager also controls capacity around the ETL window: it estimates the
+number of nodes from the size of the S3 input, resizes the cluster (elastic
+resize) up before a load and back down afterwards, pauses and resumes it,
+and creates scheduled pause/resume actions. Each transition is waited for and
+its duration printed. Clients can be passed in, e.g. botocore Stubber or moto
+backed clients in tests.
 
 This file can also be imported as a module and contains the following
-functions:
+functions and classes:
 
-    * create_iam_role - Creating IAM role on AWS and attaching appropriate policy.   
-    * create_redshift_cluster - Create redshift cluster and starting it. 
+    * ClusterManager - Cached boto3 session and clients with cluster operations.
+    * create_iam_role - Creating IAM role on AWS and attaching appropriate policy.
+    * create_redshift_cluster - Create redshift cluster and starting it.
     * redshiftProps - Returns properties of Redshift cluster.
     * delete_redshift_cluster - Deleting the redshift cluster from AWS.
+    * wait_for_cluster - Waiting for a cluster status with exponential backoff.
+    * write_cluster_config - Writing HOST and ARN back into the config file.
+    * provision_cluster - Creating IAM role and cluster concurrently and
+      waiting until the cluster can be used.
+    * resize_cluster - Elastic resize to a number of nodes.
+    * pause_cluster - Pausing the cluster.
+    * resume_cluster - Resuming a paused cluster.
 """
 
+# Importing system libraries
+import configparser
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Defaults of the [CAPACITY] section of dwh.cfg
+DEFAULT_GB_PER_NODE = 50
+DEFAULT_MIN_NODES = 2
+DEFAULT_MAX_NODES = 8
+
+
+class ClusterManager:
+    """Cached boto3 session and clients with the cluster operations.
+
+    Parameters
+    ___________
+        config_file - Configuration file, read once
+        region      - AWS region of the cluster
+        cache_ttl   - Seconds describe_clusters results are reused
+        clients     - boto3 clients per service to use instead of creating them
+    """
+
+    def __init__(self, config_file='dwh.cfg', region='us-west-2', cache_ttl=5, clients=None):
+        self.config_file = config_file
+        self.region = region
+        self.cache_ttl = cache_ttl
+        self.config = configparser.ConfigParser()
+        self.config.read(config_file)
+        self._lock = threading.Lock()
+        self._session = None
+        self._clients = dict(clients or {})
+        self._described = None
+        self._described_at = 0.0
+
+    @property
+    def session(self):
+        """boto3 session created on first use."""
+
+        with self._lock:
+            if self._session is None:
+                import boto3
+
+                self._session = boto3.session.Session(
+                                    aws_access_key_id=self.config.get('AWS','KEY'),
+                                    aws_secret_access_key=self.config.get('AWS','SECRET'),
+                                    region_name=self.region
+                                   )
+            return self._session
+
+    def client(self, service):
+        """boto3 client of the cached session, created on first use."""
+
+        with self._lock:
+            if service in self._clients:
+                return self._clients[service]
+        session = self.session
+        with self._lock:
+            if service not in self._clients:
+                self._clients[service] = session.client(service)
+            return self._clients[service]
+
+    @property
+    def iam(self):
+        return self.client('iam')
+
+    @property
+    def redshift(self):
+        return self.client('redshift')
+
+    @property
+    def identifier(self):
+        return self.config.get('CLUSTER','CLUSTER_IDENTIFIER')
+
+    def invalidate(self):
+        """Dropping the cached describe_clusters result."""
+
+        with self._lock:
+            self._described = None
+
+    def describe_cluster(self, max_age=None):
+        """Properties of the cluster, cached for cache_ttl seconds.
+
+        Parameters
+        ___________
+            max_age - Oldest acceptable cached result in seconds, defaults to cache_ttl
+        Returns
+        ___________
+            dict - describe_clusters entry of the cluster
+        """
+
+        max_age = self.cache_ttl if max_age is None else max_age
+        with self._lock:
+            if self._described is not None and time.time() - self._described_at <= max_age:
+                return self._described
+
+        props = self.redshift.describe_clusters(ClusterIdentifier=self.identifier)['Clusters'][0]
+        with self._lock:
+            self._described, self._described_at = props, time.time()
+        return props
+
+    def create_iam_role(self):
+        """Creating IAM role and adding read only access on S3 bucket.
+
+        Parameters
+        ___________
+            None
+        Returns
+        ___________
+            arn - Amazon resource name
+        """
+
+        role_name = self.config.get("IAM_ROLE","ROLE_NAME")
+        roleArn = None
+
+        try:
+            roleArn = self.iam.create_role(
+                          Path='/',
+                          RoleName=role_name,
+                          Description = "Allows Redshift clusters to call AWS services on your behalf.",
+                          AssumeRolePolicyDocument=json.dumps(
+                                                             {'Statement': [{'Action': 'sts:AssumeRole',
+                                                              'Effect': 'Allow',
+                                                              'Principal': {'Service': 'redshift.amazonaws.com'}}],
+                                                              'Version': '2012-10-17'})
+                         )['Role']['Arn']
+        except Exception as e:
+            print(e)
+
+        try:
+            self.iam.attach_role_policy(RoleName=role_name,
+                                        PolicyArn="arn:aws:iam::aws:policy/AmazonS3ReadOnlyAccess"
+                                       )
+        except Exception as e:
+            print(e)
+
+        # Role existed already, looking its ARN up
+        if roleArn is None:
+            try:
+                roleArn = self.iam.get_role(RoleName=role_name)['Role']['Arn']
+            except Exception as e:
+                print(e)
+
+        return roleArn
+
+    def create_redshift_cluster(self, arn=None):
+        """Creating redshift cluster and starting it.
+
+        An existing cluster of the same identifier is kept, any other error is
+        raised, so provision_cluster does not wait for a cluster that was never
+        created.
+
+        Parameters
+        ___________
+            arn - IAM role attached to the cluster, None to attach it later
+        Returns
+        ___________
+            None
+        """
+
+        config = self.config
+        try:
+            self.redshift.create_cluster(
+                              ClusterType=config.get('HARDWARE','CLUSTER_TYPE'),
+                              NodeType=config.get('HARDWARE','NODE_TYPE'),
+                              NumberOfNodes=int(config.get('HARDWARE','NUM_NODES')),
+                              DBName=config.get('DB','DB_NAME'),
+                              ClusterIdentifier=self.identifier,
+                              MasterUsername=config.get('DB','DB_NAME'),
+                              MasterUserPassword=config.get('DB','DB_PASSWORD'),
+                              IamRoles=[arn] if arn else []
+                             )
+        except self.redshift.exceptions.ClusterAlreadyExistsFault as e:
+            print(e)
+        self.invalidate()
+
+    def redshift_props(self):
+        """Accessing properties of redshift cluster.
+
+        Parameters
+        ___________
+            None
+        Returns
+        ___________
+            Pandas Data frame - Properties of redshift cluster.
+        """
+
+        import pandas as pd
+
+        myClusterProps = self.describe_cluster()
+
+        pd.set_option('display.max_colwidth', None)
+        keysToShow = ["ClusterIdentifier", "NodeType", "ClusterStatus", "MasterUsername", "DBName", "Endpoint", "NumberOfNodes", 'VpcId']
+        x = [(k, v) for k,v in myClusterProps.items() if k in keysToShow]
+        return pd.DataFrame(data=x, columns=["Key", "Value"])
+
+    def delete_redshift_cluster(self):
+        """Deleting already running redshift cluster.
+
+        Parameters
+        ___________
+            None
+        Returns
+        ___________
+            None
+        """
+
+        self.redshift.delete_cluster(ClusterIdentifier=self.identifier, SkipFinalClusterSnapshot=True)
+        self.invalidate()
+
+    def wait_for_cluster(self, status='available', timeout=1800, progress=None, nodes=None):
+        """Waiting for the cluster to reach a status (see wait_for_cluster).
+
+        Parameters
+        ___________
+            status   - Expected ClusterStatus, 'deleted' waits until the cluster is gone
+            timeout  - Seconds to wait before giving up
+            progress - Called with (status, seconds waited) after every poll
+            nodes    - Expected NumberOfNodes, None for any
+        Returns
+        ___________
+            dict - cluster properties ({} once deleted)
+        """
+
+        props = wait_for_cluster(self.redshift, self.identifier, status, timeout,
+                                 progress=progress, nodes=nodes)
+        with self._lock:
+            self._described, self._described_at = (props or None), time.time()
+        return props
+
+    def provision_cluster(self, progress=None, timeout=1800):
+        """Creating IAM role and cluster concurrently and waiting until the
+        cluster is available with the role attached. HOST and ARN are written
+        back into the config file, so create_tables.py and etl.py can start
+        right away.
+
+        Parameters
+        ___________
+            progress - Called with (status, seconds waited) while waiting
+            timeout  - Seconds to wait for the cluster
+        Returns
+        ___________
+            dict - cluster properties
+        """
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        # Creating the clients up front so both threads share them
+        self.client('iam')
+        self.client('redshift')
+
+        # The cluster does not need the role to start, so both are created together
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            role = executor.submit(self.create_iam_role)
+            cluster = executor.submit(self.create_redshift_cluster)
+            arn = role.result()
+            cluster.result()
+
+        self.wait_for_cluster(timeout=timeout, progress=progress)
+
+        if arn:
+            self.redshift.modify_cluster_iam_roles(ClusterIdentifier=self.identifier, AddIamRoles=[arn])
+        props = self.wait_for_cluster(timeout=timeout, progress=progress)
+
+        write_cluster_config(props['Endpoint']['Address'], arn, self.config_file)
+        # Later calls on this manager (e.g. the shared one) see the new HOST and ARN
+        self.config.read(self.config_file)
+        return props
+
+    def _transition(self, name, action, status, timeout, progress, nodes=None):
+        """Starting a cluster transition, waiting for it and printing its duration."""
+
+        start = time.time()
+        action()
+        self.invalidate()
+        props = self.wait_for_cluster(status, timeout, progress, nodes)
+        print("{} of {} took {:.0f}s".format(name, self.identifier, time.time() - start))
+        return props
+
+    def resize_cluster(self, nodes, timeout=3600, progress=None):
+        """Resizing the cluster to a number of nodes (elastic resize).
+
+        Parameters
+        ___________
+            nodes    - Number of nodes after the resize
+            timeout  - Seconds to wait for the resize
+            progress - Called with (status, seconds waited) while waiting
+        Returns
+        ___________
+            dict - cluster properties
+        """
+
+        props = self.describe_cluster(max_age=0)
+        if props['NumberOfNodes'] == nodes:
+            return props
+        return self._transition('Resize to {} nodes'.format(nodes),
+                                lambda: self.redshift.resize_cluster(ClusterIdentifier=self.identifier,
+                                                                     NumberOfNodes=nodes, Classic=False),
+                                'available', timeout, progress, nodes)
+
+    def pause_cluster(self, timeout=1800, progress=None):
+        """Pausing the cluster, compute is not billed while paused.
+
+        Parameters
+        ___________
+            timeout  - Seconds to wait for the pause
+            progress - Called with (status, seconds waited) while waiting
+        Returns
+        ___________
+            dict - cluster properties
+        """
+
+        if self.describe_cluster(max_age=0)['ClusterStatus'] == 'paused':
+            return self.describe_cluster()
+        return self._transition('Pause', lambda: self.redshift.pause_cluster(ClusterIdentifier=self.identifier),
+                                'paused', timeout, progress)
+
+    def resume_cluster(self, timeout=1800, progress=None):
+        """Resuming a paused cluster.
+
+        Parameters
+        ___________
+            timeout  - Seconds to wait for the cluster
+            progress - Called with (status, seconds waited) while waiting
+        Returns
+        ___________
+            dict - cluster properties
+        """
+
+        if self.describe_cluster(max_age=0)['ClusterStatus'] != 'paused':
+            return self.describe_cluster()
+        return self._transition('Resume', lambda: self.redshift.resume_cluster(ClusterIdentifier=self.identifier),
+                                'available', timeout, progress)
+
+    def input_bytes(self, loaded=()):
+        """Size of the S3 input of a load (LOG_DATA and SONG_DATA) in bytes.
+
+        Parameters
+        ___________
+            loaded - s3:// URIs left out, e.g. the files an incremental load
+                     does not stage again
+        Returns
+        ___________
+            int - bytes of the files to load
+        """
+
+        from staging_loader import list_objects
+
+        s3 = self.client('s3')
+        return sum(size for option in ('LOG_DATA', 'SONG_DATA')
+                   for uri, size in list_objects(s3, self.config.get('S3', option))
+                   if uri not in loaded)
+
+    def estimate_nodes(self, input_bytes=None, loaded=()):
+        """Number of nodes for a load, from the S3 input size.
+
+        Parameters
+        ___________
+            input_bytes - Size of the input, listed from S3 if None
+            loaded      - s3:// URIs left out of the listed input
+        Returns
+        ___________
+            int - GB_PER_NODE of input per node, between MIN_NODES and MAX_NODES
+        """
+
+        if input_bytes is None:
+            input_bytes = self.input_bytes(loaded)
+        gb_per_node = float(self.config.get('CAPACITY', 'GB_PER_NODE', fallback='') or DEFAULT_GB_PER_NODE)
+        min_nodes = int(self.config.get('CAPACITY', 'MIN_NODES', fallback='') or DEFAULT_MIN_NODES)
+        max_nodes = int(self.config.get('CAPACITY', 'MAX_NODES', fallback='') or DEFAULT_MAX_NODES)
+        return max(min_nodes, min(max_nodes, math.ceil(input_bytes / (gb_per_node * 1e9))))
+
+    @contextmanager
+    def capacity_window(self, nodes=None, pause_after=False, progress=None, loaded=None, resize=True):
+        """Resuming and resizing the cluster for a load and scaling it back after.
+
+        Parameters
+        ___________
+            nodes       - Nodes during the load, estimated from the S3 input if None
+            pause_after - Pause the cluster once the load is done
+            progress    - Called with (status, seconds waited) while waiting
+            loaded      - Called once the cluster is available, returns the
+                          s3:// URIs left out of the estimate (incremental loads)
+            resize      - False only resumes the cluster (and pauses it after)
+        Returns
+        ___________
+            dict - cluster properties during the load
+        """
+
+        self.resume_cluster(progress=progress)
+        if not resize:
+            try:
+                yield self.describe_cluster(max_age=0)
+            finally:
+                if pause_after:
+                    self.pause_cluster(progress=progress)
+            return
+
+        original = self.describe_cluster(max_age=0)['NumberOfNodes']
+        if nodes is None:
+            nodes = self.estimate_nodes(loaded=loaded() if loaded else ())
+        try:
+            yield self.resize_cluster(nodes, progress=progress)
+        finally:
+            self.resize_cluster(original, progress=progress)
+            if pause_after:
+                self.pause_cluster(progress=progress)
+
+    def schedule_pause_resume(self, pause_cron, resume_cron, role_arn):
+        """Creating Redshift scheduled actions pausing and resuming the cluster.
+
+        Parameters
+        ___________
+            pause_cron  - Schedule of the pause, e.g. 'cron(0 20 * * ? *)'
+            resume_cron - Schedule of the resume, e.g. 'cron(0 6 * * ? *)'
+            role_arn    - IAM role the scheduler assumes
+        Returns
+        ___________
+            None
+        """
+
+        for action, schedule in (('Pause', pause_cron), ('Resume', resume_cron)):
+            name = '{}-{}'.format(self.identifier, action.lower())
+            try:
+                self.redshift.delete_scheduled_action(ScheduledActionName=name)
+            except self.redshift.exceptions.ScheduledActionNotFoundFault:
+                pass
+            self.redshift.create_scheduled_action(
+                ScheduledActionName=name,
+                TargetAction={action + 'Cluster': {'ClusterIdentifier': self.identifier}},
+                Schedule=schedule,
+                IamRole=role_arn,
+                Enable=True)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def _default_manager():
+    """ClusterManager for dwh.cfg shared by the module level functions."""
+
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = ClusterManager()
+        return _manager
+
+
 def create_iam_role():
-    """Creating IAM role and adding rwad only access on S3 bucket. 
-    
+    """Creating IAM role and adding rwad only access on S3 bucket.
+
     Parameters
     ___________
-        None    
+        None
     Returns
     ___________
         arn - Amazon resource name
     """
-    
-    import boto3
-    import configparser
-    import json
-    
-    config = configparser.ConfigParser()
-    config.read('dwh.cfg')
-
-    try:
-        iam = boto3.client('iam',
-                           aws_access_key_id=config.get('AWS','KEY'),
-                           aws_secret_access_key=config.get('AWS','SECRET'),
-                           region_name='us-west-2'
-                          )
-    except Exception as e:
-        print(e)
-  
-    try:
-        dwhRole = iam.create_role(
-                                 Path='/',
-                                 RoleName=config.get("IAM_ROLE","ROLE_NAME"),
-                                 Description = "Allows Redshift clusters to call AWS services on your behalf.",
-                                 AssumeRolePolicyDocument=json.dumps(
-                                                                    {'Statement': [{'Action': 'sts:AssumeRole',
-                                                                     'Effect': 'Allow',
-                                                                     'Principal': {'Service': 'redshift.amazonaws.com'}}],
-                                                                     'Version': '2012-10-17'})
-                                 )    
-    except Exception as e:
-        print(e)
-    
-    try:    
-        iam.attach_role_policy(RoleName=config.get("IAM_ROLE","ROLE_NAME"),
-                               PolicyArn="arn:aws:iam::aws:policy/AmazonS3ReadOnlyAccess"
-                              )['ResponseMetadata']['HTTPStatusCode']
-    except Exception as e:
-        print(e)
-    
-    try:   
-        roleArn = iam.get_role(RoleName=config.get("IAM_ROLE","ROLE_NAME"))['Role']['Arn']
-    except Exception as e:
-        print(e)
-    
-    return roleArn
-
-def create_redshift_cluster(arn):
-    """Creating redshift cluster and starting it. 
-    
+
+    return _default_manager().create_iam_role()
+
+
+def create_redshift_cluster(arn=None):
+    """Creating redshift cluster and starting it.
+
     Parameters
     ___________
-        None    
+        arn - IAM role attached to the cluster, None to attach it later
     Returns
     ___________
         None
     """
-    
-    import boto3
-    import configparser
-
-    config = configparser.ConfigParser()
-    config.read('dwh.cfg')
-
-    try:
-        redshift = boto3.client('redshift',
-                                region_name="us-west-2",
-                                aws_access_key_id=config.get('AWS','KEY'),
-                                aws_secret_access_key=config.get('AWS','SECRET')
-                               )
-    except Exception as e:
-        print(e)
-    
-    try:
-        response = redshift.create_cluster(
-                                           ClusterType=config.get('HARDWARE','CLUSTER_TYPE'),
-                                           NodeType=config.get('HARDWARE','NODE_TYPE'),
-                                           NumberOfNodes=int(config.get('HARDWARE','NUM_NODES')),
-                                           DBName=config.get('DB','DB_NAME'),
-                                           ClusterIdentifier=config.get('CLUSTER','CLUSTER_IDENTIFIER'),
-                                           MasterUsername=config.get('DB','DB_NAME'),
-                                           MasterUserPassword=config.get('DB','DB_PASSWORD'),
-                                           IamRoles=[arn]
-                                          )
-    except Exception as e:
-        print(e)
-        
-    
+
+    _default_manager().create_redshift_cluster(arn)
+
+
 def redshiftProps():
-    """Accessing properties of redshift cluster. 
-    
+    """Accessing properties of redshift cluster.
+
     Parameters
     ___________
-        None    
+        None
     Returns
     ___________
-        Pandas Data frame - Properties of redshift cluster. 
+        Pandas Data frame - Properties of redshift cluster.
     """
-    
-    import pandas as pd
-    import boto3
-    import configparser
-
-    config = configparser.ConfigParser()
-    config.read('dwh.cfg')
-
-    try:
-        redshift = boto3.client('redshift',
-                                region_name="us-west-2",
-                                aws_access_key_id=config.get('AWS','KEY'),
-                                aws_secret_access_key=config.get('AWS','SECRET')
-                               )
-    except Exception as e:
-        print(e)
-    
-    myClusterProps = redshift.describe_clusters(ClusterIdentifier=config.get('CLUSTER','CLUSTER_IDENTIFIER'))['Clusters'][0]
-    
-    pd.set_option('display.max_colwidth', -1)
-    keysToShow = ["ClusterIdentifier", "NodeType", "ClusterStatus", "MasterUsername", "DBName", "Endpoint", "NumberOfNodes", 'VpcId']
-    x = [(k, v) for k,v in myClusterProps.items() if k in keysToShow]
-    host = myClusterProps['Endpoint']['Address']
-    return pd.DataFrame(data=x, columns=["Key", "Value"])
+
+    return _default_manager().redshift_props()
+
 
 def delete_redshift_cluster():
-    """Deleting already running redshift cluster. 
-    
+    """Deleting already running redshift cluster.
+
     Parameters
     ___________
-        None    
+        None
     Returns
     ___________
-        None 
+        None
+    """
+
+    _default_manager().delete_redshift_cluster()
+
+
+def wait_for_cluster(redshift, identifier, status='available', timeout=1800,
+                     delay=5, max_delay=60, progress=None, nodes=None):
+    """Waiting for a cluster to reach a status, polling with exponential backoff.
+
+    Parameters
+    ___________
+        redshift   - boto3 redshift client
+        identifier - Cluster identifier
+        status     - Expected ClusterStatus, 'deleted' waits until the cluster is gone
+        timeout    - Seconds to wait before giving up
+        delay      - Seconds before the second poll, doubled up to max_delay
+        max_delay  - Longest wait between two polls
+        progress   - Called with (status, seconds waited) after every poll
+        nodes      - Expected NumberOfNodes, None for any
+    Returns
+    ___________
+        dict - cluster properties ({} once deleted)
+    """
+
+    start = time.time()
+    while True:
+        try:
+            props = redshift.describe_clusters(ClusterIdentifier=identifier)['Clusters'][0]
+        except redshift.exceptions.ClusterNotFoundFault:
+            props = {}
+
+        current = props.get('ClusterStatus', 'deleted')
+        roles_in_sync = all(role.get('ApplyStatus') == 'in-sync'
+                            for role in props.get('IamRoles', []))
+        elapsed = time.time() - start
+        if progress is not None:
+            progress(current, elapsed)
+        nodes_match = nodes is None or props.get('NumberOfNodes') == nodes
+        if current == status and roles_in_sync and nodes_match:
+            return props
+        if elapsed > timeout:
+            raise TimeoutError("Cluster {} still {} after {:.0f}s".format(identifier, current, elapsed))
+
+        time.sleep(min(delay, max_delay))
+        delay *= 2
+
+
+def write_cluster_config(host=None, arn=None, config_file='dwh.cfg'):
+    """Writing HOST and ARN back into the config file, keeping comments.
+
+    Parameters
+    ___________
+        host        - Cluster endpoint address for [DB] HOST
+        arn         - IAM role ARN for [IAM_ROLE] ARN
+        config_file - Config file to update
+    Returns
+    ___________
+        None
     """
-    
-    import boto3
-    import configparser
-    
-    config = configparser.ConfigParser()
-    config.read('dwh.cfg')
-    
-    try:
-        redshift = boto3.client('redshift',
-                                region_name="us-west-2",
-                                aws_access_key_id=config.get('AWS','KEY'),
-                                aws_secret_access_key=config.get('AWS','SECRET')
-                               )
-    except Exception as e:
-        print(e)
-        
-    redshift.delete_cluster(ClusterIdentifier=config.get('CLUSTER','CLUSTER_IDENTIFIER'),  SkipFinalClusterSnapshot=True)
+
+    values = {('DB', 'HOST'): host, ('IAM_ROLE', 'ARN'): arn}
+
+    # newline='' keeps the line endings of the file, e.g. CRLF
+    with open(config_file, newline='') as f:
+        lines = f.readlines()
+
+    section = None
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped.startswith('[') and stripped.endswith(']'):
+            section = stripped[1:-1]
+        elif '=' in stripped and not stripped.startswith('#'):
+            key = stripped.split('=', 1)[0].strip().upper()
+            if values.get((section, key)) is not None:
+                ending = line[len(line.rstrip('\r\n')):] or '\n'
+                lines[i] = '{}={}{}'.format(key, values[(section, key)], ending)
+
+    with open(config_file, 'w', newline='') as f:
+        f.writelines(lines)
+
+
+def provision_cluster(progress=None, timeout=1800):
+    """Creating IAM role and cluster concurrently and waiting until the
+    cluster is available with the role attached. HOST and ARN are written
+    back into dwh.cfg, so create_tables.py and etl.py can start right away.
+
+    Parameters
+    ___________
+        progress - Called with (status, seconds waited) while waiting
+        timeout  - Seconds to wait for the cluster
+    Returns
+    ___________
+        dict - cluster properties
+    """
+
+    return _default_manager().provision_cluster(progress, timeout)
+
+
+def resize_cluster(nodes, progress=None):
+    """Resizing the cluster to a number of nodes (elastic resize).
+
+    Parameters
+    ___________
+        nodes    - Number of nodes after the resize
+        progress - Called with (status, seconds waited) while waiting
+    Returns
+    ___________
+        dict - cluster properties
+    """
+
+    return _default_manager().resize_cluster(nodes, progress=progress)
+
+
+def pause_cluster(progress=None):
+    """Pausing the cluster.
+
+    Parameters
+    ___________
+        progress - Called with (status, seconds waited) while waiting
+    Returns
+    ___________
+        dict - cluster properties
+    """
+
+    return _default_manager().pause_cluster(progress=progress)
+
+
+def resume_cluster(progress=None):
+    """Resuming a paused cluster.
+
+    Parameters
+    ___________
+        progress - Called with (status, seconds waited) while waiting
+    Returns
+    ___________
+        dict - cluster properties
+    """
+
+    return _default_manager().resume_cluster(progress=progress)
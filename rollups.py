@@ -0,0 +1,197 @@
+"""Rollup tables of daily plays maintained at load time
+Consumers mostly read plays per day and song, artist or user level, which
+otherwise means aggregating all of songs_plays_fact on every query. The rollup
+tables daily_song_plays, daily_artist_plays and daily_level_plays (per hour,
+joined to time_dim) hold these aggregates and are refreshed after every load
+from the songplays the load added only: the staged NextSong events newer than
+the 'rollups' watermark in etl_watermarks (the highest event ts rolled up so
+far, the same ts watermark incremental.py uses) are joined to the song lookup,
+aggregated and their plays added to the existing (day, key) rows.
+
+Without a watermark, and after a swap load which replaced the Fact table, the
+rollups are rebuilt from songs_plays_fact.
+
+Usage:
+    python rollups.py [--config dwh.cfg] [--rebuild] [--compare]
+
+This file can also be imported as a module and contains the following
+functions:
+
+    * rollup_statements - Statements merging new songplays into one rollup.
+    * refresh_rollups - Bringing the rollups up to date with songs_plays_fact.
+    * compare_latency - Timing the daily plays queries on Fact table and rollups.
+    * main - the main function of the script
+"""
+
+# Importing system libraries
+import argparse
+import configparser
+import time
+
+# Importing user libraries
+from db_connection import connect
+from sql_queries import (rollup_delta_create, rollup_delta_drop, rollup_fact_songplays,
+                         rollup_merge_insert, rollup_merge_update, rollup_query_pairs,
+                         rollup_staged_songplays, rollup_tables, rollup_watermark_delete,
+                         rollup_watermark_insert, staged_events_max_ts_select, watermark_select)
+
+
+def rollup_statements(table, keys, delta, songplays):
+    """Statements merging a set of songplays into one rollup.
+
+    Parameters
+    ___________
+        table     : str
+                   Rollup table
+        keys      : list
+                   Key columns of the rollup, plays is summed per key
+        delta     : str
+                   Query aggregating the songplays per day and key
+        songplays : str
+                   Table or subquery of the songplays, e.g.
+                   sql_queries.rollup_staged_songplays
+
+    Returns
+    ___________
+        list - statements, the first one takes the parameters of songplays
+    """
+
+    match = ' and '.join('{0}.{1} = d.{1}'.format(table, key) for key in keys)
+    columns = ', '.join(keys + ['plays'])
+    return [rollup_delta_create.format(delta=delta.format(songplays=songplays)),
+            rollup_merge_update.format(table=table, match=match),
+            rollup_merge_insert.format(table=table, columns=columns, match=match),
+            rollup_delta_drop]
+
+
+def _merge(cur, songplays, params, rewrite):
+    """Merging a set of songplays into every rollup."""
+
+    for table, keys, delta in rollup_tables:
+        statements = rollup_statements(table, keys, delta, songplays)
+        cur.execute(rewrite(statements[0]), params)
+        for statement in statements[1:]:
+            cur.execute(rewrite(statement))
+
+
+def refresh_rollups(cur, rebuild=False, rewrite=None):
+    """Adding the songplays of the latest load to the rollups.
+
+    The staged NextSong events newer than the rollup watermark are the
+    songplays the load added to songs_plays_fact; only they are aggregated.
+    Without a watermark (first refresh, re-created tables) or with rebuild
+    the rollups are rebuilt from the Fact table. Runs on the caller's
+    transaction and does not commit, so the rollups can be refreshed together
+    with the load that added the songplays.
+
+    Parameters
+    ___________
+        cur     : psycopg2 cursor object
+                 Cursor object for sparkifydb
+        rebuild : bool
+                 Rebuild the rollups from songs_plays_fact, e.g. after the
+                 Fact table was replaced
+        rewrite : callable
+                 Applied to every statement, e.g. pg_compat.to_postgres
+
+    Returns
+    ___________
+        dict - rebuilt, staged event ts range rolled up and seconds
+    """
+
+    rewrite = rewrite or (lambda query: query)
+    start = time.time()
+
+    cur.execute(rewrite(watermark_select), ('rollups',))
+    row = cur.fetchone()
+    watermark = row[0] if row else None
+    cur.execute(rewrite(staged_events_max_ts_select))
+    latest = cur.fetchone()[0]
+
+    rebuild = rebuild or watermark is None
+    if rebuild:
+        for table, _, _ in rollup_tables:
+            cur.execute(rewrite("delete from {};".format(table)))
+        _merge(cur, rollup_fact_songplays, None, rewrite)
+    elif latest is not None and latest > watermark:
+        _merge(cur, rollup_staged_songplays, (watermark,), rewrite)
+
+    if rebuild or (latest is not None and latest > watermark):
+        cur.execute(rewrite(rollup_watermark_delete))
+        if latest is not None:
+            cur.execute(rewrite(rollup_watermark_insert), (latest,))
+
+    return {'rebuilt': rebuild, 'event_ts': (watermark, latest), 'seconds': time.time() - start}
+
+
+def _timed_query(cur, query, repeat):
+    """Best of repeat runs of a query, returning (seconds, rows)."""
+
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        cur.execute(query)
+        rows = cur.fetchall()
+        seconds = time.time() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, rows
+
+
+def compare_latency(cur, repeat=3, pairs=rollup_query_pairs):
+    """Timing the daily plays queries on the Fact table and on the rollups.
+
+    Parameters
+    ___________
+        cur    : psycopg2 cursor object
+                Cursor object for sparkifydb
+        repeat : int
+                Runs per query, the fastest one counts
+        pairs  : list
+                (name, Fact table query, rollup query)
+
+    Returns
+    ___________
+        list - dict per query with name, fact_seconds, rollup_seconds, rows
+               and whether both queries returned the same rows
+    """
+
+    results = []
+    for name, fact_query, rollup_query in pairs:
+        fact_seconds, fact_rows = _timed_query(cur, fact_query, repeat)
+        rollup_seconds, rollup_rows = _timed_query(cur, rollup_query, repeat)
+        results.append({'query': name, 'fact_seconds': round(fact_seconds, 4),
+                        'rollup_seconds': round(rollup_seconds, 4), 'rows': len(rollup_rows),
+                        'matches': sorted(map(tuple, fact_rows)) == sorted(map(tuple, rollup_rows))})
+        print("{:<20} fact {:>9.3f}s rollup {:>9.3f}s {:>8.1f}x {:>10} rows{}"
+              .format(name, fact_seconds, rollup_seconds, fact_seconds / max(rollup_seconds, 1e-9),
+                      len(rollup_rows), '' if results[-1]['matches'] else ' MISMATCH'))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Refresh the daily plays rollups.')
+    parser.add_argument('--config', default='dwh.cfg', help='configuration file')
+    parser.add_argument('--rebuild', action='store_true', help='rebuild the rollups from all songplays')
+    parser.add_argument('--compare', action='store_true', help='compare rollup and Fact table query latency')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+
+    conn = connect(config)
+    conn.autocommit = False
+    cur = conn.cursor()
+    try:
+        print(refresh_rollups(cur, args.rebuild))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if args.compare:
+        compare_latency(cur)
+        conn.rollback()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
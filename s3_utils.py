@@ -0,0 +1,79 @@
+"""Shared S3 helpers for sparkifydb scripts
+This script creates the boto3 S3 client from the [AWS] section of dwh.cfg and
+holds the s3:// URI and COPY manifest helpers used by etl.py, incremental.py,
+staging_loader.py, export.py and preflight.py.
+
+This file can also be imported as a module and contains the following
+functions:
+
+    * s3_client - Creating a boto3 S3 client from dwh.cfg.
+    * split_s3_uri - Splitting an s3:// URI into bucket and key prefix.
+    * write_manifest - Writing a Redshift COPY manifest to S3.
+"""
+
+# Importing system libraries
+import json
+
+
+def s3_client(config):
+    """Creating a boto3 S3 client from the AWS section of dwh.cfg.
+
+    Parameters
+    ___________
+        config : configparser.ConfigParser
+                Loaded dwh.cfg
+
+    Returns
+    ___________
+        boto3 S3 client
+    """
+
+    import boto3
+
+    return boto3.client('s3',
+                        region_name='us-west-2',
+                        aws_access_key_id=config.get('AWS','KEY'),
+                        aws_secret_access_key=config.get('AWS','SECRET')
+                       )
+
+
+def split_s3_uri(uri):
+    """Splitting an s3:// URI into bucket and key prefix.
+
+    Parameters
+    ___________
+        uri : str
+             S3 URI as kept in dwh.cfg, optionally quoted
+
+    Returns
+    ___________
+        tuple - (bucket, prefix)
+    """
+
+    uri = uri.strip().strip("'\"")
+    if not uri.startswith('s3://'):
+        raise ValueError("Not an S3 URI: " + uri)
+    bucket, _, prefix = uri[len('s3://'):].partition('/')
+    return bucket, prefix
+
+
+def write_manifest(s3, uri, keys):
+    """Writing a Redshift COPY manifest listing the given files.
+
+    Parameters
+    ___________
+        s3   : boto3 S3 client
+        uri  : str
+              S3 URI the manifest is written to
+        keys : list
+              s3:// URIs of the files to load
+
+    Returns
+    ___________
+        str - S3 URI of the manifest
+    """
+
+    bucket, key = split_s3_uri(uri)
+    manifest = {'entries': [{'url': k, 'mandatory': True} for k in keys]}
+    s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(manifest).encode('utf-8'))
+    return 's3://{}/{}'.format(bucket, key)
@@ -0,0 +1,298 @@
+"""Distribution key, sort key and compression advisor for sparkifydb tables
+This script profiles the data loaded into the staging, Fact and Dimension
+tables (row count, cardinality and null share of every column, skew of every
+distribution key candidate) and generates CREATE TABLE statements with the
+recommended DISTSTYLE/DISTKEY, SORTKEY and column ENCODE settings.
+
+Distribution key candidates are the join columns of songplay_table_insert,
+song_lookup_insert and the primary keys. Skew is estimated from the most
+frequent value: no slice can hold fewer rows than that value has, so a column
+whose top value is 40% of the rows puts at least 40% of the table on one slice.
+
+Usage:
+    python schema_advisor.py [--config dwh.cfg] [--slices 4] [--output schema.sql]
+
+This file can also be imported as a module and contains the following
+functions:
+
+    * parse_create - Table name and columns of a CREATE TABLE statement.
+    * profile_table - Profiling row count, cardinality, nulls and skew.
+    * recommend - Choosing dist style, dist key, sort key and encodings.
+    * render_create - Rendering a CREATE TABLE with the recommendation.
+    * advise - Profiling every table and rendering the recommended DDL.
+    * main - the main function of the script
+"""
+
+# Importing system libraries
+import argparse
+import configparser
+import re
+
+# Importing user libraries
+from db_connection import connect
+from sql_queries import create_table_queries
+
+# Join columns of songplay_table_insert and song_lookup_insert, preferred
+# distribution keys. events_stg joins song_lookup on the fnv_hash of song,
+# artist and length, none of its columns is a join key.
+JOIN_COLUMNS = {
+    'song_lookup': ['song_key', 'song_id', 'artist_id'],
+    'songs_dim': ['song_id', 'artist_id'],
+    'artists_dim': ['artist_id'],
+    'songs_plays_fact': ['song_id', 'artist_id', 'user_id', 'start_time'],
+}
+
+# Columns usually filtered or joined by range, preferred sort keys
+SORT_CANDIDATES = ['start_time', 'ts']
+
+# Tables up to this many rows are copied to every node
+SMALL_TABLE_ROWS = 1000000
+
+# Highest acceptable ratio of the fullest slice to an even slice
+MAX_SKEW = 1.5
+
+# Column types AZ64 can encode
+AZ64_TYPES = ('smallint', 'integer', 'bigint', 'decimal', 'numeric', 'date', 'timestamp')
+
+_CONSTRAINT_WORDS = ('primary', 'unique', 'foreign', 'constraint', 'distkey', 'sortkey')
+
+
+def parse_create(query):
+    """Table name and columns of a CREATE TABLE statement.
+
+    Parameters
+    ___________
+        query : str
+               CREATE TABLE statement from sql_queries.py
+
+    Returns
+    ___________
+        tuple - (table name, list of (column name, type, rest of definition))
+    """
+
+    table = re.search(r'create\s+table\s+(?:if\s+not\s+exists\s+)?(\w+)', query, re.IGNORECASE).group(1)
+    # Column list up to the parenthesis closing the first one, table
+    # attributes like sortkey (a, b) follow it
+    start = query.index('(') + 1
+    depth = 1
+    for end in range(start, len(query)):
+        depth += query[end] == '('
+        depth -= query[end] == ')'
+        if not depth:
+            break
+    body = query[start:end]
+
+    columns = []
+    depth = 0
+    current = ''
+    for char in body + ',':
+        if char == ',' and depth == 0:
+            definition = current.strip()
+            current = ''
+            if not definition or definition.split()[0].lower() in _CONSTRAINT_WORDS:
+                continue
+            name, rest = definition.split(None, 1)
+            match = re.match(r'(\w+(?:\s+precision)?(?:\s*\([\d,\s]*\))?)(.*)', rest, re.DOTALL)
+            columns.append((name, match.group(1).lower(), ' '.join(match.group(2).split())))
+            continue
+        depth += char == '('
+        depth -= char == ')'
+        current += char
+    return table, columns
+
+
+def profile_table(cur, table, columns):
+    """Profiling row count, cardinality, nulls and top value share of a table.
+
+    All columns are profiled with one aggregate scan; the top value share is
+    only queried for distribution key candidates.
+
+    Parameters
+    ___________
+        cur     : psycopg2 cursor object
+                 Cursor object for sparkifydb
+        table   : str
+                 Table name
+        columns : list
+                 (column name, type, definition) of the table
+
+    Returns
+    ___________
+        dict - rows and per column distinct, nulls and top_share
+    """
+
+    names = [name for name, _, _ in columns]
+    aggregates = ', '.join('count(distinct {0}), count({0})'.format(name) for name in names)
+    cur.execute("select count(*), {} from {};".format(aggregates, table))
+    result = cur.fetchone()
+
+    rows = result[0]
+    profile = {'rows': rows, 'columns': {}}
+    for i, name in enumerate(names):
+        profile['columns'][name] = {'distinct': result[1 + 2 * i],
+                                    'nulls': rows - result[2 + 2 * i],
+                                    'top_share': None}
+
+    for name in JOIN_COLUMNS.get(table, []):
+        if name in profile['columns'] and rows:
+            cur.execute("select count(*) from {0} group by {1} order by 1 desc limit 1;"
+                        .format(table, name))
+            profile['columns'][name]['top_share'] = cur.fetchone()[0] / rows
+    return profile
+
+
+def _skew(top_share, slices):
+    """Rows on the fullest slice relative to an even distribution."""
+
+    return max(top_share, 1.0 / slices) * slices
+
+
+def _encoding(column_type, stats, rows, is_sortkey):
+    if is_sortkey:
+        return 'raw'
+    if column_type.startswith(AZ64_TYPES):
+        return 'az64'
+    if column_type.startswith(('varchar', 'char')) and stats['distinct'] <= 255 and rows:
+        return 'bytedict'
+    return 'zstd'
+
+
+def recommend(table, columns, profile, slices):
+    """Choosing dist style, dist key, sort key and encodings for a table.
+
+    Parameters
+    ___________
+        table   : str
+                 Table name
+        columns : list
+                 (column name, type, definition) of the table
+        profile : dict
+                 Output of profile_table
+        slices  : int
+                 Number of slices of the cluster
+
+    Returns
+    ___________
+        dict - diststyle, distkey, sortkey, encodings and the skew per candidate
+    """
+
+    rows = profile['rows']
+    names = [name for name, _, _ in columns]
+    skews = {name: _skew(profile['columns'][name]['top_share'], slices)
+             for name in JOIN_COLUMNS.get(table, [])
+             if name in names and profile['columns'][name]['top_share'] is not None}
+
+    distkey = None
+    if rows <= SMALL_TABLE_ROWS and not table.endswith('_stg') and table != 'songs_plays_fact':
+        diststyle = 'all'
+    else:
+        candidates = [name for name in JOIN_COLUMNS.get(table, [])
+                      if name in skews and skews[name] <= MAX_SKEW
+                      and profile['columns'][name]['distinct'] >= slices * 10]
+        if candidates:
+            diststyle, distkey = 'key', candidates[0]
+        else:
+            diststyle = 'even'
+
+    sortkey = next((name for name in SORT_CANDIDATES if name in names), distkey)
+
+    encodings = {name: _encoding(column_type, profile['columns'][name], rows, name == sortkey)
+                 for name, column_type, _ in columns}
+    return {'diststyle': diststyle, 'distkey': distkey, 'sortkey': sortkey,
+            'encodings': encodings, 'skews': skews}
+
+
+def render_create(table, columns, advice):
+    """Rendering a CREATE TABLE statement with the recommended settings.
+
+    Parameters
+    ___________
+        table   : str
+                 Table name
+        columns : list
+                 (column name, type, definition) of the table
+        advice  : dict
+                 Output of recommend
+
+    Returns
+    ___________
+        str - CREATE TABLE statement
+    """
+
+    lines = []
+    for name, column_type, rest in columns:
+        rest = re.sub(r'\b(distkey|sortkey)\b', '', rest, flags=re.IGNORECASE).strip()
+        lines.append(' {:<16} {:<14} encode {:<8} {}'.format(name, column_type,
+                                                             advice['encodings'][name],
+                                                             rest).rstrip())
+    attributes = 'diststyle ' + advice['diststyle']
+    if advice['distkey']:
+        attributes += '\ndistkey ({})'.format(advice['distkey'])
+    if advice['sortkey']:
+        attributes += '\nsortkey ({})'.format(advice['sortkey'])
+    return "create table if not exists {}\n(\n{}\n)\n{};\n".format(table, ',\n'.join(lines), attributes)
+
+
+def advise(cur, slices, tables=None):
+    """Profiling every populated table and rendering the recommended DDL.
+
+    Parameters
+    ___________
+        cur    : psycopg2 cursor object
+                 Cursor object for sparkifydb
+        slices : int
+                 Number of slices of the cluster
+        tables : list
+                 Tables to profile, defaults to all tables of sql_queries.py
+
+    Returns
+    ___________
+        list - (table, advice, CREATE TABLE statement) per profiled table
+    """
+
+    results = []
+    for query in create_table_queries:
+        table, columns = parse_create(query)
+        if tables is not None and table not in tables:
+            continue
+        profile = profile_table(cur, table, columns)
+        if not profile['rows']:
+            print("-- {}: no rows, skipped".format(table))
+            continue
+        advice = recommend(table, columns, profile, slices)
+        for name, skew in sorted(advice['skews'].items()):
+            print("-- {}.{}: {} distinct, fullest slice {:.1f}x even"
+                  .format(table, name, profile['columns'][name]['distinct'], skew))
+        results.append((table, advice, render_create(table, columns, advice)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recommend DISTKEY/SORTKEY/ENCODE from data profiling.')
+    parser.add_argument('--config', default='dwh.cfg', help='configuration file')
+    parser.add_argument('--slices', type=int, help='cluster slices, defaults to NUM_NODES/NODE_TYPE')
+    parser.add_argument('--tables', help='comma separated tables to profile')
+    parser.add_argument('--output', help='file the CREATE TABLE statements are written to')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+
+    if args.slices is None:
+        from staging_loader import cluster_slices
+        args.slices = cluster_slices(config)
+
+    conn = connect(config)
+    cur = conn.cursor()
+    results = advise(cur, args.slices, args.tables.split(',') if args.tables else None)
+    conn.close()
+
+    ddl = '\n'.join(create for _, _, create in results)
+    print(ddl)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(ddl)
+
+
+if __name__ == "__main__":
+    main()
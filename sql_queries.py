@@ -1,14 +1,42 @@
 """ Database SQL statement (Redshift Compatible) 
 This script is to define quesries used to create/drop/insert into database.
+
+Statements depending on the configuration (the S3 COPY statements) are kept as
+templates and rendered on first use, once per configuration, so importing this
+module does not read dwh.cfg and one process can serve several clusters:
+
+    * render_statement - Rendering one template for a configuration.
+    * get_copy_table_queries - COPY statements for a configuration.
+
+staging_events_copy, staging_songs_copy and copy_table_queries are still
+available as module attributes, rendered with dwh.cfg when first accessed.
 """
 
 # Importing System Libraries
 import configparser
+import functools
+import os
 
 
 # CONFIG
-config = configparser.ConfigParser()
-config.read('dwh.cfg')
+
+DEFAULT_CONFIG_FILE = 'dwh.cfg'
+
+# Template placeholders and the (section, option) they are rendered with
+TEMPLATE_PARAMETERS = {
+    'log_data': ('S3', 'LOG_DATA'),
+    'song_data': ('S3', 'SONG_DATA'),
+    'arn': ('IAM_ROLE', 'ARN'),
+    'maxerror': ('S3', 'MAXERROR'),
+}
+
+# Values of template parameters left empty in the configuration
+TEMPLATE_DEFAULTS = {
+    'maxerror': '0',
+}
+
+# Template parameters a statement cannot be rendered without
+TEMPLATE_REQUIRED = ('log_data', 'song_data', 'arn')
 
 # DROP TABLES
 
@@ -19,10 +47,21 @@ user_table_drop = "drop table if exists users_dim;"
 song_table_drop = "drop table if exists songs_dim;"
 artist_table_drop = "drop table if exists artists_dim;"
 time_table_drop = "drop table if exists time_dim;"
+watermark_table_drop = "drop table if exists etl_watermarks;"
+loaded_files_table_drop = "drop table if exists etl_loaded_files;"
+staged_files_table_drop = "drop table if exists etl_staged_files;"
+song_lookup_table_drop = "drop table if exists song_lookup;"
+checkpoint_table_drop = "drop table if exists etl_checkpoints;"
+user_history_table_drop = "drop table if exists users_dim_history;"
+load_generation_table_drop = "drop table if exists etl_load_generations;"
+daily_song_plays_table_drop = "drop table if exists daily_song_plays;"
+daily_artist_plays_table_drop = "drop table if exists daily_artist_plays;"
+daily_level_plays_table_drop = "drop table if exists daily_level_plays;"
 
 # CREATE TABLES (Staging)
 
-# Page column as used Diskey because that would help fetch entire dat from one node.
+# Distribution style is even. Using page as distkey put almost all NextSong rows
+# on one slice and serialized the fact join (see schema_advisor.py).
 
 staging_events_table_create= ("""
  create table if not exists events_stg
@@ -37,7 +76,7 @@ staging_events_table_create= ("""
  level         varchar(20),
  location      varchar(255),
  method        varchar(20),
- page          varchar(20) distkey,
+ page          varchar(20),
  registration  real,
  session_id    smallint,
  song          varchar(255),
@@ -45,7 +84,8 @@ staging_events_table_create= ("""
  ts            bigint,
  user_Agent    varchar(255),
  user_Id       integer 
- );
+ )
+ diststyle even;
  """)
 
 staging_songs_table_create = ("""
@@ -133,26 +173,314 @@ create table if not exists time_dim
  );
  """)
 
+# CREATE TABLE (User history, optional)
+# Slowly changing dimension (type 2) of users: one row per level a user had,
+# valid from the first event with that level until the next change.
+
+user_history_table_create = ("""
+create table if not exists users_dim_history
+(
+ user_id          integer not null,
+ first_name       varchar(255) not null,
+ last_name        varchar(255),
+ gender           char(1) not null,
+ level            varchar(100) not null,
+ valid_from       timestamp not null,
+ valid_to         timestamp,
+ is_current       boolean not null
+)
+diststyle all
+sortkey (user_id, valid_from);
+""")
+
+# CREATE TABLE (Song lookup)
+# One row per song keyed by a hash of normalized title, artist name and duration
+# rounded to 0.1s, so the fact load is a single join on one integer key. The
+# table is small and copied to every node, so the join with events_stg needs
+# no redistribution.
+
+song_lookup_table_create = ("""
+create table if not exists song_lookup
+(
+ song_key         bigint not null,
+ song_id          varchar(255) not null,
+ artist_id        varchar(255) not null
+)
+diststyle all;
+""")
+
+# CREATE TABLES (Incremental load state)
+# Highest event ts merged so far per source and every S3 key already staged.
+
+watermark_table_create = ("""
+create table if not exists etl_watermarks
+(
+ source           varchar(50) primary key,
+ value            bigint not null,
+ updated_at       timestamp not null
+);
+""")
+
+loaded_files_table_create = ("""
+create table if not exists etl_loaded_files
+(
+ source           varchar(50) not null,
+ s3_key           varchar(1024) not null,
+ loaded_at        timestamp not null,
+ primary key (source, s3_key)
+);
+""")
+
+# Files a full load run staged, recorded with its COPY steps so a resumed
+# run still knows them when it records the load state
+staged_files_table_create = ("""
+create table if not exists etl_staged_files
+(
+ run_id           varchar(64) not null,
+ source           varchar(50) not null,
+ s3_key           varchar(1024) not null
+);
+""")
+
+# CREATE TABLE (Checkpoints)
+# Completed ETL steps per run, used to resume a failed run.
+
+checkpoint_table_create = ("""
+create table if not exists etl_checkpoints
+(
+ run_id           varchar(64) not null,
+ step             varchar(100) not null,
+ completed_at     timestamp not null,
+ primary key (run_id, step)
+);
+""")
+
+# CREATE TABLE (Load generations)
+# One row per completed load, the latest one invalidates cached query results.
+
+load_generation_table_create = ("""
+create table if not exists etl_load_generations
+(
+ loaded_at        timestamp not null
+);
+""")
+
+# CREATE TABLES (Rollups)
+# Plays per day pre-aggregated from songs_plays_fact, kept up to date by
+# rollups.py from the songplays each load adds. Sorted by day, as consumers
+# read date ranges.
+
+daily_song_plays_table_create = ("""
+create table if not exists daily_song_plays
+(
+ play_date        date not null,
+ song_id          varchar(255) not null,
+ artist_id        varchar(255) not null,
+ plays            bigint not null
+)
+distkey (song_id)
+sortkey (play_date);
+""")
+
+daily_artist_plays_table_create = ("""
+create table if not exists daily_artist_plays
+(
+ play_date        date not null,
+ artist_id        varchar(255) not null,
+ plays            bigint not null
+)
+distkey (artist_id)
+sortkey (play_date);
+""")
+
+daily_level_plays_table_create = ("""
+create table if not exists daily_level_plays
+(
+ play_date        date not null,
+ hour             smallint not null,
+ level            varchar(100) not null,
+ plays            bigint not null
+)
+diststyle all
+sortkey (play_date);
+""")
+
+# CREATE TABLE (Statement log, optional)
+
+statement_log_table_create = ("""
+create table if not exists etl_statement_log
+(
+ run_id           varchar(64) not null,
+ statement        varchar(255) not null,
+ started_at       timestamp not null,
+ seconds          double precision not null,
+ rows_affected    bigint,
+ query_id         integer,
+ bytes_scanned    bigint,
+ error            varchar(1024)
+);
+""")
+
+statement_log_insert = ("""insert into etl_statement_log
+                           values (%s, %s, TIMESTAMP 'epoch' + %s * INTERVAL '1 second',
+                                   %s, %s, %s, %s, %s);
+                        """)
+
+# Bytes read by the scan steps of the given Redshift query ids
+bytes_scanned_select = ("""select query, sum(bytes)
+                             from svl_query_summary
+                            where query in %s
+                              and is_rrscan = 't'
+                            group by query;
+                        """)
+
+# Table statistics (maintenance)
+# Percentage of unsorted rows and of stale statistics per table. svv_table_info
+# only exists on Redshift; on PostgreSQL dead tuples stand in for unsorted rows
+# and rows modified since the last analyze for stale statistics.
+
+redshift_table_stats_select = ("""select "table", tbl_rows,
+                                        coalesce(unsorted, 0), coalesce(stats_off, 0)
+                                   from svv_table_info
+                                  where "schema" = 'public';
+                               """)
+
+postgres_table_stats_select = ("""select relname, n_live_tup,
+                                        100.0 * n_dead_tup / greatest(n_live_tup + n_dead_tup, 1),
+                                        100.0 * n_mod_since_analyze / greatest(n_live_tup, 1)
+                                   from pg_stat_user_tables
+                                  where schemaname = 'public';
+                               """)
+
 # Insert data into Staging tables
 
-staging_events_copy = ("""
-                       copy events_stg from {} 
+staging_events_copy_template = ("""
+                       copy events_stg from {log_data} 
+                       credentials 'aws_iam_role={arn}' 
+                       json 's3://udacity-dend/log_json_path.json' 
+                       compupdate off region 'us-west-2' maxerror {maxerror}
+                       """)
+
+staging_songs_copy_template = ("""
+                       copy songs_stg from {song_data} 
+                       credentials 'aws_iam_role={arn}' 
+                       json 'auto' 
+                       compupdate off region 'us-west-2' maxerror {maxerror}
+                       """)
+
+# Insert data into Staging tables from a manifest
+# Formatted at run time with the manifest S3 URI, the IAM role ARN and extra
+# COPY options (e.g. gzip for compacted files).
+
+staging_events_copy_manifest = ("""
+                       copy events_stg from '{}' 
                        credentials 'aws_iam_role={}' 
                        json 's3://udacity-dend/log_json_path.json' 
-                       compupdate off region 'us-west-2'                    
-                       """).format(config.get('S3','LOG_DATA'), 
-                                   config.get('IAM_ROLE','ARN'))
+                       manifest compupdate off region 'us-west-2' {}
+                       """)
 
-staging_songs_copy = ("""
-                       copy songs_stg from {} 
+staging_songs_copy_manifest = ("""
+                       copy songs_stg from '{}' 
                        credentials 'aws_iam_role={}' 
                        json 'auto' 
-                       compupdate off region 'us-west-2'                     
-                       """).format(config.get('S3','SONG_DATA'),
-                                   config.get('IAM_ROLE','ARN'))
+                       manifest compupdate off region 'us-west-2' {}
+                       """)
+
+# Rows rejected by the latest COPY statements of this session (Redshift)
+
+load_errors_select = ("""select trim(filename), line_number, trim(colname), trim(raw_field_value),
+                               trim(err_reason)
+                          from stl_load_errors
+                         where session = pg_backend_pid()
+                         order by starttime desc
+                         limit %s;
+                      """)
+
+# Export of a table to S3 as Parquet
+# Formatted at run time with the SELECT statement (single quotes doubled), the
+# S3 prefix and the IAM role ARN. Every slice writes its own files.
+
+table_unload = ("""
+                unload ('{}')
+                to '{}'
+                iam_role '{}'
+                format as parquet parallel on allowoverwrite;
+                """)
+
+unload_count_select = "select pg_last_unload_count();"
+
+# Checkpoints
+
+checkpoint_insert = "insert into etl_checkpoints values (%s, %s, current_timestamp);"
+
+checkpoint_select = "select step from etl_checkpoints where run_id = %s;"
+
+# Latest run without a 'finished' checkpoint
+checkpoint_unfinished_run_select = ("""select run_id
+                                         from etl_checkpoints
+                                        group by run_id
+                                       having sum(case when step = 'finished' then 1 else 0 end) = 0
+                                        order by max(completed_at) desc
+                                        limit 1;
+                                    """)
+
+# Live catalog, compared with the CREATE TABLE statements by create_tables.py --sync
+
+catalog_columns_select = ("""select table_name, column_name, data_type,
+                                   character_maximum_length, is_nullable
+                              from information_schema.columns
+                             where table_schema = 'public'
+                             order by table_name, ordinal_position;
+                          """)
+
+# Load generations
+
+load_generation_insert = "insert into etl_load_generations values (current_timestamp);"
+
+load_generation_select = "select max(loaded_at) from etl_load_generations;"
+
+# Incremental load state
+
+staging_truncate_queries = ["truncate events_stg;", "truncate songs_stg;"]
+
+loaded_files_select = "select s3_key from etl_loaded_files where source = %s;"
+
+loaded_files_all_select = "select s3_key from etl_loaded_files;"
+
+loaded_files_insert = "insert into etl_loaded_files values (%s, %s, current_timestamp);"
+
+loaded_files_delete = "delete from etl_loaded_files where source = %s;"
+
+staged_files_insert = "insert into etl_staged_files values (%s, %s, %s);"
+
+staged_files_select = "select source, s3_key from etl_staged_files where run_id = %s;"
+
+staged_files_delete = "delete from etl_staged_files where run_id = %s;"
+
+watermark_select = "select value from etl_watermarks where source = %s;"
+
+songplay_exists_select = "select 1 from songs_plays_fact limit 1;"
+
+# Events at or below the watermark were merged by an earlier run.
+events_stg_below_watermark_delete = "delete from events_stg where ts <= %s;"
+
+watermark_upsert = ("""
+                    delete from etl_watermarks
+                     where source = 'events'
+                       and exists (select 1 from events_stg);
+                    insert into etl_watermarks
+                    select 'events', max(ts), getdate()
+                      from events_stg
+                     having max(ts) is not null;
+                    """)
 
 # Insert data into Fact table
 
+# Join of an event to its song lookup row
+song_key_match = ("""l.song_key = fnv_hash(lower(trim(e.song)) || '|' ||
+                                                   lower(trim(e.artist)) || '|' ||
+                                                   cast(cast(round(e.length * 10) as bigint) as varchar), 0)""")
+
 songplay_table_insert = ("""insert into songs_plays_fact
                          (
                          start_time,
@@ -167,20 +495,40 @@ songplay_table_insert = ("""insert into songs_plays_fact
                          select TIMESTAMP 'epoch' + ts/1000 *INTERVAL '1 second',
                                 user_id,
                                 level,
-                                s.song_id,
-                                a.artist_id,
+                                l.song_id,
+                                l.artist_id,
                                 session_id,
                                 e.location,
                                 user_agent
-                         from events_stg e join songs_dim s
-                         on (e.song = s.title and e.length = s.duration)
-                         join artists_dim a 
-                         on (a.name =e.artist)
+                         from events_stg e join song_lookup l
+                         on ({song_key_match})
                          where e.page ='NextSong'; 
-                         """)
+                         """).format(song_key_match=song_key_match)
+
+# Rebuilding the song lookup from the Dimension tables
+
+song_lookup_insert = ("""delete from song_lookup;
+                      insert into song_lookup
+                      (
+                      song_key,
+                      song_id,
+                      artist_id
+                      )
+                      select distinct fnv_hash(lower(trim(s.title)) || '|' ||
+                                               lower(trim(a.name)) || '|' ||
+                                               cast(cast(round(s.duration * 10) as bigint) as varchar), 0),
+                             s.song_id,
+                             s.artist_id
+                        from songs_dim s join artists_dim a
+                          on (s.artist_id = a.artist_id);
+                      """)
 
 # Insert data into Dimesnion table
 
+# Dimension rows are deduplicated per key with row_number(), Redshift does not
+# enforce primary keys and select distinct over all columns keeps one row per
+# variant (e.g. every level a user had).
+
 song_table_insert = ("""insert into songs_dim
                      (
                      song_id,
@@ -189,12 +537,17 @@ song_table_insert = ("""insert into songs_dim
                      year,
                      duration
                      )
-                     select distinct song_id,
+                     select song_id,
                             title,
                             artist_id,
                             year,
                             duration
-                       from songs_stg    
+                       from (select song_id, title, artist_id, year, duration,
+                                    row_number() over (partition by song_id
+                                                       order by year desc, title) as version
+                               from songs_stg
+                              where song_id is not null) s
+                      where version = 1;
                      """)
 
 user_table_insert = ("""insert into users_dim
@@ -205,13 +558,18 @@ user_table_insert = ("""insert into users_dim
                        gender, 
                        level
                        )
-                       select distinct user_id,
+                       select user_id,
                               first_name,
                               last_name,
                               gender,
                               level
-                         from events_stg
-                         where page ='NextSong';    
+                         from (select user_id, first_name, last_name, gender, level,
+                                      row_number() over (partition by user_id
+                                                         order by ts desc) as version
+                                 from events_stg
+                                where page ='NextSong'
+                                  and user_id is not null) e
+                        where version = 1;
                        """)
                 
 artist_table_insert = ("""
@@ -223,14 +581,26 @@ artist_table_insert = ("""
                        latitude, 
                        longitude
                        )
-                       select distinct artist_id,
+                       select artist_id,
                               artist_name,
                               artist_location,
                               artist_latitude,
                               artist_longitude
-                         from songs_stg;    
+                         from (select artist_id, artist_name, artist_location,
+                                      artist_latitude, artist_longitude,
+                                      row_number() over (partition by artist_id
+                                                         order by case when artist_location <> '' then 0 else 1 end,
+                                                                  case when artist_latitude is not null then 0 else 1 end,
+                                                                  artist_name) as version
+                                 from songs_stg
+                                where artist_id is not null) s
+                        where version = 1;
                        """)
 
+# Timestamps are converted once per distinct ts of NextSong events, the parts
+# are extracted from the deduplicated start_time and only timestamps not yet in
+# time_dim are inserted.
+
 time_table_insert = ("""
                      insert into time_dim
                      (
@@ -242,19 +612,330 @@ time_table_insert = ("""
                       year, 
                       weekday
                      )
-                      select distinct TIMESTAMP 'epoch' + ts/1000 *INTERVAL '1 second',
-                             extract(hour from TIMESTAMP 'epoch' + ts/1000 *INTERVAL '1 second'),
-                             extract(day from TIMESTAMP 'epoch' + ts/1000 *INTERVAL '1 second'),
-                             extract(week from TIMESTAMP 'epoch' + ts/1000 *INTERVAL '1 second'),
-                             extract(month from TIMESTAMP 'epoch' + ts/1000 *INTERVAL '1 second'),
-                             extract(year from TIMESTAMP 'epoch' + ts/1000 *INTERVAL '1 second'),
-                             extract(weekday from TIMESTAMP 'epoch' + ts/1000 *INTERVAL '1 second')
-                        from events_stg;   
+                      select t.start_time,
+                             extract(hour from t.start_time),
+                             extract(day from t.start_time),
+                             extract(week from t.start_time),
+                             extract(month from t.start_time),
+                             extract(year from t.start_time),
+                             extract(weekday from t.start_time)
+                        from (select distinct TIMESTAMP 'epoch' + ts/1000 *INTERVAL '1 second' as start_time
+                                from events_stg
+                               where page = 'NextSong') t
+                       where not exists (select 1
+                                           from time_dim d
+                                          where d.start_time = t.start_time);
 """)
 
+# Maintain users_dim_history (optional)
+# Staged events newer than a user's current history row are reduced to level
+# changes, seeded with the current row so a continuing level is no change.
+# The changes are added and the replaced current row is closed at the first
+# of them. Events at or before the current row are ignored, so replaying
+# staging does not add versions.
+
+user_level_changes = ("""select user_id, first_name, last_name, gender, level, valid_from,
+                               lead(valid_from) over (partition by user_id order by valid_from) as valid_to
+                          from (select user_id, first_name, last_name, gender, level, valid_from, stored,
+                                       lag(level) over (partition by user_id order by valid_from) as previous_level
+                                  from (select user_id, first_name, last_name, gender, level, valid_from,
+                                               1 as stored
+                                          from users_dim_history
+                                         where is_current
+                                        union all
+                                        select e.user_id, e.first_name, e.last_name, e.gender, e.level,
+                                               TIMESTAMP 'epoch' + e.ts/1000 *INTERVAL '1 second',
+                                               0
+                                          from events_stg e
+                                          left join users_dim_history h
+                                            on h.user_id = e.user_id
+                                           and h.is_current
+                                         where e.page = 'NextSong'
+                                           and e.user_id is not null
+                                           and (h.valid_from is null
+                                                or TIMESTAMP 'epoch' + e.ts/1000 *INTERVAL '1 second' > h.valid_from)) v
+                               ) v
+                         where stored = 0
+                           and (previous_level is null or previous_level <> level)""")
+
+user_history_insert = ("""insert into users_dim_history
+                         select user_id, first_name, last_name, gender, level,
+                                valid_from, valid_to, valid_to is null
+                           from ({changes}) c;
+                         update users_dim_history
+                            set valid_to = n.next_valid_from,
+                                is_current = false
+                           from (select h.user_id, h.valid_from, min(n.valid_from) as next_valid_from
+                                   from users_dim_history h
+                                   join users_dim_history n
+                                     on n.user_id = h.user_id
+                                    and n.valid_from > h.valid_from
+                                  where h.is_current
+                                  group by h.user_id, h.valid_from) n
+                          where users_dim_history.user_id = n.user_id
+                            and users_dim_history.valid_from = n.valid_from
+                            and users_dim_history.is_current;
+                      """).format(changes=user_level_changes)
+
+# Merge data into Dimension tables (incremental load)
+# Rows for keys present in staging are replaced, everything else is kept.
+# time_table_insert only adds new timestamps and needs no delete.
+
+user_table_merge_delete = ("""delete from users_dim
+                              using events_stg e
+                              where users_dim.user_id = e.user_id
+                                and e.page = 'NextSong';
+                           """)
+
+song_table_merge_delete = ("""delete from songs_dim
+                              using songs_stg s
+                              where songs_dim.song_id = s.song_id;
+                           """)
+
+artist_table_merge_delete = ("""delete from artists_dim
+                                using songs_stg s
+                                where artists_dim.artist_id = s.artist_id;
+                             """)
+
+# Rollups (maintained by rollups.py)
+# Every delta aggregates a set of songplays per day and key and is merged into
+# its rollup: plays of existing (day, key) rows are added up, new rows
+# inserted. After a load the songplays are the staged NextSong events newer
+# than the rollup watermark (the highest event ts rolled up, %s), i.e. the
+# rows the load added to the Fact table; a rebuild reads the Fact table.
+
+rollup_staged_songplays = ("""(select TIMESTAMP 'epoch' + e.ts/1000 *INTERVAL '1 second' as start_time,
+                                      e.level, l.song_id, l.artist_id
+                                 from events_stg e join song_lookup l
+                                 on ({song_key_match})
+                                where e.page = 'NextSong'
+                                  and e.ts > %s)""").format(song_key_match=song_key_match)
+
+rollup_fact_songplays = "songs_plays_fact"
+
+daily_song_plays_delta = ("""select cast(p.start_time as date) as play_date, p.song_id, p.artist_id,
+                                    count(*) as plays
+                               from {songplays} p
+                              group by 1, 2, 3""")
+
+daily_artist_plays_delta = ("""select cast(p.start_time as date) as play_date, p.artist_id,
+                                      count(*) as plays
+                                 from {songplays} p
+                                group by 1, 2""")
+
+daily_level_plays_delta = ("""select cast(p.start_time as date) as play_date, t.hour, p.level,
+                                     count(*) as plays
+                                from {songplays} p
+                                join time_dim t on t.start_time = p.start_time
+                               group by 1, 2, 3""")
+
+# (rollup table, key columns, delta query)
+rollup_tables = [
+    ('daily_song_plays', ['play_date', 'song_id', 'artist_id'], daily_song_plays_delta),
+    ('daily_artist_plays', ['play_date', 'artist_id'], daily_artist_plays_delta),
+    ('daily_level_plays', ['play_date', 'hour', 'level'], daily_level_plays_delta),
+]
+
+rollup_delta_create = "create temp table rollup_delta as {delta};"
+
+rollup_merge_update = ("""update {table}
+                             set plays = {table}.plays + d.plays
+                            from rollup_delta d
+                           where {match};
+                       """)
+
+rollup_merge_insert = ("""insert into {table} ({columns})
+                          select {columns}
+                            from rollup_delta d
+                           where not exists (select 1 from {table} where {match});
+                       """)
+
+rollup_delta_drop = "drop table rollup_delta;"
+
+staged_events_max_ts_select = "select max(ts) from events_stg where page = 'NextSong';"
+
+rollup_watermark_delete = "delete from etl_watermarks where source = 'rollups';"
+
+rollup_watermark_insert = "insert into etl_watermarks values ('rollups', %s, current_timestamp);"
+
+# Daily plays as consumers query them, from the Fact table and from the
+# rollups: (name, Fact table query, rollup query), compared by rollups.py
+
+rollup_query_pairs = [
+    ('daily_song_plays',
+     """select cast(start_time as date) as play_date, song_id, count(*) as plays
+          from songs_plays_fact
+         group by 1, 2;""",
+     """select play_date, song_id, sum(plays) as plays
+          from daily_song_plays
+         group by 1, 2;"""),
+    ('daily_artist_plays',
+     """select cast(start_time as date) as play_date, artist_id, count(*) as plays
+          from songs_plays_fact
+         group by 1, 2;""",
+     """select play_date, artist_id, plays
+          from daily_artist_plays;"""),
+    ('daily_level_plays',
+     """select cast(start_time as date) as play_date, level, count(*) as plays
+          from songs_plays_fact
+         group by 1, 2;""",
+     """select play_date, level, sum(plays) as plays
+          from daily_level_plays
+         group by 1, 2;"""),
+]
+
+# Dashboard queries (served through query_cache.py)
+# Plays are read from the rollups, distinct users need the Fact table.
+
+top_songs_select = ("""select s.title, a.name as artist, sum(r.plays) as plays
+                          from daily_song_plays r
+                          join songs_dim s on s.song_id = r.song_id
+                          join artists_dim a on a.artist_id = r.artist_id
+                         group by s.title, a.name
+                         order by plays desc
+                         limit 10;
+                    """)
+
+plays_per_hour_select = ("""select hour, sum(plays) as plays
+                               from daily_level_plays
+                              group by hour
+                              order by hour;
+                         """)
+
+level_activity_select = ("""select f.level, count(distinct f.user_id) as users, count(*) as plays
+                               from songs_plays_fact f
+                              group by f.level
+                              order by f.level;
+                         """)
+
+dashboard_queries = {
+    'top_songs': top_songs_select,
+    'plays_per_hour': plays_per_hour_select,
+    'level_activity': level_activity_select,
+}
+
 # QUERY LISTS
 
-create_table_queries = [staging_events_table_create, staging_songs_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create]
-drop_table_queries = [staging_events_table_drop, staging_songs_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop]
-copy_table_queries = [staging_events_copy, staging_songs_copy]
-insert_table_queries = [user_table_insert, song_table_insert, artist_table_insert,time_table_insert, songplay_table_insert]
+create_table_queries = [staging_events_table_create, staging_songs_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create, song_lookup_table_create, watermark_table_create, loaded_files_table_create, staged_files_table_create, checkpoint_table_create, user_history_table_create, load_generation_table_create, daily_song_plays_table_create, daily_artist_plays_table_create, daily_level_plays_table_create]
+drop_table_queries = [staging_events_table_drop, staging_songs_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop, song_lookup_table_drop, watermark_table_drop, loaded_files_table_drop, staged_files_table_drop, checkpoint_table_drop, user_history_table_drop, load_generation_table_drop, daily_song_plays_table_drop, daily_artist_plays_table_drop, daily_level_plays_table_drop]
+insert_table_queries = [user_table_insert, song_table_insert, artist_table_insert,time_table_insert, song_lookup_insert, songplay_table_insert]
+merge_table_queries = [user_table_merge_delete, user_table_insert,
+                       song_table_merge_delete, song_table_insert,
+                       artist_table_merge_delete, artist_table_insert,
+                       time_table_insert,
+                       song_lookup_insert, songplay_table_insert]
+
+# INSERT DEPENDENCIES
+# Each node is (name, query, tables read, tables written). A node has to wait
+# for every node writing a table it reads, so all dimension loads can run
+# together, the song lookup waits for songs_dim and artists_dim and the fact
+# load waits for the song lookup.
+
+insert_table_nodes = [
+    ('user_table_insert', user_table_insert, ['events_stg'], ['users_dim']),
+    ('song_table_insert', song_table_insert, ['songs_stg'], ['songs_dim']),
+    ('artist_table_insert', artist_table_insert, ['songs_stg'], ['artists_dim']),
+    ('time_table_insert', time_table_insert, ['events_stg', 'time_dim'], ['time_dim']),
+    ('song_lookup_insert', song_lookup_insert, ['songs_dim', 'artists_dim'], ['song_lookup']),
+    ('songplay_table_insert', songplay_table_insert,
+     ['events_stg', 'song_lookup'], ['songs_plays_fact']),
+]
+
+# Optional nodes, added with etl.py --user-history
+user_history_nodes = [
+    ('user_history_insert', user_history_insert, ['events_stg', 'users_dim_history'], ['users_dim_history']),
+]
+
+# STATEMENT TEMPLATES
+# Rendered lazily per configuration, see render_statement.
+
+statement_templates = {
+    'staging_events_copy': staging_events_copy_template,
+    'staging_songs_copy': staging_songs_copy_template,
+}
+
+copy_table_names = ['staging_events_copy', 'staging_songs_copy']
+
+
+@functools.lru_cache(maxsize=32)
+def _read_config(path, mtime):
+    """Reading a config file, cached until the file changes."""
+    
+    config = configparser.ConfigParser()
+    config.read(path)
+    return config
+
+
+def _template_values(config, placeholders=False):
+    """Template parameter values of a config (ConfigParser or file path).
+
+    Raises ValueError naming the options of TEMPLATE_REQUIRED left empty, or
+    with placeholders renders them as <[SECTION] OPTION>.
+    """
+    
+    if config is None:
+        config = DEFAULT_CONFIG_FILE
+    source = config if isinstance(config, str) else 'the configuration'
+    if isinstance(config, str):
+        mtime = os.path.getmtime(config) if os.path.exists(config) else None
+        config = _read_config(os.path.abspath(config), mtime)
+    values = {name: config.get(section, option, fallback='') or TEMPLATE_DEFAULTS.get(name, '')
+              for name, (section, option) in TEMPLATE_PARAMETERS.items()}
+    missing = ['[{}] {}'.format(*TEMPLATE_PARAMETERS[name]) for name in TEMPLATE_REQUIRED if not values[name]]
+    if placeholders:
+        for name in TEMPLATE_REQUIRED:
+            values[name] = values[name] or '<[{}] {}>'.format(*TEMPLATE_PARAMETERS[name])
+    elif missing:
+        raise ValueError("{} not set in {}".format(', '.join(missing), source))
+    return tuple(sorted(values.items()))
+
+
+@functools.lru_cache(maxsize=256)
+def _render(name, values):
+    return statement_templates[name].format(**dict(values))
+
+
+def render_statement(name, config=None, placeholders=False):
+    """Rendering a statement template for a configuration. 
+    
+    Parameters
+    ___________
+        name         : str
+                      Name of the template in statement_templates
+        config       : configparser.ConfigParser or str
+                      Configuration or config file path, dwh.cfg by default
+        placeholders : bool
+                      Render empty required options as <[SECTION] OPTION>
+                      instead of raising ValueError, e.g. for a dry run
+    
+    Returns
+    ___________
+        str - rendered statement, memoized per configuration values
+    """
+    
+    return _render(name, _template_values(config, placeholders))
+
+
+def get_copy_table_queries(config=None):
+    """COPY statements of the staging tables for a configuration. 
+    
+    Parameters
+    ___________
+        config : configparser.ConfigParser or str
+                Configuration or config file path, dwh.cfg by default
+    
+    Returns
+    ___________
+        list - rendered COPY statements
+    """
+    
+    return [render_statement(name, config) for name in copy_table_names]
+
+
+def __getattr__(name):
+    # Rendering the configuration dependent statements on first access
+    if name == 'copy_table_queries':
+        return get_copy_table_queries()
+    if name in statement_templates:
+        return render_statement(name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
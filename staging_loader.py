@@ -0,0 +1,216 @@
+"""Manifest based, slice parallel loading of Redshift staging tables
+This script lists the Song and Event json files of the S3 source prefixes,
+writes a COPY manifest per staging table and issues the COPY commands.
+
+In manifest mode the manifest lists the source files themselves, so files
+left out (e.g. quarantined by preflight.py) are skipped without moving them;
+COPY spreads the listed files over the slices on its own. In compact mode the
+files are first grouped into batches of balanced size, one per cluster slice,
+and each batch is compacted into one gzip'd line delimited json file, which
+Redshift ingests much faster than thousands of tiny files; the manifest then
+lists one file of similar size per slice, so every slice gets the same work.
+
+This file can also be imported as a module and contains the following
+functions:
+
+    * cluster_slices - Number of slices of the cluster configured in dwh.cfg.
+    * list_objects - Listing json files (key and size) under an S3 prefix.
+    * balance_batches - Grouping files into batches of similar total size.
+    * compact_batch - Writing one batch as a gzip'd line delimited json file.
+    * load_staging_tables - Loading both staging tables through manifests.
+"""
+
+# Importing system libraries
+import gzip
+import json
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Importing user libraries
+from s3_utils import split_s3_uri, write_manifest
+from sql_queries import staging_events_copy_manifest, staging_songs_copy_manifest
+
+# Size up to which a compacted batch is kept in memory before spilling to disk
+SPOOL_SIZE = 64 * 1024 * 1024
+
+# Slices per node for each Redshift node type
+NODE_SLICES = {
+    'dc2.large': 2,
+    'dc2.8xlarge': 16,
+    'ds2.xlarge': 2,
+    'ds2.8xlarge': 16,
+    'ra3.xlplus': 2,
+    'ra3.4xlarge': 4,
+    'ra3.16xlarge': 16,
+}
+
+
+def cluster_slices(config):
+    """Number of slices of the cluster configured in dwh.cfg.
+
+    Parameters
+    ___________
+        config : configparser.ConfigParser
+                Loaded dwh.cfg
+
+    Returns
+    ___________
+        int - NUM_NODES times the slices per node of NODE_TYPE
+    """
+
+    node_type = config.get('HARDWARE', 'NODE_TYPE').strip().lower()
+    num_nodes = int(config.get('HARDWARE', 'NUM_NODES') or 1)
+    return max(1, num_nodes) * NODE_SLICES.get(node_type, 2)
+
+
+def list_objects(s3, uri):
+    """Listing json files under an S3 prefix.
+
+    Parameters
+    ___________
+        s3  : boto3 S3 client
+        uri : str
+             S3 URI of the prefix
+
+    Returns
+    ___________
+        list - (s3:// URI, size in bytes) of each json file
+    """
+
+    bucket, prefix = split_s3_uri(uri)
+    objects = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith('.json'):
+                objects.append(('s3://{}/{}'.format(bucket, obj['Key']), obj['Size']))
+    return objects
+
+
+def balance_batches(objects, num_batches):
+    """Grouping files into batches of similar total size.
+
+    Files are handed out largest first, each to the currently smallest batch.
+
+    Parameters
+    ___________
+        objects     : list
+                     (s3:// URI, size in bytes) of each file
+        num_batches : int
+                     Number of batches, normally the cluster slice count
+
+    Returns
+    ___________
+        list - non empty lists of s3:// URIs
+    """
+
+    batches = [[] for _ in range(max(1, num_batches))]
+    sizes = [0] * len(batches)
+    for uri, size in sorted(objects, key=lambda obj: obj[1], reverse=True):
+        smallest = sizes.index(min(sizes))
+        batches[smallest].append(uri)
+        sizes[smallest] += size
+    return [batch for batch in batches if batch]
+
+
+def _json_records(body):
+    """Yielding json records of a file holding one document or one per line."""
+
+    text = body.decode('utf-8')
+    try:
+        yield json.loads(text)
+    except ValueError:
+        for line in text.splitlines():
+            if line.strip():
+                yield json.loads(line)
+
+
+def compact_batch(s3, batch, uri):
+    """Writing all files of a batch as one gzip'd line delimited json file.
+
+    Parameters
+    ___________
+        s3    : boto3 S3 client
+        batch : list
+               s3:// URIs of the source files
+        uri   : str
+               S3 URI of the compacted file
+
+    Returns
+    ___________
+        str - S3 URI of the compacted file
+
+    The file is spooled to disk past SPOOL_SIZE and uploaded with upload_fileobj,
+    which switches to a multipart upload for large batches.
+    """
+
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as spool:
+        with gzip.GzipFile(fileobj=spool, mode='wb') as out:
+            for source in batch:
+                bucket, key = split_s3_uri(source)
+                body = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+                for record in _json_records(body):
+                    out.write(json.dumps(record).encode('utf-8') + b'\n')
+        spool.seek(0)
+        bucket, key = split_s3_uri(uri)
+        s3.upload_fileobj(spool, bucket, key)
+    return 's3://{}/{}'.format(bucket, key)
+
+
+def load_staging_tables(cur, conn, s3, config, compact=False, max_workers=8, exclude=()):
+    """Loading events_stg and songs_stg through balanced COPY manifests.
+
+    Nothing is committed, the caller commits both tables at once (etl.py runs
+    the load as one checkpointed step).
+
+    Parameters
+    ___________
+        cur         : psycopg2 cursor object
+                     Cursor object for sparkifydb
+        conn        : psycopg2 connection object
+                     Connection object for sparkifydb
+        s3          : boto3 S3 client
+        config      : configparser.ConfigParser
+                     Loaded dwh.cfg
+        compact     : bool
+                     Compact source files into one gzip'd file per slice
+                     first, False lists the source files in the manifest
+        max_workers : int
+                     Number of batches compacted at the same time
+        exclude     : set
+                     s3:// URIs of files left out, e.g. quarantined by preflight.py
+
+    Returns
+    ___________
+        dict - number of files in the manifest per staging table
+    """
+
+    arn = config.get('IAM_ROLE', 'ARN')
+    prefix = config.get('S3', 'MANIFEST_PREFIX').strip().strip("'\"").rstrip('/')
+    slices = cluster_slices(config)
+    sources = [('events_stg', config.get('S3', 'LOG_DATA'), staging_events_copy_manifest),
+               ('songs_stg', config.get('S3', 'SONG_DATA'), staging_songs_copy_manifest)]
+
+    loaded = {}
+    for table, uri, copy_query in sources:
+        objects = [obj for obj in list_objects(s3, uri) if obj[0] not in exclude]
+        if compact:
+            # Batches of balanced size only matter once each becomes one file
+            batches = balance_batches(objects, slices)
+            targets = ['{}/compacted/{}/part-{:04d}.json.gz'.format(prefix, table, i)
+                       for i in range(len(batches))]
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                files = list(executor.map(lambda args: compact_batch(s3, *args),
+                                          zip(batches, targets)))
+        else:
+            files = [source for source, _ in objects]
+
+        loaded[table] = len(files)
+        if not files:
+            continue
+
+        manifest = write_manifest(s3, '{}/{}.manifest'.format(prefix, table), files)
+        options = 'maxerror ' + (config.get('S3', 'MAXERROR', fallback='') or '0')
+        cur.execute(copy_query.format(manifest, arn, ('gzip ' if compact else '') + options))
+
+    return loaded
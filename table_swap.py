@@ -0,0 +1,204 @@
+"""Blue/green loading of sparkifydb Fact and Dimension tables
+This script builds the Fact and Dimension tables under shadow names
+(<table>_new) while the production tables stay readable, validates them and
+swaps them in with ALTER TABLE ... RENAME in one transaction. Analysts never
+see empty or half loaded tables and read queries are not slowed down by the
+load.
+
+The Fact table can instead be appended to: swap loads stage the whole S3
+prefix, so only the shadow songplays newer than the latest one already in
+production are inserted into songs_plays_fact, in the transaction renaming
+the Dimension tables, so the Fact rows and the Dimensions change together.
+songplay_id is left out of the insert and generated by production, the
+shadow table numbers its rows from 0 again on every load.
+
+This file can also be imported as a module and contains the following
+functions:
+
+    * shadow_statement - Rewriting a statement to use the shadow tables.
+    * shadow_nodes - Rewriting insert DAG nodes to use the shadow tables.
+    * prepare_shadow_tables - Creating (fresh) shadow tables.
+    * validate_shadow_tables - Checking the shadow tables before the swap.
+    * swap_tables - Swapping the shadow tables in.
+"""
+
+# Importing system libraries
+import re
+
+# Importing user libraries
+from schema_advisor import parse_create
+from sql_queries import create_table_queries
+
+# Tables built under a shadow name and swapped in
+PRODUCTION_TABLES = ['songs_plays_fact', 'users_dim', 'songs_dim', 'artists_dim', 'time_dim']
+
+SHADOW_SUFFIX = '_new'
+OLD_SUFFIX = '_old'
+
+_TABLE_PATTERN = re.compile(r'\b({})\b'.format('|'.join(PRODUCTION_TABLES)))
+
+
+def shadow_statement(query):
+    """Rewriting a statement to use the shadow tables.
+
+    Parameters
+    ___________
+        query : str
+               Statement from sql_queries.py
+
+    Returns
+    ___________
+        str - statement with production table names replaced by shadow names
+    """
+
+    return _TABLE_PATTERN.sub(lambda match: match.group(1) + SHADOW_SUFFIX, query)
+
+
+def shadow_nodes(nodes):
+    """Rewriting insert DAG nodes to use the shadow tables.
+
+    Parameters
+    ___________
+        nodes : list of tuples
+               (name, query, tables read, tables written), see dag_executor
+
+    Returns
+    ___________
+        list - nodes reading and writing the shadow tables
+    """
+
+    def rename(tables):
+        return [table + SHADOW_SUFFIX if table in PRODUCTION_TABLES else table for table in tables]
+
+    return [(name, shadow_statement(query), rename(reads), rename(writes))
+            for name, query, reads, writes in nodes]
+
+
+def prepare_shadow_tables(cur, conn, fresh=True):
+    """Creating the shadow tables.
+
+    Parameters
+    ___________
+        cur   : psycopg2 cursor object
+               Cursor object for sparkifydb
+        conn  : psycopg2 connection object
+               Connection object for sparkifydb
+        fresh : bool
+               Drop shadow tables left by an earlier load first; False keeps
+               them, e.g. when resuming a failed load
+
+    Returns
+    ___________
+        None
+    """
+
+    for query in create_table_queries:
+        table, _ = parse_create(query)
+        if table not in PRODUCTION_TABLES:
+            continue
+        if fresh:
+            cur.execute("drop table if exists {};".format(table + SHADOW_SUFFIX))
+        cur.execute(shadow_statement(query))
+    conn.commit()
+
+
+def validate_shadow_tables(cur):
+    """Checking the shadow tables before they are swapped in.
+
+    Every shadow table has to hold rows.
+
+    Parameters
+    ___________
+        cur : psycopg2 cursor object
+             Cursor object for sparkifydb
+
+    Returns
+    ___________
+        dict - row count per shadow table
+    """
+
+    counts = {}
+    for table in PRODUCTION_TABLES:
+        cur.execute("select count(*) from {};".format(table + SHADOW_SUFFIX))
+        counts[table + SHADOW_SUFFIX] = cur.fetchone()[0]
+
+    empty = [table for table, rows in counts.items() if not rows]
+    if empty:
+        raise ValueError("Shadow tables are empty, not swapping: " + ', '.join(empty))
+    return counts
+
+
+def _appended_columns():
+    """Fact table columns copied by an append, all but the identity column."""
+
+    query = next(query for query in create_table_queries if parse_create(query)[0] == 'songs_plays_fact')
+    return [name for name, _, rest in parse_create(query)[1]
+            if not re.search(r'\bidentity\b', rest, re.IGNORECASE)]
+
+
+def _table_exists(cur, table):
+    cur.execute("select count(*) from information_schema.tables where table_name = %s;", (table,))
+    return cur.fetchone()[0] > 0
+
+
+def swap_tables(cur, conn, append_fact=False):
+    """Swapping the shadow tables in.
+
+    All renames (and the Fact append) happen in one transaction, readers see
+    either the old or the new set of tables and a failure changes nothing.
+    The replaced tables are dropped afterwards. The connection has to be in
+    autocommit mode and outside a transaction, as the transactions are
+    managed here.
+
+    Parameters
+    ___________
+        cur         : psycopg2 cursor object
+                     Cursor object for sparkifydb
+        conn        : psycopg2 connection object
+                     Connection object for sparkifydb
+        append_fact : bool
+                     Insert the shadow Fact rows newer than the latest
+                     production songplay into songs_plays_fact instead of
+                     swapping the table
+
+    Returns
+    ___________
+        None
+    """
+
+    if not conn.autocommit:
+        raise ValueError("swap_tables needs a connection in autocommit mode")
+
+    tables = list(PRODUCTION_TABLES)
+    if append_fact:
+        tables.remove('songs_plays_fact')
+
+    autocommit = conn.autocommit
+    conn.autocommit = False
+    try:
+        if append_fact:
+            # The shadow table holds every staged songplay, the ones already in
+            # production would be appended a second time. ALTER TABLE APPEND
+            # would keep the shadow songplay_ids, which production already
+            # holds, and cannot run inside this transaction.
+            columns = ', '.join(_appended_columns())
+            cur.execute("insert into songs_plays_fact ({0}) select {0} from songs_plays_fact{1} "
+                        "where start_time > (select coalesce(max(start_time), '1900-01-01') "
+                        "from songs_plays_fact);".format(columns, SHADOW_SUFFIX))
+        for table in tables:
+            cur.execute("drop table if exists {};".format(table + OLD_SUFFIX))
+            if _table_exists(cur, table):
+                cur.execute("alter table {} rename to {};".format(table, table + OLD_SUFFIX))
+            cur.execute("alter table {} rename to {};".format(table + SHADOW_SUFFIX, table))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = autocommit
+
+    for table in tables:
+        cur.execute("drop table if exists {};".format(table + OLD_SUFFIX))
+    if append_fact:
+        cur.execute("drop table if exists songs_plays_fact{};".format(SHADOW_SUFFIX))
+    conn.commit()
@@ -0,0 +1,84 @@
+"""Shared fixtures of the test suite
+
+The modules of the project are top level scripts, so the repository root is
+put on sys.path. AWS calls go to moto or to botocore Stubber backed clients,
+nothing leaves the machine.
+"""
+
+# Importing system libraries
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BUCKET = 'sparkify-test'
+
+CONFIG = """[CLUSTER]
+CLUSTER_IDENTIFIER=sparkify
+
+[S3]
+LOG_DATA=s3://{bucket}/log_data
+SONG_DATA=s3://{bucket}/song_data
+MANIFEST_PREFIX=s3://{bucket}/manifests
+
+[IAM_ROLE]
+ARN=arn:aws:iam::123456789012:role/sparkify
+
+[AWS]
+KEY=testing
+SECRET=testing
+
+[DB]
+DB_NAME=sparkifydb
+DB_PASSWORD=Passw0rd
+
+[HARDWARE]
+CLUSTER_TYPE=multi-node
+NODE_TYPE=dc2.large
+NUM_NODES=2
+
+[CAPACITY]
+GB_PER_NODE=1
+MIN_NODES=2
+MAX_NODES=8
+""".format(bucket=BUCKET)
+
+
+@pytest.fixture(autouse=True)
+def aws_credentials(monkeypatch):
+    """Fake credentials, so no client can reach a real account."""
+
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SECURITY_TOKEN', 'AWS_SESSION_TOKEN'):
+        monkeypatch.setenv(name, 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-west-2')
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    path = tmp_path / 'dwh.cfg'
+    path.write_text(CONFIG)
+    return str(path)
+
+
+@pytest.fixture
+def config(config_file):
+    import configparser
+
+    parsed = configparser.ConfigParser()
+    parsed.read(config_file)
+    return parsed
+
+
+@pytest.fixture
+def s3():
+    """moto backed S3 client with an empty bucket."""
+
+    import boto3
+    from moto import mock_aws
+
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-west-2')
+        client.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={'LocationConstraint': 'us-west-2'})
+        yield client
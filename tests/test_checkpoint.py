@@ -0,0 +1,89 @@
+"""Tests of the checkpointed load steps"""
+
+# Importing system libraries
+import pytest
+
+# Importing user libraries
+import checkpoint
+from sql_queries import checkpoint_insert
+
+
+class _Conn:
+    def __init__(self, rows=()):
+        self.autocommit = True
+        self.rows = list(rows)
+        self.queries = []
+        self.events = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, params=None):
+        self.queries.append((query, params))
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+    def commit(self):
+        self.events.append(('commit', self.autocommit))
+
+    def rollback(self):
+        self.events.append(('rollback', self.autocommit))
+
+
+def test_run_step_records_the_step_in_its_transaction():
+    conn = _Conn()
+    completed = set()
+
+    assert checkpoint.run_step(conn, 'r1', 'songs', completed, lambda cur: cur.execute('copy songs'))
+
+    assert conn.queries == [('copy songs', None), (checkpoint_insert, ('r1', 'songs'))]
+    assert conn.events == [('commit', False)] and conn.autocommit
+    assert completed == {'songs'}
+
+
+def test_run_step_skips_completed_steps():
+    conn = _Conn()
+
+    assert not checkpoint.run_step(conn, 'r1', 'songs', {'songs'}, lambda cur: cur.execute('copy songs'))
+
+    assert conn.queries == [] and conn.events == []
+
+
+def test_failed_step_is_rolled_back_and_not_recorded():
+    conn = _Conn()
+    completed = set()
+
+    def _fail(cur):
+        raise RuntimeError("copy failed")
+
+    with pytest.raises(RuntimeError):
+        checkpoint.run_step(conn, 'r1', 'songs', completed, _fail)
+
+    assert conn.queries == [] and conn.events == [('rollback', False)]
+    assert conn.autocommit and completed == set()
+
+
+def test_resume_picks_up_the_completed_steps_of_the_unfinished_run(monkeypatch):
+    conn = _Conn([('started',), ('songs',)])
+    monkeypatch.setattr(conn, 'fetchone', lambda: ('r1',))
+
+    run_id, completed = checkpoint.start_run(conn, conn, resume=True)
+
+    assert run_id == 'r1' and completed == {'songs'}
+    assert (checkpoint_insert, ('r1', 'started')) not in conn.queries
+
+
+def test_new_run_is_recorded_as_started():
+    conn = _Conn()
+
+    run_id, completed = checkpoint.start_run(conn, conn, 'r2')
+
+    assert run_id == 'r2' and completed == set()
+    assert conn.queries[-1] == (checkpoint_insert, ('r2', 'started'))
@@ -0,0 +1,58 @@
+"""Tests of the schema sync plan"""
+
+# Importing user libraries
+from create_tables import plan_schema_sync
+
+QUERY = """create table if not exists plays
+(
+ play_id     integer identity(0,1) primary key,
+ user_name   varchar(100) not null,
+ level       varchar(20),
+ started_at  timestamp not null
+);"""
+
+CATALOG = [('play_id', 'integer', None, False),
+           ('user_name', 'character varying', 100, False),
+           ('level', 'character varying', 20, True),
+           ('started_at', 'timestamp without time zone', None, False)]
+
+
+def _plan(columns):
+    return plan_schema_sync({'plays': columns}, [QUERY])
+
+
+def test_missing_table_is_created():
+    assert plan_schema_sync({}, [QUERY]) == [('plays', 'create', [QUERY])]
+
+
+def test_matching_table_is_left_alone():
+    assert _plan(CATALOG) == []
+
+
+def test_appended_nullable_column_is_added():
+    query = QUERY.replace("not null\n);", "not null,\n session_id  smallint\n);")
+
+    assert plan_schema_sync({'plays': CATALOG}, [query]) == [
+        ('plays', 'alter columns', ["alter table plays add column session_id smallint;"])]
+
+
+def test_wider_varchar_is_altered_in_place():
+    catalog = [CATALOG[0], ('user_name', 'character varying', 50, False)] + CATALOG[2:]
+
+    assert _plan(catalog) == [
+        ('plays', 'alter columns', ["alter table plays alter column user_name type varchar(100);"])]
+
+
+def test_other_changes_copy_the_rows_into_a_new_table():
+    catalog = [CATALOG[0], ('user_name', 'character varying', 200, False), CATALOG[3]]
+
+    (table, action, statements), = _plan(catalog)
+
+    assert (table, action) == ('plays', 'rebuild')
+    assert statements[0] == "drop table if exists plays_sync;"
+    assert statements[1].startswith("create table if not exists plays_sync\n")
+    # The identity column is generated again, the dropped level column has nothing to copy
+    assert statements[2:] == ["insert into plays_sync (user_name, started_at) select user_name, started_at from plays;",
+                              "drop table plays;",
+                              "alter table plays_sync rename to plays;"]
+    assert not any(statement.startswith("drop table if exists plays;") for statement in statements)
@@ -0,0 +1,72 @@
+"""Tests of the statement dependency graph"""
+
+# Importing system libraries
+import pytest
+
+# Importing user libraries
+from dag_executor import build_dag, run_dag
+from sql_queries import insert_table_nodes
+
+
+def test_readers_depend_on_earlier_writers():
+    nodes = [('a', '', [], ['t1']),
+             ('b', '', ['t1'], ['t2']),
+             ('c', '', ['s'], ['t3']),
+             ('d', '', ['t2', 't3'], ['t1'])]
+
+    assert build_dag(nodes) == {'a': set(), 'b': {'a'}, 'c': set(), 'd': {'a', 'b', 'c'}}
+
+
+def test_writers_of_the_same_table_keep_declaration_order():
+    nodes = [('first', '', [], ['t']), ('second', '', [], ['t'])]
+
+    assert build_dag(nodes)['second'] == {'first'}
+
+
+def test_duplicate_nodes_are_rejected():
+    with pytest.raises(ValueError):
+        build_dag([('a', '', [], ['t']), ('a', '', [], ['t'])])
+
+
+def test_insert_nodes_form_a_dag():
+    dag = build_dag(insert_table_nodes)
+    names = [node[0] for node in insert_table_nodes]
+
+    assert set(dag) == set(names)
+    assert all(names.index(upstream) < names.index(name) for name, upstreams in dag.items()
+               for upstream in upstreams)
+
+
+class _Conn:
+    autocommit = True
+    rowcount = 1
+
+    def cursor(self):
+        return self
+
+    def execute(self, query):
+        self.query = query
+
+    def close(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def test_every_statement_borrows_and_returns_a_connection():
+    borrowed, returned = [], []
+
+    def connect():
+        borrowed.append(_Conn())
+        return borrowed[-1]
+
+    timings = run_dag([('a', 'q1', [], ['t1']), ('b', 'q2', ['t1'], ['t2']), ('c', 'q3', [], ['t3'])],
+                      connect, max_workers=2, release=returned.append)
+
+    assert set(timings) == {'a', 'b', 'c'}
+    assert sorted(map(id, borrowed)) == sorted(map(id, returned))
+    assert all(conn.autocommit for conn in returned)
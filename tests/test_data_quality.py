@@ -0,0 +1,72 @@
+"""Tests of the single scan data quality checks"""
+
+# Importing system libraries
+import pytest
+
+# Importing user libraries
+from data_quality import CHECKS, INCREMENTAL_CHECKS, check_load, compile_checks, run_quality_checks
+
+
+class _Cursor:
+    """Answers each scan with the row given for its table."""
+
+    def __init__(self, checks, **rows):
+        self.tables = [table for table, _, _ in compile_checks(checks)]
+        self.rows = rows
+        self.queries = []
+
+    def execute(self, query):
+        self.queries.append(query)
+
+    def fetchone(self):
+        return self.rows[self.tables[len(self.queries) - 1]]
+
+
+# Rows of a good full load, in the select list order of compile_checks
+GOOD = {'events_stg': (10,), 'songs_plays_fact': (8, 0, 0, 0), 'users_dim': (0, 0),
+        'songs_dim': (0,), 'artists_dim': (0,), 'time_dim': (0,)}
+
+
+def test_compile_checks_scans_every_table_once():
+    scans = compile_checks()
+
+    assert [table for table, _, _ in scans] == list(GOOD)
+    table, query, names = scans[1]
+    assert names == ['songplays_within_staging', 'songplays_null_keys', 'songplays_orphan_song_id',
+                     'songplays_orphan_artist_id']
+    assert query.startswith("select count(*), sum(case when f.start_time is null")
+    assert "left join (select distinct song_id from songs_dim) s" in query
+
+
+def test_checks_pass_on_a_good_load():
+    cur = _Cursor(CHECKS, **GOOD)
+
+    results, timings = run_quality_checks(None, cur=cur)
+
+    assert all(passed for _, _, passed in results)
+    assert set(timings) == set(GOOD) and len(cur.queries) == len(GOOD)
+
+
+def test_failed_checks_are_named():
+    cur = _Cursor(CHECKS, **dict(GOOD, songs_plays_fact=(12, 0, 3, 0), users_dim=(0, 1)))
+
+    with pytest.raises(ValueError, match="songplays_within_staging, songplays_orphan_song_id, "
+                                         "users_duplicate_user_id"):
+        check_load(cur=cur)
+
+
+def test_rewrite_is_applied_to_every_scan():
+    cur = _Cursor(CHECKS, **GOOD)
+
+    run_quality_checks(None, rewrite=lambda query: query.replace('users_dim', 'users_dim_new'), cur=cur)
+
+    assert any('from users_dim_new' in query for query in cur.queries)
+
+
+def test_incremental_checks_allow_a_merge_without_events():
+    cur = _Cursor(INCREMENTAL_CHECKS, **dict(GOOD, events_stg=(None,), staged_songplays=(0,),
+                                             songs_plays_fact=(0, 0, 0)))
+
+    results = check_load(cur=cur, checks=INCREMENTAL_CHECKS)
+
+    assert dict((name, passed) for name, _, passed in results)['songplays_within_staging']
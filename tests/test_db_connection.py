@@ -0,0 +1,125 @@
+"""Tests of the connection retries and the connection pool"""
+
+# Importing system libraries
+import psycopg2
+import pytest
+
+# Importing user libraries
+import db_connection
+from db_connection import ConnectionPool, connect
+
+
+class _Conn:
+    def __init__(self):
+        self.closed = 0
+        self.autocommit = True
+        self.rolled_back = False
+
+    def set_session(self, autocommit):
+        self.autocommit = autocommit
+
+    def rollback(self):
+        self.rolled_back = True
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def db_config(config):
+    for option, value in (('HOST', 'localhost'), ('DB_USER', 'sparkify'), ('DB_PORT', '5439')):
+        config.set('DB', option, value)
+    return config
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    conns = []
+
+    def _connect(config):
+        conns.append(_Conn())
+        return conns[-1]
+
+    monkeypatch.setattr(db_connection, 'connect', _connect)
+    return conns
+
+
+def test_connect_retries_with_backoff(db_config, monkeypatch):
+    attempts, waits = [], []
+
+    def _connect(**params):
+        attempts.append(params)
+        if len(attempts) < 3:
+            raise psycopg2.OperationalError("refused")
+        return _Conn()
+
+    monkeypatch.setattr(psycopg2, 'connect', _connect)
+    monkeypatch.setattr(db_connection.time, 'sleep', waits.append)
+
+    conn = connect(db_config, backoff=0.5)
+
+    assert len(attempts) == 3 and waits == [0.5, 1.0]
+    assert attempts[0]['keepalives'] == 1 and conn.autocommit
+
+
+def test_connect_raises_after_the_last_attempt(db_config, monkeypatch):
+    def _connect(**params):
+        raise psycopg2.OperationalError("refused")
+
+    monkeypatch.setattr(psycopg2, 'connect', _connect)
+    monkeypatch.setattr(db_connection.time, 'sleep', lambda seconds: None)
+
+    with pytest.raises(psycopg2.OperationalError):
+        connect(db_config, retries=2)
+
+
+def test_pool_reuses_returned_connections(config, opened):
+    pool = ConnectionPool(config, maxconn=2)
+
+    first = pool.getconn()
+    pool.putconn(first)
+    with pool.connection() as conn:
+        assert conn is first
+
+    assert len(opened) == 1
+
+
+def test_pool_replaces_closed_connections(config, opened):
+    pool = ConnectionPool(config, maxconn=2)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    conn.close()
+
+    assert pool.getconn() is not conn
+    assert len(opened) == 2
+
+
+def test_pool_rolls_back_transactions_of_returned_connections(config, opened):
+    pool = ConnectionPool(config, maxconn=1)
+    conn = pool.getconn()
+    conn.autocommit = False
+
+    pool.putconn(conn)
+
+    assert conn.rolled_back and pool.getconn() is conn
+
+
+def test_pool_closes_broken_connections(config, opened):
+    pool = ConnectionPool(config, maxconn=1)
+
+    with pytest.raises(psycopg2.InterfaceError):
+        with pool.connection():
+            raise psycopg2.InterfaceError("connection already closed")
+
+    assert opened[0].closed
+    assert pool.getconn() is opened[1]
+
+
+def test_closeall_closes_idle_and_borrowed_connections(config, opened):
+    pool = ConnectionPool(config, maxconn=2)
+    borrowed = pool.getconn()
+    pool.putconn(pool.getconn())
+
+    pool.closeall()
+
+    assert borrowed.closed and all(conn.closed for conn in opened)
@@ -0,0 +1,73 @@
+"""Tests of the deduplicating Dimension loads and merges
+
+The inserts only use standard SQL, so they run on an in-memory SQLite
+database with the columns of the CREATE TABLE statements.
+"""
+
+# Importing system libraries
+import sqlite3
+
+import pytest
+
+# Importing user libraries
+from schema_advisor import parse_create
+from sql_queries import (artist_table_insert, artist_table_merge_delete, create_table_queries,
+                         merge_table_queries, song_table_insert, song_table_merge_delete, user_table_insert,
+                         user_table_merge_delete)
+
+
+@pytest.fixture
+def db():
+    conn = sqlite3.connect(':memory:')
+    for query in create_table_queries:
+        table, columns = parse_create(query)
+        if table in ('events_stg', 'songs_stg', 'users_dim', 'songs_dim', 'artists_dim'):
+            conn.execute("create table {} ({})".format(table, ', '.join(name for name, _, _ in columns)))
+    yield conn
+    conn.close()
+
+
+def _insert(db, table, **values):
+    db.execute("insert into {} ({}) values ({})".format(table, ', '.join(values), ', '.join('?' * len(values))),
+               list(values.values()))
+
+
+def test_users_keep_the_latest_event_per_user(db):
+    _insert(db, 'events_stg', user_id=1, first_name='Ann', level='free', page='NextSong', ts=1)
+    _insert(db, 'events_stg', user_id=1, first_name='Ann', level='paid', page='NextSong', ts=2)
+    _insert(db, 'events_stg', user_id=1, first_name='Ann', level='free', page='Home', ts=3)
+    _insert(db, 'events_stg', user_id=None, first_name='Guest', level='free', page='NextSong', ts=4)
+
+    db.execute(user_table_insert)
+
+    assert db.execute("select user_id, level from users_dim").fetchall() == [(1, 'paid')]
+
+
+def test_songs_keep_one_row_per_song_id(db):
+    _insert(db, 'songs_stg', song_id='S1', title='B', year=2000, artist_id='A1')
+    _insert(db, 'songs_stg', song_id='S1', title='A', year=2001, artist_id='A1')
+    _insert(db, 'songs_stg', song_id=None, title='C', year=2001, artist_id='A1')
+
+    db.execute(song_table_insert)
+
+    assert db.execute("select song_id, title from songs_dim").fetchall() == [('S1', 'A')]
+
+
+def test_artists_prefer_rows_with_location_and_coordinates(db):
+    _insert(db, 'songs_stg', artist_id='A1', artist_name='Ann', artist_location='')
+    _insert(db, 'songs_stg', artist_id='A1', artist_name='Ann', artist_location='Oslo', artist_latitude=59.9)
+    _insert(db, 'songs_stg', artist_id='A1', artist_name='Ann', artist_location='Oslo')
+
+    db.execute(artist_table_insert)
+
+    assert db.execute("select artist_id, location, latitude from artists_dim").fetchall() == [('A1', 'Oslo', 59.9)]
+
+
+@pytest.mark.parametrize('delete, insert, key', [
+    (user_table_merge_delete, user_table_insert, 'users_dim.user_id = e.user_id'),
+    (song_table_merge_delete, song_table_insert, 'songs_dim.song_id = s.song_id'),
+    (artist_table_merge_delete, artist_table_insert, 'artists_dim.artist_id = s.artist_id'),
+])
+def test_merges_replace_the_staged_keys_before_inserting(delete, insert, key):
+    assert merge_table_queries.index(delete) + 1 == merge_table_queries.index(insert)
+    assert key in delete
@@ -0,0 +1,107 @@
+"""Tests of the Parquet export paths"""
+
+# Importing system libraries
+import collections
+import datetime
+import decimal
+import os
+
+import pyarrow.parquet as pq
+import pytest
+
+# Importing user libraries
+from export import download_prefix, export_table, stream_table, unload_table
+from s3_utils import split_s3_uri
+from conftest import BUCKET
+
+_Column = collections.namedtuple('_Column', 'name type_code precision scale')
+
+# song_id varchar, year smallint, duration numeric(10, 2), released date, played timestamp, score numeric
+DESCRIPTION = [_Column('song_id', 1043, None, None), _Column('year', 21, None, None),
+               _Column('duration', 1700, 10, 2), _Column('released', 1082, None, None),
+               _Column('played', 1114, None, None), _Column('score', 1700, None, None)]
+
+
+class _Conn:
+    """Connection with one named cursor over the given rows."""
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.autocommit = True
+        self.description = DESCRIPTION
+        self.queries = []
+
+    def cursor(self, name=None):
+        self.name = name
+        return self
+
+    def execute(self, query, params=None):
+        self.queries.append(query)
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def fetchone(self):
+        return (5,)
+
+    def close(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def _rows(count):
+    return [('S{}'.format(i), 2000 + i, decimal.Decimal('215.25'), datetime.date(2018, 11, 1),
+             datetime.datetime(2018, 11, 1, 12, 0), decimal.Decimal('0.5') if i % 2 else None)
+            for i in range(count)]
+
+
+def test_stream_table_writes_typed_files_of_bounded_size(tmp_path):
+    conn = _Conn(_rows(5))
+
+    result = stream_table(conn, 'songs_dim', str(tmp_path), batch_rows=2, file_rows=4)
+
+    assert (result['rows'], result['files']) == (5, 2)
+    assert conn.name == 'export_songs_dim' and conn.autocommit
+    table = pq.read_table(str(tmp_path))
+    assert table.num_rows == 5
+    assert [str(field.type) for field in table.schema] == ['string', 'int16', 'decimal128(10, 2)', 'date32[day]',
+                                                          'timestamp[us]', 'double']
+    assert table.column('score').to_pylist()[:2] == [None, 0.5]
+
+
+def test_stream_table_of_an_empty_table_writes_nothing(tmp_path):
+    assert stream_table(_Conn([]), 'songs_dim', str(tmp_path))['files'] == 0
+
+
+def test_unload_quotes_the_select_and_counts_the_rows():
+    conn = _Conn([])
+
+    result = unload_table(conn, 'songs_dim', 's3://{}/export/'.format(BUCKET), 'arn:role')
+
+    assert result['rows'] == 5
+    assert "'select * from songs_dim'" in conn.queries[0]
+    assert "s3://{}/export/songs_dim/".format(BUCKET) in conn.queries[0]
+
+
+def test_download_prefix_fetches_every_file(s3, tmp_path):
+    for i in range(3):
+        s3.put_object(Bucket=BUCKET, Key='export/songs_dim/{}.parquet'.format(i), Body=b'x' * (i + 1))
+
+    result = download_prefix(s3, 's3://{}/export/songs_dim/'.format(BUCKET), str(tmp_path))
+
+    assert (result['files'], result['bytes']) == (3, 6)
+    assert sorted(os.listdir(str(tmp_path))) == ['0.parquet', '1.parquet', '2.parquet']
+
+
+def test_unknown_tables_are_rejected(config, tmp_path):
+    with pytest.raises(ValueError):
+        export_table(config, _Conn([]), 'pg_user', str(tmp_path), redshift=False)
+
+
+def test_split_s3_uri():
+    assert split_s3_uri(" 's3://bucket/log_data/2018' ") == ('bucket', 'log_data/2018')
+    with pytest.raises(ValueError):
+        split_s3_uri('bucket/log_data')
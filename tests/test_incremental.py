@@ -0,0 +1,75 @@
+"""Tests of the incremental load state"""
+
+# Importing user libraries
+import etl
+from incremental import list_new_keys, record_full_load
+from sql_queries import (loaded_files_delete, loaded_files_insert, loaded_files_select, staged_files_delete,
+                         staged_files_insert, staged_files_select, watermark_upsert)
+from conftest import BUCKET
+
+
+class _Cursor:
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.queries = []
+
+    def execute(self, query, params=None):
+        self.queries.append((query, params))
+
+    def executemany(self, query, params):
+        self.queries.append((query, list(params)))
+
+    def fetchall(self):
+        return self.rows
+
+
+def test_list_new_keys_skips_loaded_files(s3):
+    for key in ('log_data/a.json', 'log_data/b.json', 'log_data/c.json', 'log_data/_SUCCESS'):
+        s3.put_object(Bucket=BUCKET, Key=key, Body=b'{}')
+    cur = _Cursor([('s3://{}/log_data/b.json'.format(BUCKET),)])
+
+    keys = list_new_keys(cur, s3, 'events', 's3://{}/log_data'.format(BUCKET))
+
+    assert keys == ['s3://{}/log_data/a.json'.format(BUCKET), 's3://{}/log_data/c.json'.format(BUCKET)]
+    assert cur.queries == [(loaded_files_select, ('events',))]
+
+
+def test_record_full_load_replaces_the_files_of_each_source():
+    cur = _Cursor()
+
+    record_full_load(cur, {'events': ['s3://b/e.json'], 'songs': []})
+
+    assert cur.queries == [(watermark_upsert, None),
+                           (loaded_files_delete, ('events',)),
+                           (loaded_files_insert, [('events', 's3://b/e.json')]),
+                           (loaded_files_delete, ('songs',)),
+                           (loaded_files_insert, [])]
+
+
+def test_record_full_load_without_files_only_moves_the_watermark():
+    cur = _Cursor()
+
+    record_full_load(cur)
+
+    assert cur.queries == [(watermark_upsert, None)]
+
+
+def test_full_load_records_the_files_listed_by_its_staging_steps():
+    cur = _Cursor([('events', 's3://b/e1.json'), ('songs', 's3://b/s1.json'), ('events', 's3://b/e2.json')])
+
+    etl._record_load_state(cur, 'r1')
+
+    assert cur.queries[0] == (staged_files_select, ('r1',))
+    assert (loaded_files_insert, [('events', 's3://b/e1.json'), ('events', 's3://b/e2.json')]) in cur.queries
+    assert (loaded_files_insert, [('songs', 's3://b/s1.json')]) in cur.queries
+    assert cur.queries[-1] == (staged_files_delete, ('r1',))
+
+
+def test_staging_steps_record_the_files_they_load(s3, config):
+    s3.put_object(Bucket=BUCKET, Key='log_data/a.json', Body=b'{}')
+    s3.put_object(Bucket=BUCKET, Key='song_data/b.json', Body=b'{}')
+    cur = _Cursor()
+
+    etl._record_staged_keys(cur, 'r1', s3, config, sources=('songs',))
+
+    assert cur.queries == [(staged_files_insert, [('r1', 'songs', 's3://{}/song_data/b.json'.format(BUCKET))])]
@@ -0,0 +1,136 @@
+"""Tests of the statement log and the end of run report"""
+
+# Importing system libraries
+import contextlib
+import json
+
+import pytest
+
+# Importing user libraries
+import etl
+import instrumentation
+from instrumentation import StatementLog, _statement_name, add_bytes_scanned, get_statement_log, report
+
+
+class _Conn:
+    is_redshift = False
+
+    def __init__(self, scanned=()):
+        self.scanned = list(scanned)
+        self.queries = []
+        self.commits = 0
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, params=None):
+        self.queries.append((query, params))
+
+    def executemany(self, query, params):
+        self.queries.append((query, list(params)))
+
+    def fetchall(self):
+        return self.scanned
+
+    def close(self):
+        pass
+
+    def commit(self):
+        self.commits += 1
+
+
+def _record(statement, seconds, query_id=None):
+    return {'statement': statement, 'started_at': 0.0, 'seconds': seconds, 'rows': 1,
+            'query_id': query_id, 'error': None}
+
+
+@pytest.mark.parametrize('query, name', [
+    ("INSERT INTO users_dim\n (user_id) select 1", 'insert into users_dim'),
+    ("create table if not exists etl_checkpoints (run_id varchar)", 'create table if not exists etl_checkpoints'),
+    ("copy events_stg from 's3://b/log_data'", 'copy events_stg'),
+    ("set statement_timeout to 1000;", 'set statement_timeout to 1000;'),
+])
+def test_statement_names(query, name):
+    assert _statement_name(query) == name
+
+
+def test_statement_log_appends_json_lines(tmp_path):
+    path = str(tmp_path / 'statements.jsonl')
+    log = get_statement_log(path)
+
+    log.emit(_record('copy events_stg', 1.5))
+    log.emit(_record('insert into users_dim', 0.5))
+
+    assert get_statement_log(path) is log
+    with open(path) as f:
+        assert [json.loads(line)['statement'] for line in f] == ['copy events_stg', 'insert into users_dim']
+
+
+def test_bytes_scanned_are_added_per_query_id():
+    records = [_record('copy events_stg', 1.0, 11), _record('select 1', 0.1), _record('insert', 1.0, 12)]
+    conn = _Conn([(11, 2048)])
+
+    add_bytes_scanned(conn, records)
+
+    assert conn.queries[0][1] == ((11, 12),)
+    assert records[0]['bytes_scanned'] == 2048 and 'bytes_scanned' not in records[2]
+
+
+def test_report_writes_the_summary_table_when_enabled(config, tmp_path, capsys):
+    path = str(tmp_path / 'statements.jsonl')
+    config['LOG'] = {'STATEMENT_LOG': path, 'SUMMARY_TABLE': 'true'}
+    get_statement_log(path).emit(_record('copy events_stg', 1.0))
+    conn = _Conn()
+
+    records = report(config, conn, 'r1')
+
+    assert len(records) == 1 and 'copy events_stg' in capsys.readouterr().out
+    assert conn.queries[-1][1][0][:2] == ('r1', 'copy events_stg') and conn.commits == 1
+
+
+@pytest.mark.parametrize('summary_table', ['', 'false'])
+def test_report_skips_the_summary_table_unless_enabled(config, tmp_path, summary_table):
+    path = str(tmp_path / 'statements.jsonl')
+    config['LOG'] = {'STATEMENT_LOG': path, 'SUMMARY_TABLE': summary_table}
+    conn = _Conn()
+
+    report(config, conn, 'r1')
+
+    assert conn.queries == []
+
+
+def test_failed_loads_are_reported(monkeypatch):
+    events = []
+
+    class _Pool:
+        maxconn = 2
+
+        def __init__(self, config):
+            pass
+
+        def getconn(self):
+            return _Conn()
+
+        def putconn(self, conn, close=False):
+            events.append('putconn')
+
+        @contextlib.contextmanager
+        def connection(self):
+            yield _Conn()
+
+        def closeall(self):
+            events.append('closeall')
+
+    def _fail(*args):
+        raise RuntimeError("COPY failed")
+
+    monkeypatch.setattr(etl, 'ConnectionPool', _Pool)
+    monkeypatch.setattr(etl, 's3_client', lambda config: None)
+    monkeypatch.setattr(etl, 'load_incremental', _fail)
+    monkeypatch.setattr(instrumentation, 'report', lambda config, conn, run_id: events.append('report'))
+
+    with pytest.raises(SystemExit) as exit_info:
+        etl.main(incremental=True)
+
+    assert exit_info.value.code == 1
+    assert events == ['putconn', 'report', 'closeall']
@@ -0,0 +1,57 @@
+"""Tests of the local json parsing and chunked COPY FROM STDIN"""
+
+# Importing system libraries
+import json
+
+import pytest
+
+# Importing user libraries
+from local_loader import copy_rows, iter_files, iter_rows, parse_jsonpaths
+
+
+class _Cursor:
+    def __init__(self):
+        self.copies = []
+
+    def copy_expert(self, query, buffer):
+        self.copies.append((query, buffer.read()))
+
+
+def test_parse_jsonpaths_accepts_both_notations():
+    assert parse_jsonpaths(["$['firstName']", '$["song"]', '$.artist.name']) == [
+        ('firstName',), ('song',), ('artist', 'name')]
+
+
+def test_parse_jsonpaths_rejects_other_expressions():
+    with pytest.raises(ValueError):
+        parse_jsonpaths(["firstName"])
+
+
+def test_iter_rows_reads_documents_and_json_lines(tmp_path):
+    (tmp_path / 'b').mkdir()
+    (tmp_path / 'a.json').write_text(json.dumps({'song': 'x', 'artist': {'name': 'y'}}))
+    (tmp_path / 'b' / 'c.json').write_text('{"song": "z"}\n\n{"artist": {"name": "w"}}\n')
+    (tmp_path / 'notes.txt').write_text('skipped')
+
+    files = list(iter_files(str(tmp_path)))
+    rows = list(iter_rows(files, parse_jsonpaths(['$.song', '$.artist.name'])))
+
+    assert [path[len(str(tmp_path)):] for path in files] == ['/a.json', '/b/c.json']
+    assert rows == [('x', 'y'), ('z', None), (None, 'w')]
+
+
+def test_copy_rows_sends_bounded_chunks():
+    cur = _Cursor()
+
+    total = copy_rows(cur, 'events_stg', ['song', 'ts'], [('a', 1), ('b,c', 2), (None, 3)], chunk_rows=2)
+
+    assert total == 3
+    assert cur.copies == [("copy events_stg (song, ts) from stdin with csv", 'a,1\r\n"b,c",2\r\n'),
+                          ("copy events_stg (song, ts) from stdin with csv", ',3\r\n')]
+
+
+def test_copy_rows_without_rows_sends_nothing():
+    cur = _Cursor()
+
+    assert copy_rows(cur, 'songs_stg', ['song_id'], []) == 0
+    assert cur.copies == []
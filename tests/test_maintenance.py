@@ -0,0 +1,30 @@
+"""Tests of the VACUUM/ANALYZE plan"""
+
+# Importing user libraries
+from maintenance import plan_maintenance
+
+STATS = {
+    'songs_dim': {'rows': 100, 'unsorted': 5.0, 'stats_off': 30.0},
+    'songs_plays_fact': {'rows': 1000, 'unsorted': 60.0, 'stats_off': 15.0},
+    'users_dim': {'rows': 10, 'unsorted': 1.0, 'stats_off': 2.0},
+    'time_dim': {'rows': 0, 'unsorted': 90.0, 'stats_off': 90.0},
+}
+
+
+def test_furthest_above_threshold_first_vacuum_before_analyze():
+    assert plan_maintenance(STATS, unsorted_pct=10, stats_off_pct=10) == [
+        ('songs_plays_fact', "vacuum sort only songs_plays_fact;"),
+        ('songs_plays_fact', "analyze songs_plays_fact;"),
+        ('songs_dim', "analyze songs_dim;"),
+    ]
+
+
+def test_empty_and_fresh_tables_are_skipped():
+    assert plan_maintenance(STATS, unsorted_pct=95, stats_off_pct=95) == []
+
+
+def test_postgres_statements():
+    assert plan_maintenance(STATS, unsorted_pct=10, stats_off_pct=20, redshift=False) == [
+        ('songs_plays_fact', "vacuum songs_plays_fact;"),
+        ('songs_dim', "analyze songs_dim;"),
+    ]
@@ -0,0 +1,50 @@
+"""Tests of the step selection, statement splitting and EXPLAIN parsing"""
+
+# Importing system libraries
+import pytest
+
+# Importing user libraries
+from pipeline import ALIASES, parse_plan, select_steps, split_statements
+
+
+def test_select_steps_keeps_load_order():
+    assert select_steps(['copy', 'create']) == ['create', 'copy']
+    assert select_steps(['all']) == ALIASES['all']
+    assert select_steps(['inserts', 'inserts']) == ALIASES['inserts']
+
+
+def test_select_steps_rejects_unknown_steps():
+    with pytest.raises(ValueError):
+        select_steps(['vacuum'])
+
+
+def test_split_statements_ignores_semicolons_in_literals():
+    query = "delete from t where a = 'x;y';\n insert into t values ('it''s; fine');  ;"
+
+    assert split_statements(query) == ["delete from t where a = 'x;y'",
+                                       "insert into t values ('it''s; fine')"]
+
+
+def test_parse_plan_reports_joins_and_redistribution():
+    plan = [
+        "XN Hash Join DS_BCAST_INNER  (cost=112.50..3000120.75 rows=100 width=80)",
+        "  Hash Cond: (\"outer\".song_id = \"inner\".song_id)",
+        "  ->  XN Hash Join DS_DIST_NONE  (cost=0.05..20.10 rows=10 width=40)",
+        "  ->  XN Network  (cost=0.00..10.00 rows=5 width=20)",
+        "        Distribute",
+        "        ->  XN Seq Scan on songs_stg  (cost=0.00..1.00 rows=5 width=20)",
+    ]
+
+    result = parse_plan(plan)
+
+    assert result['cost'] == 3000120.75
+    assert result['joins'] == ['XN Hash Join DS_BCAST_INNER', 'XN Hash Join DS_DIST_NONE']
+    assert result['redistribution'] == ['DS_BCAST_INNER', 'XN Network Distribute']
+    assert result['flagged'] == ['DS_BCAST_INNER']
+
+
+def test_parse_plan_of_a_postgres_plan():
+    plan = ["Hash Join  (cost=1.09..2.20 rows=4 width=8)",
+            "  ->  Seq Scan on t  (cost=0.00..1.04 rows=4 width=8)"]
+
+    assert parse_plan(plan) == {'cost': 2.2, 'joins': ['Hash Join'], 'redistribution': [], 'flagged': []}
@@ -0,0 +1,52 @@
+"""Tests of the record checks run before COPY"""
+
+# Importing system libraries
+import pytest
+
+# Importing user libraries
+from preflight import _validate_text, check_record, column_rules
+
+RULES = column_rules("""create table t
+(
+ name      varchar(5),
+ code      char(1),
+ hits      smallint,
+ total     bigint,
+ length    real
+);""")
+
+
+def test_column_rules():
+    assert RULES == [('name', 'string', 5), ('code', 'string', 1), ('hits', 'integer', (-32768, 32767)),
+                     ('total', 'integer', (-2 ** 63, 2 ** 63 - 1)), ('length', 'number', None)]
+
+
+@pytest.mark.parametrize('values', [
+    ('abc', 'F', 12, 10 ** 12, 1.5),
+    ('abcde', None, '7', '', '2.5'),
+    (None, None, None, None, None),
+])
+def test_valid_records(values):
+    assert check_record(values, RULES) is None
+
+
+@pytest.mark.parametrize('values, error', [
+    (('abcdef',), 'name is 6 bytes, longer than 5'),
+    (('äöü',), 'name is 6 bytes, longer than 5'),
+    ((None, None, 40000), 'hits out of range: 40000'),
+    ((None, None, 1.5), 'hits out of range: 1.5'),
+    ((None, None, 'x'), "hits is not a number: 'x'"),
+    ((None, None, None, None, float('nan')), 'length is not a finite number: nan'),
+    ((None, None, None, None, 'Infinity'), "length is not a finite number: 'Infinity'"),
+    ((None, None, None, 10 ** 400), 'total is not a number'),
+    ((None, None, [1, 2]), 'hits is not a number: [1, 2]'),
+])
+def test_bad_records(values, error):
+    assert check_record(values, RULES).startswith(error)
+
+
+def test_non_object_records_are_bad():
+    records, errors = _validate_text('[1, 2]', [['name']], RULES[:1])
+
+    assert records == 1
+    assert errors == ['record 1: not a json object: list']
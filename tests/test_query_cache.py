@@ -0,0 +1,83 @@
+"""Tests of the cache keys and the per load invalidation of cached results"""
+
+# Importing system libraries
+import datetime
+import os
+
+# Importing user libraries
+from query_cache import QueryCache, normalize_sql
+from sql_queries import load_generation_select
+
+
+class _Conn:
+    """Connection answering the load generation lookup and one result set."""
+
+    closed = 0
+
+    def __init__(self):
+        self.loaded_at = datetime.datetime(2026, 10, 1, 12, 0)
+        self.queries = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, params=None):
+        self.query = query
+        if query != load_generation_select:
+            self.queries.append((query, params))
+        self.description = [('song',), ('plays',)]
+
+    def fetchone(self):
+        return (self.loaded_at,)
+
+    def fetchall(self):
+        return [('a', 3), ('b', 1)]
+
+    def close(self):
+        pass
+
+
+def _cache(tmp_path, config):
+    cache = QueryCache(config, directory=str(tmp_path), check_seconds=0)
+    cache._conn = _Conn()
+    return cache
+
+
+def test_normalize_sql_keeps_literals():
+    assert (normalize_sql("SELECT  song\n FROM songs_dim WHERE title = 'Hey  Jude';")
+            == "select song from songs_dim where title = 'Hey  Jude'")
+    assert normalize_sql("select 'it''s  A'") == "select 'it''s  A'"
+
+
+def test_formatting_does_not_split_the_cache(tmp_path, config):
+    cache = _cache(tmp_path, config)
+
+    assert cache.path("select 1;", generation='g') == cache.path("SELECT\n 1", generation='g')
+    assert cache.path("select 1", (1,), generation='g') != cache.path("select 1", (2,), generation='g')
+
+
+def test_results_are_cached_until_the_next_load(tmp_path, config):
+    cache = _cache(tmp_path, config)
+    conn = cache._conn
+
+    first = cache.query("select song, plays from top_songs")
+    second = cache.query("select song, plays from top_songs")
+
+    assert first.to_pydict() == second.to_pydict() == {'song': ['a', 'b'], 'plays': [3, 1]}
+    assert len(conn.queries) == 1
+
+    conn.loaded_at = datetime.datetime(2026, 10, 2, 12, 0)
+    cache.query("select song, plays from top_songs")
+
+    assert len(conn.queries) == 2
+    # The results of the older load are removed, other files are left alone
+    assert sorted(os.listdir(str(tmp_path))) == ['20261002120000000000', 'dwh.cfg']
+
+
+def test_refresh_runs_the_query_again(tmp_path, config):
+    cache = _cache(tmp_path, config)
+
+    cache.query("select 1")
+    cache.query("select 1", refresh=True)
+
+    assert len(cache._conn.queries) == 2
@@ -0,0 +1,204 @@
+"""Tests of the ClusterManager capacity operations against stubbed clients"""
+
+# Importing system libraries
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+# Importing user libraries
+import redshift_cluster
+from redshift_cluster import ClusterManager
+from conftest import BUCKET
+
+
+def _cluster(status='available', nodes=2):
+    return {'Clusters': [{'ClusterIdentifier': 'sparkify', 'ClusterStatus': status, 'NumberOfNodes': nodes}]}
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(redshift_cluster.time, 'sleep', lambda seconds: None)
+
+
+@pytest.fixture
+def redshift():
+    client = boto3.client('redshift', region_name='us-west-2')
+    with Stubber(client) as stubber:
+        yield client, stubber
+        stubber.assert_no_pending_responses()
+
+
+def _manager(config_file, redshift, **clients):
+    return ClusterManager(config_file, clients=dict(clients, redshift=redshift[0]))
+
+
+def _describe(stubber, status='available', nodes=2):
+    stubber.add_response('describe_clusters', _cluster(status, nodes), {'ClusterIdentifier': 'sparkify'})
+
+
+def _resize(stubber, before, after):
+    _describe(stubber, nodes=before)
+    stubber.add_response('resize_cluster', {},
+                         {'ClusterIdentifier': 'sparkify', 'NumberOfNodes': after, 'Classic': False})
+    _describe(stubber, 'resizing', before)
+    _describe(stubber, nodes=after)
+
+
+def test_resize_waits_for_the_new_node_count(config_file, redshift):
+    _resize(redshift[1], 2, 4)
+
+    props = _manager(config_file, redshift).resize_cluster(4)
+
+    assert props['NumberOfNodes'] == 4
+
+
+def test_resize_to_the_current_size_does_nothing(config_file, redshift):
+    _describe(redshift[1], nodes=4)
+
+    assert _manager(config_file, redshift).resize_cluster(4)['NumberOfNodes'] == 4
+
+
+def test_pause_and_resume(config_file, redshift):
+    stubber = redshift[1]
+    _describe(stubber)
+    stubber.add_response('pause_cluster', {}, {'ClusterIdentifier': 'sparkify'})
+    _describe(stubber, 'pausing')
+    _describe(stubber, 'paused')
+    _describe(stubber, 'paused')
+    stubber.add_response('resume_cluster', {}, {'ClusterIdentifier': 'sparkify'})
+    _describe(stubber)
+
+    manager = _manager(config_file, redshift)
+    assert manager.pause_cluster()['ClusterStatus'] == 'paused'
+    assert manager.resume_cluster()['ClusterStatus'] == 'available'
+
+
+def test_pause_of_a_paused_cluster_does_nothing(config_file, redshift):
+    _describe(redshift[1], 'paused')
+
+    assert _manager(config_file, redshift).pause_cluster()['ClusterStatus'] == 'paused'
+
+
+def test_capacity_window_scales_back_and_pauses(config_file, redshift):
+    stubber = redshift[1]
+    _describe(stubber)                  # resume, already available
+    _describe(stubber)                  # original size
+    _resize(stubber, 2, 6)
+    _resize(stubber, 6, 2)
+    _describe(stubber)
+    stubber.add_response('pause_cluster', {}, {'ClusterIdentifier': 'sparkify'})
+    _describe(stubber, 'paused')
+
+    with _manager(config_file, redshift).capacity_window(6, pause_after=True) as props:
+        assert props['NumberOfNodes'] == 6
+
+
+def test_capacity_window_scales_back_when_the_load_fails(config_file, redshift):
+    stubber = redshift[1]
+    _describe(stubber)
+    _describe(stubber)
+    _resize(stubber, 2, 6)
+    _resize(stubber, 6, 2)
+
+    with pytest.raises(RuntimeError):
+        with _manager(config_file, redshift).capacity_window(6):
+            raise RuntimeError("load failed")
+
+
+def test_capacity_window_without_resize_only_pauses(config_file, redshift):
+    stubber = redshift[1]
+    _describe(stubber)
+    _describe(stubber)
+    _describe(stubber)
+    stubber.add_response('pause_cluster', {}, {'ClusterIdentifier': 'sparkify'})
+    _describe(stubber, 'paused')
+
+    with _manager(config_file, redshift).capacity_window(pause_after=True, resize=False) as props:
+        assert props['NumberOfNodes'] == 2
+
+
+def test_capacity_window_estimates_from_the_files_not_loaded(config_file, redshift, s3):
+    for i in range(5):
+        s3.put_object(Bucket=BUCKET, Key='log_data/{}.json'.format(i), Body=b'x' * 10)
+    stubber = redshift[1]
+    _describe(stubber)
+    _describe(stubber)
+    _describe(stubber, nodes=2)         # estimated size is the MIN_NODES the cluster has
+    _describe(stubber)
+    loaded = {'s3://{}/log_data/{}.json'.format(BUCKET, i) for i in range(4)}
+
+    manager = _manager(config_file, redshift, s3=s3)
+    with manager.capacity_window(loaded=lambda: loaded) as props:
+        assert props['NumberOfNodes'] == 2
+    assert manager.input_bytes(loaded) == 10
+    assert manager.input_bytes() == 50
+
+
+@pytest.mark.parametrize('input_bytes, nodes', [(0, 2), (3.5e9, 4), (100e9, 8)])
+def test_estimate_nodes_is_bounded(config_file, input_bytes, nodes):
+    assert ClusterManager(config_file).estimate_nodes(input_bytes) == nodes
+
+
+def test_schedule_pause_resume_replaces_missing_actions(config_file, redshift):
+    stubber = redshift[1]
+    for action, schedule in (('Pause', 'cron(0 20 * * ? *)'), ('Resume', 'cron(0 6 * * ? *)')):
+        name = 'sparkify-' + action.lower()
+        stubber.add_client_error('delete_scheduled_action', 'ScheduledActionNotFound',
+                                 expected_params={'ScheduledActionName': name})
+        stubber.add_response('create_scheduled_action', {},
+                             {'ScheduledActionName': name,
+                              'TargetAction': {action + 'Cluster': {'ClusterIdentifier': 'sparkify'}},
+                              'Schedule': schedule, 'IamRole': 'arn:role', 'Enable': True})
+
+    _manager(config_file, redshift).schedule_pause_resume('cron(0 20 * * ? *)', 'cron(0 6 * * ? *)',
+                                                          'arn:role')
+
+
+def test_schedule_pause_resume_raises_other_errors(config_file, redshift):
+    redshift[1].add_client_error('delete_scheduled_action', 'UnauthorizedOperation')
+
+    with pytest.raises(redshift[0].exceptions.UnauthorizedOperation):
+        _manager(config_file, redshift).schedule_pause_resume('cron(0 20 * * ? *)', 'cron(0 6 * * ? *)',
+                                                              'arn:role')
+
+
+def _create_params():
+    return {'ClusterType': 'multi-node', 'NodeType': 'dc2.large', 'NumberOfNodes': 2, 'DBName': 'sparkifydb',
+            'ClusterIdentifier': 'sparkify', 'MasterUsername': 'sparkifydb', 'MasterUserPassword': 'Passw0rd',
+            'IamRoles': []}
+
+
+def test_create_keeps_an_existing_cluster(config_file, redshift):
+    redshift[1].add_client_error('create_cluster', 'ClusterAlreadyExists', expected_params=_create_params())
+
+    _manager(config_file, redshift).create_redshift_cluster()
+
+
+def test_create_raises_when_the_cluster_is_not_created(config_file, redshift):
+    redshift[1].add_client_error('create_cluster', 'InsufficientClusterCapacity', expected_params=_create_params())
+
+    with pytest.raises(redshift[0].exceptions.InsufficientClusterCapacityFault):
+        _manager(config_file, redshift).create_redshift_cluster()
+
+
+def test_write_cluster_config_keeps_crlf_line_endings(tmp_path):
+    config_file = tmp_path / 'dwh.cfg'
+    config_file.write_bytes(b'[DB]\r\n# endpoint\r\nHOST=\r\n[IAM_ROLE]\r\nARN=\r\n')
+
+    redshift_cluster.write_cluster_config('sparkify.example.com', 'arn:role', str(config_file))
+
+    assert config_file.read_bytes() == (b'[DB]\r\n# endpoint\r\nHOST=sparkify.example.com\r\n'
+                                        b'[IAM_ROLE]\r\nARN=arn:role\r\n')
+
+
+def test_provision_reloads_the_written_config(config_file, redshift, monkeypatch):
+    redshift[1].add_response('modify_cluster_iam_roles', {},
+                             {'ClusterIdentifier': 'sparkify', 'AddIamRoles': ['arn:new']})
+    manager = _manager(config_file, redshift, iam=boto3.client('iam', region_name='us-west-2'))
+    monkeypatch.setattr(manager, 'create_iam_role', lambda: 'arn:new')
+    monkeypatch.setattr(manager, 'create_redshift_cluster', lambda: None)
+    monkeypatch.setattr(manager, 'wait_for_cluster', lambda **kwargs: {'Endpoint': {'Address': 'host'}})
+
+    manager.provision_cluster()
+
+    assert manager.config.get('IAM_ROLE', 'ARN') == 'arn:new'
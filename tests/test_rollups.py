@@ -0,0 +1,78 @@
+"""Tests of the rollup merge statements and the refresh decisions"""
+
+# Importing system libraries
+import sqlite3
+
+# Importing user libraries
+from rollups import refresh_rollups, rollup_statements
+from sql_queries import (rollup_staged_songplays, rollup_tables, rollup_watermark_insert,
+                         staged_events_max_ts_select, watermark_select)
+
+
+def test_merge_adds_up_existing_days_and_inserts_new_ones():
+    db = sqlite3.connect(':memory:')
+    db.execute("create table daily_artist_plays (play_date, artist_id, plays)")
+    db.execute("create table plays (play_date, artist_id)")
+    db.executemany("insert into daily_artist_plays values (?, ?, ?)", [('2026-10-01', 'A1', 5)])
+    db.executemany("insert into plays values (?, ?)",
+                   [('2026-10-01', 'A1'), ('2026-10-01', 'A1'), ('2026-10-02', 'A1'), ('2026-10-01', 'A2')])
+    # Same shape as daily_artist_plays_delta without the Redshift date cast
+    delta = "select play_date, artist_id, count(*) as plays from {songplays} p group by 1, 2"
+
+    for statement in rollup_statements('daily_artist_plays', ['play_date', 'artist_id'], delta, 'plays'):
+        db.execute(statement)
+
+    assert sorted(db.execute("select * from daily_artist_plays").fetchall()) == [
+        ('2026-10-01', 'A1', 7), ('2026-10-01', 'A2', 1), ('2026-10-02', 'A1', 1)]
+
+
+class _Cursor:
+    def __init__(self, watermark, latest):
+        self.results = {watermark_select: (watermark,) if watermark is not None else None,
+                        staged_events_max_ts_select: (latest,)}
+        self.queries = []
+
+    def execute(self, query, params=None):
+        self.queries.append((query, params))
+
+    def fetchone(self):
+        return self.results[self.queries[-1][0]]
+
+
+def test_without_watermark_the_rollups_are_rebuilt_from_the_fact_table():
+    cur = _Cursor(None, 200)
+
+    result = refresh_rollups(cur)
+
+    assert result['rebuilt']
+    assert ("delete from daily_song_plays;", None) in cur.queries
+    assert any('from songs_plays_fact p' in query for query, _ in cur.queries)
+    assert cur.queries[-1] == (rollup_watermark_insert, (200,))
+
+
+def test_only_the_staged_songplays_above_the_watermark_are_added():
+    cur = _Cursor(100, 200)
+
+    result = refresh_rollups(cur)
+
+    deltas = [(query, params) for query, params in cur.queries if query.startswith('create temp table')]
+    assert not result['rebuilt'] and len(deltas) == len(rollup_tables)
+    assert all(rollup_staged_songplays in query and params == (100,) for query, params in deltas)
+    assert cur.queries[-1] == (rollup_watermark_insert, (200,))
+
+
+def test_nothing_is_merged_without_newer_events():
+    cur = _Cursor(200, 200)
+
+    refresh_rollups(cur)
+
+    assert [query for query, _ in cur.queries] == [watermark_select, staged_events_max_ts_select]
+
+
+def test_statements_are_rewritten():
+    cur = _Cursor(100, 200)
+
+    refresh_rollups(cur, rewrite=lambda query: query.replace('rollup_delta', 'rollup_delta_pg'))
+
+    merges = [query for query, _ in cur.queries if 'rollup_delta' in query]
+    assert merges and all('rollup_delta_pg' in query for query in merges)
@@ -0,0 +1,25 @@
+"""Tests of the CREATE TABLE parser"""
+
+# Importing user libraries
+from schema_advisor import parse_create
+from sql_queries import create_table_queries
+
+
+def test_columns_and_table_attributes():
+    query = """CREATE TABLE IF NOT EXISTS plays
+    (
+     play_id    bigint identity(0,1) primary key,
+     amount     numeric(10, 2) not null,
+     name       varchar(255)
+    )
+    diststyle key distkey(play_id) sortkey (play_id, name);"""
+
+    assert parse_create(query) == ('plays', [('play_id', 'bigint', 'identity(0,1) primary key'),
+                                             ('amount', 'numeric(10, 2)', 'not null'),
+                                             ('name', 'varchar(255)', '')])
+
+
+def test_every_create_statement_parses():
+    for query in create_table_queries:
+        table, columns = parse_create(query)
+        assert table and columns
@@ -0,0 +1,71 @@
+"""Tests of the song lookup key joining events to songs
+
+fnv_hash is registered as a Python function on an in-memory SQLite
+database, the rest of the key expressions is standard SQL.
+"""
+
+# Importing system libraries
+import sqlite3
+import zlib
+
+import pytest
+
+# Importing user libraries
+from schema_advisor import JOIN_COLUMNS, parse_create, recommend
+from sql_queries import create_table_queries, song_key_match, song_lookup_insert
+
+
+@pytest.fixture
+def db():
+    conn = sqlite3.connect(':memory:')
+    conn.create_function('fnv_hash', 2, lambda value, seed: zlib.crc32(value.encode()))
+    for query in create_table_queries:
+        table, columns = parse_create(query)
+        if table in ('events_stg', 'songs_dim', 'artists_dim', 'song_lookup'):
+            conn.execute("create table {} ({})".format(table, ', '.join(name for name, _, _ in columns)))
+    yield conn
+    conn.close()
+
+
+def _matches(db):
+    db.executescript(song_lookup_insert)
+    return db.execute("select e.song, l.song_id from events_stg e join song_lookup l on ({})"
+                      .format(song_key_match)).fetchall()
+
+
+def test_events_match_songs_regardless_of_case_blanks_and_length_noise(db):
+    db.execute("insert into songs_dim (song_id, title, artist_id, duration) values ('S1', 'Hey Jude', 'A1', 431.04)")
+    db.execute("insert into artists_dim (artist_id, name) values ('A1', 'The Beatles')")
+    db.execute("insert into events_stg (song, artist, length) values (' hey jude', 'THE BEATLES ', 431.02)")
+    db.execute("insert into events_stg (song, artist, length) values ('Hey Jude', 'The Beatles', 245.5)")
+
+    assert _matches(db) == [(' hey jude', 'S1')]
+
+
+def test_lookup_is_rebuilt_from_the_dimensions(db):
+    db.execute("insert into song_lookup values (1, 'S0', 'A0')")
+    db.execute("insert into songs_dim (song_id, title, artist_id, duration) values ('S1', 'Help', 'A1', 138.0)")
+    db.execute("insert into artists_dim (artist_id, name) values ('A1', 'The Beatles')")
+
+    db.executescript(song_lookup_insert)
+
+    assert db.execute("select song_id, artist_id from song_lookup").fetchall() == [('S1', 'A1')]
+
+
+def test_join_columns_are_columns_of_their_tables():
+    columns = {table: [name for name, _, _ in cols] for table, cols in map(parse_create, create_table_queries)}
+
+    for table, names in JOIN_COLUMNS.items():
+        assert set(names) <= set(columns[table]), table
+
+
+def test_large_fact_table_is_distributed_on_an_even_join_key():
+    table, columns = next(parse_create(query) for query in create_table_queries
+                          if parse_create(query)[0] == 'songs_plays_fact')
+    profile = {'rows': 10 ** 7, 'columns': {name: {'distinct': 10 ** 5, 'nulls': 0, 'top_share': None}
+                                            for name, _, _ in columns}}
+    profile['columns']['song_id']['top_share'] = 0.001
+
+    advice = recommend(table, columns, profile, slices=4)
+
+    assert (advice['diststyle'], advice['distkey'], advice['sortkey']) == ('key', 'song_id', 'start_time')
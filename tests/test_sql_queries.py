@@ -0,0 +1,28 @@
+"""Tests of the configuration dependent statement templates"""
+
+# Importing system libraries
+import pytest
+
+# Importing user libraries
+from sql_queries import get_copy_table_queries, render_statement
+
+
+def test_copy_statements_are_rendered_from_the_config(config):
+    events, songs = get_copy_table_queries(config)
+
+    assert "copy events_stg from s3://sparkify-test/log_data" in events
+    assert "copy songs_stg from s3://sparkify-test/song_data" in songs
+    assert "arn:aws:iam::123456789012:role/sparkify" in events and 'maxerror 0' in events
+
+
+def test_missing_required_options_are_reported(config):
+    config.set('IAM_ROLE', 'ARN', '')
+    config.remove_option('S3', 'SONG_DATA')
+
+    with pytest.raises(ValueError, match=r"\[S3\] SONG_DATA, \[IAM_ROLE\] ARN not set"):
+        render_statement('staging_songs_copy', config)
+
+
+def test_missing_config_file_is_reported(tmp_path):
+    with pytest.raises(ValueError, match="not set in .*missing.cfg"):
+        get_copy_table_queries(str(tmp_path / 'missing.cfg'))
@@ -0,0 +1,93 @@
+"""Tests of the slice balanced batches and COPY manifests"""
+
+# Importing system libraries
+import gzip
+import json
+
+# Importing user libraries
+from staging_loader import balance_batches, list_objects, load_staging_tables, write_manifest
+from conftest import BUCKET
+
+
+def test_balance_batches_evens_out_sizes():
+    objects = [('s3://b/{}.json'.format(size), size) for size in (90, 50, 40, 30, 20, 10, 10)]
+
+    batches = balance_batches(objects, 2)
+
+    sizes = dict(objects)
+    assert sorted(sum(sizes[uri] for uri in batch) for batch in batches) == [120, 130]
+    assert sorted(uri for batch in batches for uri in batch) == sorted(uri for uri, _ in objects)
+
+
+def test_balance_batches_drops_empty_batches():
+    assert balance_batches([('s3://b/a.json', 1)], 4) == [['s3://b/a.json']]
+    assert balance_batches([], 4) == []
+    assert balance_batches([('s3://b/a.json', 1)], 0) == [['s3://b/a.json']]
+
+
+def test_list_objects_only_lists_json(s3):
+    s3.put_object(Bucket=BUCKET, Key='log_data/2018/a.json', Body=b'{}')
+    s3.put_object(Bucket=BUCKET, Key='log_data/2018/_SUCCESS', Body=b'')
+    s3.put_object(Bucket=BUCKET, Key='song_data/b.json', Body=b'{}')
+
+    assert list_objects(s3, 's3://{}/log_data'.format(BUCKET)) == [
+        ('s3://{}/log_data/2018/a.json'.format(BUCKET), 2)]
+
+
+def test_write_manifest_lists_mandatory_entries(s3):
+    files = ['s3://{}/log_data/a.json'.format(BUCKET), 's3://{}/log_data/b.json'.format(BUCKET)]
+
+    uri = write_manifest(s3, 's3://{}/manifests/events_stg.manifest'.format(BUCKET), files)
+
+    assert uri == 's3://{}/manifests/events_stg.manifest'.format(BUCKET)
+    body = s3.get_object(Bucket=BUCKET, Key='manifests/events_stg.manifest')['Body'].read()
+    assert json.loads(body) == {'entries': [{'url': files[0], 'mandatory': True},
+                                            {'url': files[1], 'mandatory': True}]}
+
+
+class _Cursor:
+    def __init__(self):
+        self.queries = []
+
+    def execute(self, query):
+        self.queries.append(query)
+
+
+def _put_sources(s3):
+    for i, size in enumerate((40, 30, 20, 10)):
+        record = json.dumps({'song_id': 'S{}'.format(i), 'pad': 'x' * size})
+        s3.put_object(Bucket=BUCKET, Key='song_data/{}.json'.format(i), Body=record.encode('utf-8'))
+
+
+def _manifest_urls(s3, table):
+    body = s3.get_object(Bucket=BUCKET, Key='manifests/{}.manifest'.format(table))['Body'].read()
+    return [entry['url'] for entry in json.loads(body)['entries']]
+
+
+def test_manifest_mode_lists_the_source_files(s3, config):
+    _put_sources(s3)
+    excluded = 's3://{}/song_data/1.json'.format(BUCKET)
+    cur = _Cursor()
+
+    loaded = load_staging_tables(cur, None, s3, config, exclude={excluded})
+
+    assert loaded == {'events_stg': 0, 'songs_stg': 3}
+    assert _manifest_urls(s3, 'songs_stg') == ['s3://{}/song_data/{}.json'.format(BUCKET, i) for i in (0, 2, 3)]
+    assert len(cur.queries) == 1 and 'gzip' not in cur.queries[0]
+
+
+def test_compact_mode_writes_one_file_per_slice(s3, config):
+    _put_sources(s3)
+    cur = _Cursor()
+
+    loaded = load_staging_tables(cur, None, s3, config, compact=True)
+
+    # dc2.large with 2 nodes has 4 slices
+    assert loaded == {'events_stg': 0, 'songs_stg': 4}
+    songs = set()
+    for url in _manifest_urls(s3, 'songs_stg'):
+        key = url.split('/', 3)[3]
+        body = gzip.decompress(s3.get_object(Bucket=BUCKET, Key=key)['Body'].read())
+        songs.update(json.loads(line)['song_id'] for line in body.splitlines())
+    assert songs == {'S0', 'S1', 'S2', 'S3'}
+    assert 'gzip' in cur.queries[0]
@@ -0,0 +1,71 @@
+"""Tests of the shadow table rewrites and the swap transaction"""
+
+# Importing system libraries
+import pytest
+
+# Importing user libraries
+from table_swap import shadow_nodes, shadow_statement, swap_tables
+
+
+class _Conn:
+    def __init__(self):
+        self.autocommit = True
+        self.queries = []
+        self.events = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, params=None):
+        self.queries.append(query)
+
+    def fetchone(self):
+        return (1,)
+
+    def commit(self):
+        self.events.append(('commit', len(self.queries)))
+
+    def rollback(self):
+        self.events.append(('rollback', len(self.queries)))
+
+
+def test_shadow_statement_renames_whole_table_names_only():
+    query = ("insert into users_dim select * from events_stg e "
+             "join songs_dim s on s.song_id = e.song_id join songs_dim_history h on true")
+
+    assert shadow_statement(query) == ("insert into users_dim_new select * from events_stg e "
+                                       "join songs_dim_new s on s.song_id = e.song_id "
+                                       "join songs_dim_history h on true")
+
+
+def test_shadow_nodes_rename_the_production_tables():
+    nodes = [('song_table_insert', 'insert into songs_dim select 1 from songs_stg', ['songs_stg'], ['songs_dim'])]
+
+    assert shadow_nodes(nodes) == [('song_table_insert', 'insert into songs_dim_new select 1 from songs_stg',
+                                    ['songs_stg'], ['songs_dim_new'])]
+
+
+def test_append_inserts_new_songplays_without_their_ids_in_the_swap_transaction():
+    conn = _Conn()
+
+    swap_tables(conn, conn, append_fact=True)
+
+    append = conn.queries[0]
+    assert append.startswith("insert into songs_plays_fact (start_time, ")
+    assert 'songplay_id' not in append and 'from songs_plays_fact_new where start_time >' in append
+    renamed = [query for query in conn.queries if 'rename' in query]
+    assert 'alter table songs_plays_fact rename to songs_plays_fact_old;' not in renamed
+    assert 'alter table users_dim_new rename to users_dim;' in renamed
+    # The append and every rename are committed together
+    swap_commit = conn.events[0][1]
+    assert conn.queries.index(renamed[-1]) < swap_commit
+    assert conn.queries[-1] == 'drop table if exists songs_plays_fact_new;'
+    assert conn.autocommit
+
+
+def test_swap_needs_an_autocommit_connection():
+    conn = _Conn()
+    conn.autocommit = False
+
+    with pytest.raises(ValueError):
+        swap_tables(conn, conn)
@@ -0,0 +1,35 @@
+"""Tests of the one pass time_dim load"""
+
+# Importing system libraries
+import re
+
+# Importing user libraries
+from pg_compat import to_postgres
+from schema_advisor import parse_create
+from sql_queries import time_table_create, time_table_insert
+
+_EPOCH = "TIMESTAMP 'epoch' + ts/1000 *INTERVAL '1 second'"
+
+
+def test_timestamps_are_converted_once_per_distinct_ts():
+    assert time_table_insert.count(_EPOCH) == 1
+    assert re.search(r"select distinct " + re.escape(_EPOCH) + r" as start_time\s+from events_stg\s+"
+                     r"where page = 'NextSong'", time_table_insert)
+
+
+def test_every_part_is_extracted_from_the_converted_timestamp():
+    _, columns = parse_create(time_table_create)
+    parts = re.findall(r'extract\((\w+) from t\.start_time\)', time_table_insert)
+
+    assert parts == [name for name, _, _ in columns if name != 'start_time']
+
+
+def test_only_new_timestamps_are_inserted():
+    assert re.search(r'where not exists \(select 1\s+from time_dim d\s+where d\.start_time = t\.start_time\)',
+                     time_table_insert)
+
+
+def test_weekday_is_rewritten_for_postgres():
+    query = to_postgres(time_table_insert)
+
+    assert 'extract(dow from t.start_time)' in query and 'extract(weekday' not in query